@@ -31,6 +31,14 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 app.config["UPLOAD_FOLDER"] = "uploads"
 app.config["MAX_CONTENT_LENGTH"] = 100 * 1024 * 1024  # 100MB max file size
 
+# Background mastering workers per web process
+app.config["MASTERING_WORKERS"] = int(os.environ.get("MASTERING_WORKERS", 2))
+
+# Uploaded-audio video renders running at once across all web processes (each process runs up to that
+# many render threads), and how many may wait before uploads get 429
+app.config["VIDEO_RENDER_WORKERS"] = int(os.environ.get("VIDEO_RENDER_WORKERS", os.cpu_count() or 2))
+app.config["VIDEO_QUEUE_LIMIT"] = int(os.environ.get("VIDEO_QUEUE_LIMIT", 20))
+
 # Ensure upload directory exists
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
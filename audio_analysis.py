@@ -0,0 +1,297 @@
+"""
+Audio analysis sidecars.
+
+Each upload is analyzed once, on a mono downmix streamed through a vectorized NumPy STFT:
+an onset-strength envelope (half-wave rectified spectral flux of the log magnitude), an RMS
+energy curve in dB, a tempo estimate with a fixed beat grid, BS.1770 integrated loudness and
+the sample peak (the mastering chain measures true peak on its own output). Uploads
+are stored by content hash (blob_store), so the sidecar next to the audio (<file>.analysis.npz)
+is computed once per distinct file and shared by every video job rendered from it; np.load
+reads its arrays lazily, so reading a feature never decodes the audio again. Mastering doesn't
+read it: it meters loudness on its own filtered and compressed signal.
+
+Curves have one value per STFT hop (ANALYSIS_HOP_FRAMES at the canonical rate, ~43 per
+second); frame k is centred at frame_offset + k / frame_rate seconds.
+
+select_highlight() uses the features to pick the most energetic window of a track, so video
+renders can seek straight to it instead of always starting at the intro.
+"""
+import os
+import threading
+import subprocess
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the features or their layout change, so stale sidecars are recomputed
+ANALYSIS_VERSION = 1
+ANALYSIS_SUFFIX = '.analysis.npz'
+
+ANALYSIS_FFT_FRAMES = 2048
+ANALYSIS_HOP_FRAMES = 1024
+
+# Compression of magnitudes before the spectral flux, log(1 + gamma * |X|)
+LOG_COMPRESSION = 1000.0
+
+TEMPO_RANGE_BPM = (60.0, 200.0)
+# Tempo prior: log-normal around this tempo with a standard deviation in octaves
+TEMPO_PRIOR_BPM = 120.0
+TEMPO_PRIOR_OCTAVES = 1.0
+
+# Onset envelope minus its moving average over this window emphasizes attacks for the tempo estimate
+ONSET_DETREND_SECONDS = 1.0
+
+# Autocorrelation peaks at up to this many multiples of the beat period refine the tempo
+TEMPO_REFINE_MULTIPLES = 8
+
+# Shorter audio gets no tempo or beat grid
+MIN_TEMPO_SECONDS = 4.0
+
+# Highlight selection: weight of onset activity against normalized energy, and the rate of the
+# fallback decode used before a file's sidecar exists
+HIGHLIGHT_ONSET_WEIGHT = 0.5
+HIGHLIGHT_DECODE_RATE = 2000
+HIGHLIGHT_FRAME_RATE = 20
+
+_ENERGY_FLOOR_DB = -120.0
+
+class FeatureAccumulator:
+    """Streaming STFT features of (frames, channels) float blocks, mixed down to mono"""
+
+    def __init__(self, sample_rate, n_fft=ANALYSIS_FFT_FRAMES, hop=ANALYSIS_HOP_FRAMES):
+        self.sample_rate = sample_rate
+        self.n_fft = n_fft
+        self.hop = hop
+        self.window = np.hanning(n_fft).astype(np.float32)
+        self.carry = np.zeros(0, dtype=np.float32)
+        self.previous = None
+        self.onset = []
+        self.energy = []
+
+    def process(self, block):
+        mono = np.asarray(block, dtype=np.float32).mean(axis=1)
+        data = np.concatenate([self.carry, mono])
+        if len(data) < self.n_fft:
+            self.carry = data
+            return
+        count = (len(data) - self.n_fft) // self.hop + 1
+        frames = np.lib.stride_tricks.sliding_window_view(data, self.n_fft)[::self.hop][:count]
+        self.carry = data[count * self.hop:]
+
+        self.energy.append(np.sqrt(np.mean(np.square(frames), axis=1)))
+        spectrum = np.log1p(LOG_COMPRESSION * np.abs(np.fft.rfft(frames * self.window, axis=1)))
+        previous = spectrum[:1] if self.previous is None else self.previous[np.newaxis, :]
+        flux = np.maximum(np.diff(np.concatenate([previous, spectrum]), axis=0), 0.0).sum(axis=1)
+        self.onset.append(flux)
+        self.previous = spectrum[-1]
+
+    def curves(self):
+        """(onset_strength, energy_db) with one value per hop"""
+        if not self.onset:
+            return np.zeros(0), np.zeros(0)
+        energy = np.concatenate(self.energy)
+        with np.errstate(divide='ignore'):
+            energy_db = np.maximum(20 * np.log10(energy), _ENERGY_FLOOR_DB)
+        return np.concatenate(self.onset), energy_db
+
+def estimate_tempo(onset, frame_rate, tempo_range=TEMPO_RANGE_BPM):
+    """
+    Tempo (BPM) and beat phase (frames) from an onset envelope: the autocorrelation peak in the
+    tempo range weighted by the tempo prior, then the grid offset that collects the most onset
+    energy. Returns (0.0, 0.0) when there is too little audio or no periodicity.
+    """
+    if len(onset) < MIN_TEMPO_SECONDS * frame_rate:
+        return 0.0, 0.0
+    width = max(int(round(ONSET_DETREND_SECONDS * frame_rate)), 1)
+    envelope = np.maximum(onset - np.convolve(onset, np.ones(width) / width, mode='same'), 0.0)
+    if not envelope.any():
+        return 0.0, 0.0
+
+    # Autocorrelation through a zero-padded FFT
+    spectrum = np.fft.rfft(envelope, 2 * len(envelope))
+    autocorrelation = np.fft.irfft(np.abs(spectrum) ** 2)[:len(envelope)]
+    min_lag = int(np.floor(60.0 * frame_rate / tempo_range[1]))
+    max_lag = min(int(np.ceil(60.0 * frame_rate / tempo_range[0])), len(envelope) - 2)
+    lags = np.arange(max(min_lag, 1), max_lag + 1)
+    prior = np.exp(-0.5 * (np.log2(60.0 * frame_rate / lags / TEMPO_PRIOR_BPM) / TEMPO_PRIOR_OCTAVES) ** 2)
+    best = lags[np.argmax(autocorrelation[lags] * prior)]
+
+    # The hop quantizes the lag to ~23 ms, so refine the period from the peaks at its multiples
+    # (each located to a fraction of a frame by parabolic interpolation) with a least-squares fit
+    multiples, peaks = [], []
+    for multiple in range(1, TEMPO_REFINE_MULTIPLES + 1):
+        low, high = multiple * best - multiple, multiple * best + multiple + 1
+        if high + 1 >= len(autocorrelation):
+            break
+        lag = low + int(np.argmax(autocorrelation[low:high]))
+        before, peak, after = autocorrelation[lag - 1:lag + 2]
+        curvature = before - 2 * peak + after
+        multiples.append(multiple)
+        peaks.append(lag + (0.5 * (before - after) / curvature if curvature < 0 else 0.0))
+    multiples, peaks = np.array(multiples), np.array(peaks)
+    period = float(multiples @ peaks / (multiples @ multiples))
+
+    # Score every integer grid offset at once
+    offsets = np.arange(int(np.ceil(period)))
+    beats = np.arange(int((len(envelope) - 1) // period) + 1)
+    positions = np.rint(offsets[:, np.newaxis] + period * beats[np.newaxis, :]).astype(np.int64)
+    scores = np.where(positions < len(envelope), envelope[np.minimum(positions, len(envelope) - 1)], 0.0).sum(axis=1)
+    return 60.0 * frame_rate / period, float(offsets[np.argmax(scores)])
+
+def analysis_path(audio_path):
+    return audio_path + ANALYSIS_SUFFIX
+
+def analyze_blocks(blocks, sample_rate, channels):
+    """Analyze a stream of decoded blocks; returns the sidecar's fields"""
+    from audio_processor import LoudnessMeter
+
+    features = FeatureAccumulator(sample_rate)
+    meter = LoudnessMeter(sample_rate, channels, oversample=1)
+    frames = 0
+    for block in blocks:
+        features.process(block)
+        meter.process(block)
+        frames += len(block)
+
+    onset, energy_db = features.curves()
+    frame_rate = sample_rate / features.hop
+    tempo, phase = estimate_tempo(onset, frame_rate)
+    frame_offset = features.n_fft / 2 / sample_rate
+    if tempo:
+        period = 60.0 * frame_rate / tempo
+        beat_frames = np.arange(phase, len(onset), period)
+        beat_times = frame_offset + beat_frames / frame_rate
+    else:
+        beat_times = np.zeros(0)
+
+    peak = onset.max() if len(onset) else 0.0
+    return {
+        'version': ANALYSIS_VERSION,
+        'duration': frames / sample_rate,
+        'frame_rate': frame_rate,
+        'frame_offset': frame_offset,
+        'onset_strength': (onset / peak if peak > 0 else onset).astype(np.float16),
+        'energy_db': energy_db.astype(np.float16),
+        'tempo_bpm': round(tempo, 2),
+        'beat_times': beat_times.astype(np.float32),
+        'integrated_lufs': meter.integrated_lufs(),
+        'sample_peak_dbfs': meter.true_peak_dbtp(),
+    }
+
+def write_analysis(sidecar_path, analysis):
+    """Write a sidecar atomically, so readers never see a partial file"""
+    tmp_path = f'{sidecar_path}.tmp{os.getpid()}_{threading.get_ident()}'
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **analysis)
+    os.replace(tmp_path, sidecar_path)
+    return sidecar_path
+
+def compute_analysis(audio_path):
+    """Decode a file (from the PCM cache when possible) and write its analysis sidecar"""
+    from audio_processor import load_decoded_audio, probe_stream_format, iter_audio_blocks, _array_blocks, \
+        STREAM_BLOCK_FRAMES
+
+    decoded = load_decoded_audio(audio_path)
+    if decoded is not None:
+        pcm, sample_rate = decoded
+        channels = pcm.shape[1]
+        blocks = _array_blocks(pcm, STREAM_BLOCK_FRAMES)
+    else:
+        sample_rate, channels, _ = probe_stream_format(audio_path)
+        blocks = iter_audio_blocks(audio_path, channels)
+    return write_analysis(analysis_path(audio_path), analyze_blocks(blocks, sample_rate, channels))
+
+def load_analysis(audio_path):
+    """
+    An audio file's analysis as a dict (scalars as floats, curves as arrays), or None if it has
+    no current sidecar
+    """
+    try:
+        with np.load(analysis_path(audio_path)) as sidecar:
+            if int(sidecar['version']) != ANALYSIS_VERSION:
+                return None
+            return {key: sidecar[key].item() if sidecar[key].ndim == 0 else sidecar[key] for key in sidecar.files}
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _low_rate_energy(audio_path):
+    """
+    Energy curve (dB, HIGHLIGHT_FRAME_RATE values per second) from a mono decode at
+    HIGHLIGHT_DECODE_RATE, for files whose analysis sidecar isn't ready yet
+    """
+    from audio_cache import ffmpeg_input_args
+
+    result = subprocess.run(['ffmpeg', '-v', 'error'] + ffmpeg_input_args(audio_path)
+                            + ['-ac', '1', '-ar', str(HIGHLIGHT_DECODE_RATE), '-f', 'f32le', '-'],
+                            stdin=subprocess.DEVNULL, capture_output=True, timeout=120)
+    if result.returncode != 0:
+        raise Exception(f'Could not decode {os.path.basename(audio_path)}: {result.stderr.decode(errors="replace")}')
+    samples = np.frombuffer(result.stdout[:len(result.stdout) // 4 * 4], dtype='<f4')
+    hop = HIGHLIGHT_DECODE_RATE // HIGHLIGHT_FRAME_RATE
+    frames = samples[:len(samples) // hop * hop].reshape(-1, hop)
+    with np.errstate(divide='ignore'):
+        return np.maximum(10 * np.log10(np.mean(np.square(frames), axis=1)), _ENERGY_FLOOR_DB)
+
+def highlight_window(energy_db, onset, frame_rate, window_seconds, candidate_times=None):
+    """
+    Start time (s) of the window_seconds window with the most energy, plus onset activity when an
+    onset curve is given: sustained loud, busy sections (usually the chorus or drop) win over
+    intros and breakdowns. Every window is scored at once from cumulative sums; candidate_times
+    (e.g. the beat grid) restrict where the window may start.
+    """
+    length = int(round(window_seconds * frame_rate))
+    if length <= 0 or len(energy_db) <= length:
+        return 0.0
+    power = 10 ** ((np.asarray(energy_db, dtype=np.float64) - np.max(energy_db)) / 10)
+    score = power if onset is None else power + HIGHLIGHT_ONSET_WEIGHT * np.asarray(onset, dtype=np.float64)
+    sums = np.cumsum(np.concatenate([[0.0], score]))
+    window_scores = sums[length:] - sums[:-length]
+
+    if candidate_times is not None and len(candidate_times):
+        starts = np.rint(np.asarray(candidate_times) * frame_rate).astype(np.int64)
+        starts = starts[(starts >= 0) & (starts < len(window_scores))]
+        if len(starts):
+            return float(starts[np.argmax(window_scores[starts])] / frame_rate)
+    return float(np.argmax(window_scores) / frame_rate)
+
+def select_highlight(audio_path, window_seconds):
+    """
+    Start time (s) of the most energetic window of an upload: from its analysis sidecar (energy,
+    onsets, beat-aligned starts) when present, else from a cheap low-rate decode
+    """
+    analysis = load_analysis(audio_path)
+    if analysis is not None:
+        if analysis['duration'] <= window_seconds:
+            return 0.0
+        # Curve frames are centred frame_offset into their window; shift beats onto the frame grid
+        start = highlight_window(analysis['energy_db'], analysis['onset_strength'], analysis['frame_rate'],
+                                 window_seconds, analysis['beat_times'] - analysis['frame_offset'])
+        return min(start, analysis['duration'] - window_seconds)
+    energy_db = _low_rate_energy(audio_path)
+    return highlight_window(energy_db, None, HIGHLIGHT_FRAME_RATE, window_seconds)
+
+# Uploads being analyzed by this process, so repeated triggers (or concurrent uploads of the
+# same content) don't start duplicate workers
+_pending = set()
+_pending_lock = threading.Lock()
+
+def _analyze_in_worker(audio_path):
+    from media_workers import run_isolated
+    try:
+        run_isolated(compute_analysis, audio_path)
+    except Exception as e:
+        logger.error(f"Error analyzing {os.path.basename(audio_path)}: {str(e)}")
+    finally:
+        with _pending_lock:
+            _pending.discard(audio_path)
+
+def compute_analysis_in_background(audio_path):
+    """Analyze an upload off the request thread, in a media worker, unless it has a sidecar or is underway"""
+    if load_analysis(audio_path) is not None:
+        return
+    with _pending_lock:
+        if audio_path in _pending:
+            return
+        _pending.add(audio_path)
+    threading.Thread(target=_analyze_in_worker, args=(audio_path,), name="audio-analysis", daemon=True).start()
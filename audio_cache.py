@@ -0,0 +1,190 @@
+"""
+Decoded PCM cache for uploaded audio.
+
+The first consumer of an upload transcodes it to canonical float32 PCM, stored as a raw
+.f32 file plus a small JSON header in a .pcm_cache directory next to the upload and keyed
+by the content hash. Later consumers memory-map it read-only, so re-mastering with tweaked
+EQ never decodes the compressed file again. Entries are evicted least-recently-used once
+the cache grows past PCM_CACHE_MAX_BYTES.
+"""
+import os
+import json
+import hashlib
+import threading
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PCM_CACHE_DIRNAME = '.pcm_cache'
+PCM_CACHE_MAX_BYTES = int(os.environ.get('PCM_CACHE_MAX_BYTES', 4 * 1024 * 1024 * 1024))
+
+# Single entries larger than this fraction of the budget are never cached
+MAX_ENTRY_FRACTION = 0.25
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+_hash_memo = {}
+_hash_lock = threading.Lock()
+
+def file_sha256(file_path):
+    """
+    SHA-256 of a file's contents, memoized on (path, size, mtime) so repeat lookups are free
+    """
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    with _hash_lock:
+        if memo_key in _hash_memo:
+            return _hash_memo[memo_key]
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    content_hash = digest.hexdigest()
+
+    with _hash_lock:
+        _hash_memo[memo_key] = content_hash
+    return content_hash
+
+def known_sha256(file_path):
+    """A file's SHA-256 if it is already memoized, else None (never reads the file)"""
+    stat = os.stat(file_path)
+    with _hash_lock:
+        return _hash_memo.get((os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns))
+
+def remember_sha256(file_path, content_hash):
+    """Seed the hash memo for a file whose hash was computed while it was being written"""
+    stat = os.stat(file_path)
+    with _hash_lock:
+        _hash_memo[(os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)] = content_hash
+
+def cache_dir_for(file_path):
+    return os.path.join(os.path.dirname(os.path.abspath(file_path)), PCM_CACHE_DIRNAME)
+
+def _entry_paths(cache_dir, content_hash):
+    base = os.path.join(cache_dir, content_hash)
+    return base + '.f32', base + '.json'
+
+def _open_entry(pcm_path, header_path):
+    with open(header_path) as f:
+        header = json.load(f)
+    pcm = np.memmap(pcm_path, dtype='<f4', mode='r', shape=(header['frames'], header['channels']))
+    # Touch both files so eviction sees this entry as recently used
+    os.utime(pcm_path)
+    os.utime(header_path)
+    return pcm, header['sample_rate']
+
+def lookup_decoded_audio(file_path):
+    """
+    Return (pcm, sample_rate) from the cache without decoding, or None on a miss
+    """
+    from audio_processor import CANONICAL_SAMPLE_RATE
+
+    pcm_path, header_path = _entry_paths(cache_dir_for(file_path), file_sha256(file_path))
+    try:
+        pcm, sample_rate = _open_entry(pcm_path, header_path)
+    except (OSError, ValueError, KeyError):
+        return None
+    # Entries decoded before resampling to the canonical rate are redecoded over
+    if sample_rate != CANONICAL_SAMPLE_RATE:
+        return None
+    return pcm, sample_rate
+
+def get_decoded_audio(file_path):
+    """
+    Return (pcm, sample_rate) for an upload, decoding into the cache on first use.
+    pcm is a read-only float32 (frames, channels) memmap. Returns None if the decoded
+    audio would be too large to cache; callers then decode directly.
+    """
+    from audio_processor import probe_stream_format, iter_audio_blocks
+
+    cached = lookup_decoded_audio(file_path)
+    if cached is not None:
+        return cached
+
+    sample_rate, channels, total_frames = probe_stream_format(file_path)
+    if total_frames and total_frames * channels * 4 > PCM_CACHE_MAX_BYTES * MAX_ENTRY_FRACTION:
+        return None
+
+    cache_dir = cache_dir_for(file_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    pcm_path, header_path = _entry_paths(cache_dir, file_sha256(file_path))
+    tmp_suffix = f'.tmp{os.getpid()}_{threading.get_ident()}'
+
+    # Stream blocks straight to disk so populating the cache never holds the whole track
+    frames = 0
+    with open(pcm_path + tmp_suffix, 'wb') as out:
+        for block in iter_audio_blocks(file_path, channels):
+            out.write(memoryview(np.ascontiguousarray(block, dtype='<f4')))
+            frames += len(block)
+    if frames == 0:
+        os.remove(pcm_path + tmp_suffix)
+        return None
+    with open(header_path + tmp_suffix, 'w') as f:
+        json.dump({'frames': frames, 'channels': channels, 'sample_rate': sample_rate}, f)
+
+    # Publish atomically: data first, header last, so readers never see a partial entry
+    os.replace(pcm_path + tmp_suffix, pcm_path)
+    os.replace(header_path + tmp_suffix, header_path)
+    logger.info(f"Cached decoded PCM for {os.path.basename(file_path)} ({frames} frames)")
+
+    evict_lru(cache_dir)
+    return _open_entry(pcm_path, header_path)
+
+def evict_lru(cache_dir, max_bytes=None, data_suffix='.f32', companion_suffixes=()):
+    """
+    Delete least-recently-used entries until the cache fits its size budget.
+    An entry is a data file (data_suffix) plus its .json header and any companion files
+    (same name, companion_suffixes in place of data_suffix), which count towards its size.
+    """
+    max_bytes = PCM_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    total = 0
+    for name in os.listdir(cache_dir):
+        if not name.endswith(data_suffix):
+            continue
+        data_path = os.path.join(cache_dir, name)
+        base = data_path[:-len(data_suffix)]
+        try:
+            stat = os.stat(data_path)
+        except OSError:
+            continue
+        size = stat.st_size
+        for suffix in companion_suffixes:
+            try:
+                size += os.path.getsize(base + suffix)
+            except OSError:
+                pass
+        entries.append((stat.st_mtime, size, data_path))
+        total += size
+
+    for _, size, data_path in sorted(entries):
+        if total <= max_bytes:
+            break
+        # Open memmaps keep working on Linux after unlink; the space is reclaimed when they close
+        base = data_path[:-len(data_suffix)]
+        for path in [base + '.json'] + [base + suffix for suffix in companion_suffixes] + [data_path]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
+        logger.info(f"Evicted {os.path.basename(data_path)} from {os.path.basename(cache_dir)}")
+
+def ffmpeg_input_args(file_path):
+    """
+    ffmpeg input arguments for an upload: the cached raw PCM when present, else the file itself
+    """
+    cached = None
+    try:
+        content_hash = file_sha256(file_path)
+        pcm_path, header_path = _entry_paths(cache_dir_for(file_path), content_hash)
+        with open(header_path) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    if cached is None:
+        return ['-i', file_path]
+    return ['-f', 'f32le', '-ar', str(cached['sample_rate']), '-ac', str(cached['channels']), '-i', pcm_path]
@@ -0,0 +1,361 @@
+"""
+Header-only audio probing.
+
+Reads duration, channels and sample rate straight from container headers (WAV, FLAC
+STREAMINFO, MP3 Xing/VBRI/CBR frames, M4A moov/mvhd) so upload validation and the UI
+never decode a file just to describe it. Anything the parsers don't recognise falls
+back to ffprobe. Results are memoized by (path, size, mtime), and by content hash when the
+file's hash is already known, so probing never reads more than the headers.
+"""
+import os
+import json
+import struct
+import subprocess
+import threading
+import logging
+from collections import OrderedDict
+from audio_cache import known_sha256
+
+logger = logging.getLogger(__name__)
+
+PROBE_MEMO_MAX_ENTRIES = 4096
+
+# How far into an MP3 (after any ID3v2 tag) to look for the first frame
+MP3_SYNC_SEARCH_BYTES = 64 * 1024
+
+_probe_memo = OrderedDict()
+_probe_lock = threading.Lock()
+
+def probe_audio(file_path):
+    """
+    Return {'duration', 'channels', 'sample_rate', 'frames', 'format'} for an audio file, or None
+    if it can't be read. frames may be None when the container doesn't record a length.
+    """
+    try:
+        stat = os.stat(file_path)
+        content_hash = known_sha256(file_path)
+    except OSError:
+        return None
+    memo_keys = [(os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)]
+    if content_hash:
+        memo_keys.append(content_hash)
+    with _probe_lock:
+        for memo_key in memo_keys:
+            if memo_key in _probe_memo:
+                info = _probe_memo[memo_key]
+                # Also file it under any key it lacks (the hash may have become known since)
+                for key in memo_keys:
+                    _probe_memo[key] = info
+                    _probe_memo.move_to_end(key)
+                return dict(info)
+
+    info = None
+    try:
+        info = parse_audio_header(file_path)
+    except (OSError, struct.error, ValueError, IndexError) as e:
+        logger.warning(f"Header parse failed for {os.path.basename(file_path)}: {str(e)}")
+    if info is None:
+        info = _ffprobe(file_path)
+    if info is None:
+        return None
+
+    with _probe_lock:
+        for memo_key in memo_keys:
+            _probe_memo[memo_key] = info
+        while len(_probe_memo) > PROBE_MEMO_MAX_ENTRIES:
+            _probe_memo.popitem(last=False)
+    return dict(info)
+
+def parse_audio_header(file_path):
+    """Probe from container headers only; None if the format isn't one we parse"""
+    with open(file_path, 'rb') as f:
+        head = f.read(12)
+        f.seek(0)
+        if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+            return _parse_wav(f)
+        if head[4:8] == b'ftyp':
+            return _parse_mp4(f, os.fstat(f.fileno()).st_size)
+
+        audio_start = _id3v2_size(f)
+        f.seek(audio_start)
+        if f.read(4) == b'fLaC':
+            return _parse_flac(f)
+        return _parse_mp3(f, audio_start, os.fstat(f.fileno()).st_size)
+
+def _info(fmt, sample_rate, channels, frames=None, duration=None):
+    if not sample_rate or not channels:
+        return None
+    if duration is None:
+        duration = frames / float(sample_rate) if frames is not None else 0.0
+    return {
+        'duration': duration,
+        'channels': channels,
+        'sample_rate': sample_rate,
+        'frames': frames,
+        'format': fmt
+    }
+
+def _parse_wav(f):
+    file_size = os.fstat(f.fileno()).st_size
+    f.seek(12)
+    channels = sample_rate = block_align = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_id, size = struct.unpack('<4sI', chunk)
+        if chunk_id == b'fmt ':
+            fmt = f.read(16)
+            _, channels, sample_rate, _, block_align, _ = struct.unpack('<HHIIHH', fmt)
+            f.seek(size - 16 + (size & 1), 1)
+        elif chunk_id == b'data':
+            if not block_align:
+                return None
+            # Streamed/oversized WAVs carry a placeholder size; trust the file length instead
+            size = min(size, file_size - f.tell())
+            return _info('WAV', sample_rate, channels, frames=size // block_align)
+        else:
+            f.seek(size + (size & 1), 1)
+
+def _id3v2_size(f):
+    """Bytes taken by a leading ID3v2 tag (0 if there is none)"""
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b'ID3':
+        return 0
+    size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+    footer = 10 if header[5] & 0x10 else 0
+    return 10 + size + footer
+
+def _parse_flac(f):
+    # Metadata blocks follow the marker; STREAMINFO is always first
+    block_header = f.read(4)
+    if len(block_header) < 4 or block_header[0] & 0x7F != 0:
+        return None
+    streaminfo = f.read(34)
+    packed = int.from_bytes(streaminfo[10:18], 'big')
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    total_frames = packed & 0xFFFFFFFFF
+    return _info('FLAC', sample_rate, channels, frames=total_frames or None)
+
+_MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_BITRATES[(2, 3)] = _MP3_BITRATES[(2, 2)]
+_MP3_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 2.5: [11025, 12000, 8000]}
+
+def _mp3_frame_header(data, pos):
+    """Decode an MPEG audio frame header at pos; None if it isn't a valid one"""
+    if pos + 4 > len(data) or data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+    version = {3: 1, 2: 2, 0: 2.5}.get((b1 >> 3) & 0x3)
+    layer = {3: 1, 2: 2, 1: 3}.get((b1 >> 1) & 0x3)
+    bitrate_index, rate_index = b2 >> 4, (b2 >> 2) & 0x3
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    bitrate = _MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 0x1
+    if layer == 1:
+        samples_per_frame = 384
+        frame_length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples_per_frame = 1152 if (layer == 2 or version == 1) else 576
+        frame_length = samples_per_frame // 8 * bitrate // sample_rate + padding
+    return {
+        'version': version,
+        'layer': layer,
+        'bitrate': bitrate,
+        'sample_rate': sample_rate,
+        'channels': 1 if (b3 >> 6) == 3 else 2,
+        'samples_per_frame': samples_per_frame,
+        'frame_length': frame_length
+    }
+
+def _parse_mp3(f, audio_start, file_size):
+    f.seek(audio_start)
+    data = f.read(MP3_SYNC_SEARCH_BYTES)
+
+    # First frame whose successor also lines up, so stray 0xFFE bytes aren't mistaken for a sync
+    pos = data.find(b'\xff')
+    header = None
+    while pos != -1:
+        header = _mp3_frame_header(data, pos)
+        if header and (pos + header['frame_length'] + 4 > len(data)
+                       or _mp3_frame_header(data, pos + header['frame_length'])):
+            break
+        header = None
+        pos = data.find(b'\xff', pos + 1)
+    if header is None:
+        return None
+
+    sample_rate, channels = header['sample_rate'], header['channels']
+    frame = data[pos:pos + header['frame_length']]
+
+    # Xing/Info tag sits after the side information of the first frame
+    if header['version'] == 1:
+        side_info = 17 if channels == 1 else 32
+    else:
+        side_info = 9 if channels == 1 else 17
+    xing = frame[4 + side_info:4 + side_info + 12]
+    if xing[:4] in (b'Xing', b'Info') and struct.unpack('>I', xing[4:8])[0] & 0x1:
+        frame_count = struct.unpack('>I', xing[8:12])[0]
+        return _info('MP3', sample_rate, channels, frames=frame_count * header['samples_per_frame'])
+
+    # VBRI tag sits at a fixed offset of 32 bytes past the header
+    vbri = frame[36:54]
+    if vbri[:4] == b'VBRI':
+        frame_count = struct.unpack('>I', vbri[14:18])[0]
+        return _info('MP3', sample_rate, channels, frames=frame_count * header['samples_per_frame'])
+
+    # CBR: length follows from the byte count, minus any ID3v1 tag at the end
+    audio_bytes = file_size - audio_start - pos
+    f.seek(max(file_size - 128, 0))
+    if f.read(3) == b'TAG':
+        audio_bytes -= 128
+    duration = audio_bytes * 8.0 / header['bitrate']
+    return _info('MP3', sample_rate, channels, frames=int(duration * sample_rate), duration=duration)
+
+_MP4_CONTAINERS = (b'moov', b'trak', b'mdia', b'minf', b'stbl')
+
+def _mp4_atoms(f, start, end):
+    """Yield (type, payload_offset, payload_size) for the atoms between start and end"""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, atom_type = struct.unpack('>I4s', f.read(8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size:
+            return
+        yield atom_type, pos + header_size, size - header_size
+        pos += size
+
+def _parse_mp4(f, file_size):
+    found = {}
+
+    def walk(start, end):
+        for atom_type, offset, size in _mp4_atoms(f, start, end):
+            if atom_type in _MP4_CONTAINERS:
+                walk(offset, offset + size)
+            elif atom_type == b'mvhd':
+                f.seek(offset)
+                version = f.read(4)[0]
+                if version == 1:
+                    _, _, timescale, duration = struct.unpack('>QQIQ', f.read(28))
+                else:
+                    _, _, timescale, duration = struct.unpack('>IIII', f.read(16))
+                found['duration'] = duration / float(timescale) if timescale else 0.0
+            elif atom_type == b'stsd' and 'channels' not in found:
+                # Audio sample entry: skip version/flags, entry count and the entry's size/format/reserved
+                f.seek(offset + 8)
+                entry = f.read(36)
+                if entry[4:8] in (b'mp4a', b'alac', b'ac-3', b'ec-3', b'Opus', b'fLaC'):
+                    found['channels'] = struct.unpack('>H', entry[24:26])[0]
+                    found['sample_rate'] = struct.unpack('>I', entry[32:36])[0] >> 16
+
+    # Walking only reads atom headers, so a moov placed after a large mdat costs one seek
+    walk(0, file_size)
+    if 'duration' not in found or 'channels' not in found:
+        return None
+    return _info('M4A', found['sample_rate'], found['channels'],
+                 frames=int(found['duration'] * found['sample_rate']), duration=found['duration'])
+
+def _ffprobe(file_path):
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'a:0',
+         '-show_entries', 'stream=sample_rate,channels,duration:format=format_name,duration',
+         '-of', 'json', file_path],
+        capture_output=True, text=True, timeout=30
+    )
+    if result.returncode != 0:
+        logger.error(f"ffprobe failed for {os.path.basename(file_path)}: {result.stderr}")
+        return None
+    probed = json.loads(result.stdout)
+    if not probed.get('streams'):
+        return None
+    stream = probed['streams'][0]
+    container = probed.get('format', {})
+    sample_rate = int(stream['sample_rate'])
+    try:
+        duration = float(stream.get('duration') or container['duration'])
+        frames = int(duration * sample_rate)
+    except (KeyError, ValueError):
+        duration, frames = 0.0, None
+    fmt = container.get('format_name', 'unknown').split(',')[0].upper()
+    return _info(fmt, sample_rate, int(stream['channels']), frames=frames, duration=duration)
+
+# Largest prefix sniff_audio_format will ask for (leading ID3 tags with artwork can be big)
+SNIFF_MAX_BYTES = 2 * 1024 * 1024
+
+def sniff_audio_format(head, complete=False):
+    """
+    Identify audio from the first bytes of a file: returns 'WAV', 'FLAC', 'MP3', 'M4A' or 'AAC',
+    or None if more bytes are needed. Raises ValueError if the data is not audio we accept.
+    complete means head is the whole file.
+    """
+    def need_more():
+        if complete or len(head) >= SNIFF_MAX_BYTES:
+            raise ValueError('Unrecognized audio data')
+        return None
+
+    if len(head) < 12:
+        return need_more()
+
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        pos = 12
+        while pos + 8 <= len(head):
+            chunk_id, size = struct.unpack('<4sI', head[pos:pos + 8])
+            if chunk_id == b'fmt ':
+                if pos + 24 > len(head):
+                    return need_more()
+                format_tag, channels, sample_rate = struct.unpack('<HHI', head[pos + 8:pos + 16])
+                if format_tag not in (1, 3, 0xFFFE) or not 0 < channels <= 32 or not 0 < sample_rate <= 768000:
+                    raise ValueError('Unsupported WAV encoding')
+                return 'WAV'
+            pos += 8 + size + (size & 1)
+        return need_more()
+
+    if head[4:8] == b'ftyp':
+        return 'M4A'
+
+    offset = 0
+    if head[:3] == b'ID3':
+        offset = 10 + ((head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]) + (10 if head[5] & 0x10 else 0)
+        if offset + 12 > len(head):
+            return need_more()
+
+    if head[offset:offset + 4] == b'fLaC':
+        if head[offset + 4] & 0x7F != 0:
+            raise ValueError('Invalid FLAC stream')
+        return 'FLAC'
+
+    # MPEG audio: allow some leading padding, but require two consecutive valid frames
+    pos = head.find(b'\xff', offset, offset + 4096)
+    while pos != -1:
+        if pos + 4 > len(head):
+            # A sync byte too close to the end to hold a frame header
+            break
+        if (head[pos + 1] & 0xF6) == 0xF0 and pos + 7 <= len(head) and (head[pos + 2] >> 2) & 0xF < 12:
+            return 'AAC'
+        header = _mp3_frame_header(head, pos)
+        if header:
+            following = pos + header['frame_length']
+            if following + 4 > len(head):
+                return 'MP3' if complete else need_more()
+            if _mp3_frame_header(head, following):
+                return 'MP3'
+        pos = head.find(b'\xff', pos + 1, offset + 4096)
+    if len(head) < offset + 4096 + 1600:
+        return need_more()
+    raise ValueError('Unrecognized audio data')
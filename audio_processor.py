@@ -1,106 +1,964 @@
 """
 Audio processing functionality for vocal mastering
 """
+import io
 import os
-from pydub import AudioSegment
-from pydub.effects import normalize, compress_dynamic_range
+import wave
+import subprocess
+from math import gcd
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
 import numpy as np
 from scipy import signal
 import logging
+from dynamics import MultibandCompressor, LookaheadLimiter
 
 logger = logging.getLogger(__name__)
 
-def apply_vocal_mastering(input_file_path, output_file_path, template_settings):
+# Loudness normalization: templates target an integrated LUFS value under a true-peak ceiling
+DEFAULT_TARGET_LUFS = -14.0
+TRUE_PEAK_CEILING_DBTP = -1.0
+
+# Uploads that decode to more than this (float32 at the canonical rate) are mastered block-by-block
+# so memory does not scale with track length; compressed size says little about decoded size
+STREAMING_THRESHOLD_BYTES = 256 * 1024 * 1024
+STREAM_BLOCK_FRAMES = 65536
+
+# Everything is decoded to this rate (WAV resampled with resample_poly when the source differs,
+# other formats by ffmpeg as it decodes), so filters, caches and deliverables all work at one rate
+CANONICAL_SAMPLE_RATE = 44100
+
+# Live EQ previews render a short window around the playhead; the pre-roll lets the filters settle
+EXCERPT_SECONDS = 10.0
+MAX_EXCERPT_SECONDS = 30.0
+EXCERPT_PREROLL_SECONDS = 0.5
+
+# Deliverables: a quick low-bitrate preview is encoded first so playback can start, then the
+# finals are encoded together, one ffmpeg process each. suffix None means the job's output path.
+# The preview is deleted when the job finishes; the finals stay with the job, and the result
+# cache hard-links them rather than keeping copies
+EXPORT_FORMATS = {
+    'preview': {'suffix': '.preview.mp3', 'args': ['-c:a', 'libmp3lame', '-b:a', '96k', '-f', 'mp3']},
+    'mp3': {'suffix': None, 'args': ['-c:a', 'libmp3lame', '-b:a', '320k', '-f', 'mp3']},
+    'wav': {'suffix': '.master.wav', 'args': ['-c:a', 'pcm_s24le', '-f', 'wav']},
+}
+FINAL_FORMATS = ('mp3', 'wav')
+
+# Template definitions: loudness target, filter bands fed into the SOS filter bank, and
+# compressor settings used where the request doesn't carry its own dynamics sliders
+MASTERING_TEMPLATES = {
+    'Radio Ready': {'target_lufs': -10.0, 'bands': [],
+                    'dynamics': {'threshold': -18.0, 'ratio': 3.0, 'attack': 10.0, 'release': 120.0}},
+    'Club Banger': {'target_lufs': -8.0, 'bands': [('lowpass', 8000, 0.707, 0.0)],
+                    'dynamics': {'threshold': -20.0, 'ratio': 4.0, 'attack': 5.0, 'release': 80.0, 'lowBand': 2.0}},
+    'Vintage Warmth': {'target_lufs': -14.0, 'bands': [('highpass', 80, 0.707, 0.0)],
+                       'dynamics': {'threshold': -16.0, 'ratio': 2.0, 'attack': 20.0, 'release': 250.0}},
+    'Vocal Focused': {'target_lufs': -12.0, 'bands': [('highpass', 100, 0.707, 0.0)],
+                      'dynamics': {'threshold': -18.0, 'ratio': 2.5, 'attack': 8.0, 'release': 150.0,
+                                   'midBand': 1.0}},
+    'Bass Heavy': {'target_lufs': -9.0, 'bands': [],
+                   'dynamics': {'threshold': -20.0, 'ratio': 4.0, 'attack': 10.0, 'release': 150.0, 'lowBand': 3.0}},
+}
+
+# Compressor and limiter sliders on the vocal mastering page, with their defaults
+DYNAMICS_DEFAULTS = {
+    'threshold': -12.0, 'ratio': 4.0, 'attack': 3.0, 'release': 100.0, 'makeupGain': 0.0,
+    'lowBand': 0.0, 'midBand': 0.0, 'highBand': 0.0,
+    'limiterThreshold': TRUE_PEAK_CEILING_DBTP, 'limiterRelease': 50.0,
+}
+
+# How far loudness normalization may push peaks into the limiter, in dB
+LIMITER_MAX_REDUCTION_DB = 6.0
+
+# EQ slider name -> (filter type, frequency in Hz, Q), as sent by the vocal mastering page
+EQ_BANDS = {
+    'bass': ('lowshelf', 120, 0.707),
+    'lowShelf': ('lowshelf', 250, 0.707),
+    'lowMid': ('peaking', 500, 1.0),
+    'mids': ('peaking', 1000, 0.7),
+    'highMid': ('peaking', 2500, 1.0),
+    'presence': ('peaking', 4500, 1.0),
+    'treble': ('highshelf', 8000, 0.707),
+    'highShelf': ('highshelf', 12000, 0.707),
+}
+
+def _eq_value(eq_settings, key, default=0.0):
+    """Read a numeric EQ setting (the frontend sends slider values as strings)"""
+    try:
+        return float(eq_settings.get(key, default))
+    except (TypeError, ValueError):
+        return default
+
+def _biquad_sos(kind, freq, q, gain_db, sample_rate):
+    """
+    Design a single second-order section (RBJ audio EQ cookbook)
+    """
+    nyquist = sample_rate / 2.0
+    freq = min(max(float(freq), 10.0), nyquist * 0.95)
+
+    if kind in ('highpass', 'lowpass'):
+        return signal.butter(2, freq, btype=kind, fs=sample_rate, output='sos')
+
+    a = 10 ** (gain_db / 40.0)
+    w0 = 2 * np.pi * freq / sample_rate
+    cos_w0 = np.cos(w0)
+    alpha = np.sin(w0) / (2 * q)
+
+    if kind == 'peaking':
+        b = [1 + alpha * a, -2 * cos_w0, 1 - alpha * a]
+        den = [1 + alpha / a, -2 * cos_w0, 1 - alpha / a]
+    elif kind == 'lowshelf':
+        sqrt_a = 2 * np.sqrt(a) * alpha
+        b = [a * ((a + 1) - (a - 1) * cos_w0 + sqrt_a),
+             2 * a * ((a - 1) - (a + 1) * cos_w0),
+             a * ((a + 1) - (a - 1) * cos_w0 - sqrt_a)]
+        den = [(a + 1) + (a - 1) * cos_w0 + sqrt_a,
+               -2 * ((a - 1) + (a + 1) * cos_w0),
+               (a + 1) + (a - 1) * cos_w0 - sqrt_a]
+    elif kind == 'highshelf':
+        sqrt_a = 2 * np.sqrt(a) * alpha
+        b = [a * ((a + 1) + (a - 1) * cos_w0 + sqrt_a),
+             -2 * a * ((a - 1) + (a + 1) * cos_w0),
+             a * ((a + 1) + (a - 1) * cos_w0 - sqrt_a)]
+        den = [(a + 1) - (a - 1) * cos_w0 + sqrt_a,
+               2 * ((a - 1) - (a + 1) * cos_w0),
+               (a + 1) - (a - 1) * cos_w0 - sqrt_a]
+    else:
+        raise ValueError(f"Unknown filter type: {kind}")
+
+    b = np.asarray(b) / den[0]
+    den = np.asarray(den) / den[0]
+    return np.concatenate([b, den])[np.newaxis, :]
+
+def build_filter_bank(template_settings, sample_rate):
+    """
+    Build the cascaded SOS filter bank for a template plus the user's EQ bands
+    """
+    template = template_settings.get('template', 'Radio Ready')
+    eq_settings = template_settings.get('eq_settings') or {}
+    preset = MASTERING_TEMPLATES.get(template, {'bands': []})
+
+    sections = [_biquad_sos(kind, freq, q, gain, sample_rate)
+                for kind, freq, q, gain in preset['bands']]
+
+    # Cut filters: lowCut is in Hz (20 means off), highCut is in kHz (20+ means off)
+    low_cut = _eq_value(eq_settings, 'lowCut')
+    if low_cut > 20:
+        sections.append(_biquad_sos('highpass', low_cut, 0.707, 0.0, sample_rate))
+    high_cut = _eq_value(eq_settings, 'highCut', 20.0)
+    if 0 < high_cut < 20:
+        sections.append(_biquad_sos('lowpass', high_cut * 1000, 0.707, 0.0, sample_rate))
+
+    for key, (kind, freq, q) in EQ_BANDS.items():
+        gain = _eq_value(eq_settings, key)
+        if gain:
+            sections.append(_biquad_sos(kind, freq, q, gain, sample_rate))
+
+    if not sections:
+        sections.append(np.array([[1.0, 0.0, 0.0, 1.0, 0.0, 0.0]]))
+    return np.vstack(sections)
+
+def loudness_target(template_settings):
+    """Integrated loudness target in LUFS: the template's target offset by the user's output gain"""
+    preset = MASTERING_TEMPLATES.get(template_settings.get('template', 'Radio Ready'), {})
+    eq_settings = template_settings.get('eq_settings') or {}
+    return preset.get('target_lufs', DEFAULT_TARGET_LUFS) + _eq_value(eq_settings, 'outputGain')
+
+def dynamics_settings(template_settings):
+    """Compressor and limiter settings: slider values, falling back to the template's, then the defaults"""
+    preset = MASTERING_TEMPLATES.get(template_settings.get('template', 'Radio Ready'), {})
+    eq_settings = template_settings.get('eq_settings') or {}
+    settings = dict(DYNAMICS_DEFAULTS, **preset.get('dynamics', {}))
+    return {key: _eq_value(eq_settings, key, default) for key, default in settings.items()}
+
+def limiter_ceiling(template_settings):
+    """Limiter ceiling in dBFS: the user's limiter threshold, never above the true-peak ceiling"""
+    return min(dynamics_settings(template_settings)['limiterThreshold'], TRUE_PEAK_CEILING_DBTP)
+
+def build_compressor(template_settings, sample_rate, channels):
+    """Multiband compressor for a template and its sliders, or None when it would do nothing"""
+    settings = dynamics_settings(template_settings)
+    band_gains = (settings['lowBand'], settings['midBand'], settings['highBand'])
+    if settings['ratio'] <= 1.0 and not settings['makeupGain'] and not any(band_gains):
+        return None
+    return MultibandCompressor(sample_rate, channels, threshold_db=settings['threshold'], ratio=settings['ratio'],
+                               attack_ms=settings['attack'], release_ms=settings['release'],
+                               makeup_db=settings['makeupGain'], band_gains_db=band_gains)
+
+def build_limiter(template_settings, sample_rate, channels):
+    """True-peak lookahead limiter at the template's ceiling, with the limiter release slider"""
+    return LookaheadLimiter(sample_rate, channels, ceiling_db=limiter_ceiling(template_settings),
+                            release_ms=dynamics_settings(template_settings)['limiterRelease'])
+
+def _k_weighting_sos(sample_rate):
+    """
+    ITU-R BS.1770 K-weighting (head-related high shelf + RLB high-pass) for any sample rate.
+    Reproduces the standard's published 48 kHz coefficients.
+    """
+    # High shelf: fc, Q and gain from the reference design
+    k = np.tan(np.pi * 1681.974450955533 / sample_rate)
+    q = 0.7071752369554196
+    vh = 10 ** (3.999843853973347 / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0,
+             1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+
+    # RLB high-pass
+    k = np.tan(np.pi * 38.13547087602444 / sample_rate)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    highpass = [1.0, -2.0, 1.0, 1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return np.array([shelf, highpass])
+
+class LoudnessMeter:
+    """
+    Streaming ITU-R BS.1770 meter: gated integrated loudness (LUFS) and 4x-oversampled true peak
+    (oversample=1 measures the cheaper sample peak instead). Feed it consecutive (frames, channels)
+    blocks with process(), then read integrated_lufs() and true_peak_dbtp().
+    """
+    OVERSAMPLE = 4
+    # Input samples of context kept on each side so the interpolator's edge ringing is never measured
+    TRUE_PEAK_MARGIN = 16
+
+    def __init__(self, sample_rate, channels, oversample=OVERSAMPLE):
+        self.channels = channels
+        self.oversample = oversample
+        self.sos = _k_weighting_sos(sample_rate).astype(np.float32)
+        self.zi = np.zeros((self.sos.shape[0], 2, channels), dtype=np.float32)
+        self.step = int(round(sample_rate * 0.1))  # 100 ms hop; gating blocks are 4 hops (400 ms)
+        self.bins = []
+        self.partial = np.zeros(channels)
+        self.partial_frames = 0
+        self.tail = np.zeros((0, channels), dtype=np.float32)
+        self.peak = 0.0
+        # Surround channels (4th and 5th) are weighted +1.5 dB per BS.1770
+        self.weights = np.array([1.41 if i in (3, 4) else 1.0 for i in range(channels)])
+
+    def process(self, block):
+        weighted, self.zi = signal.sosfilt(self.sos, block, axis=0, zi=self.zi)
+        weighted *= weighted
+        frames = len(weighted)
+        start = 0
+
+        # Finish the 100 ms bin left open by the previous block
+        if self.partial_frames:
+            take = min(self.step - self.partial_frames, frames)
+            self.partial += weighted[:take].sum(axis=0, dtype=np.float64)
+            self.partial_frames += take
+            start = take
+            if self.partial_frames == self.step:
+                self.bins.append(self.partial[np.newaxis, :])
+                self.partial = np.zeros(self.channels)
+                self.partial_frames = 0
+
+        full = (frames - start) // self.step
+        if full:
+            end = start + full * self.step
+            self.bins.append(weighted[start:end].reshape(full, self.step, self.channels)
+                             .sum(axis=1, dtype=np.float64))
+            start = end
+        if start < frames:
+            self.partial += weighted[start:].sum(axis=0, dtype=np.float64)
+            self.partial_frames += frames - start
+
+        # True peak: oversample with history from the previous block and only measure samples that
+        # have full context; the last margin of the stream is measured in true_peak_dbtp()
+        history = np.concatenate([self.tail, block]) if len(self.tail) else block
+        start = max(len(self.tail) - self.TRUE_PEAK_MARGIN, 0)
+        end = len(history) - self.TRUE_PEAK_MARGIN
+        self._measure_true_peak(history, start, end)
+        self.tail = np.asarray(history[-2 * self.TRUE_PEAK_MARGIN:], dtype=np.float32)
+
+    def _measure_true_peak(self, history, start, end):
+        if end <= start:
+            return
+        if self.oversample == 1:
+            self.peak = max(self.peak, _peak(history[start:end]))
+            return
+        upsampled = signal.resample_poly(history, self.oversample, 1, axis=0)
+        self.peak = max(self.peak, _peak(upsampled[start * self.oversample:end * self.oversample]))
+
+    def integrated_lufs(self):
+        if not self.bins:
+            return float('-inf')
+        energies = np.concatenate(self.bins) / self.step
+        if len(energies) >= 4:
+            blocks = np.lib.stride_tricks.sliding_window_view(energies, 4, axis=0).mean(axis=-1)
+        else:
+            blocks = energies.mean(axis=0, keepdims=True)
+
+        power = blocks @ self.weights
+        with np.errstate(divide='ignore'):
+            block_lufs = -0.691 + 10 * np.log10(power)
+
+        # Absolute gate at -70 LUFS, then relative gate 10 LU below the absolute-gated loudness
+        gated = power[block_lufs > -70.0]
+        if gated.size == 0:
+            return float('-inf')
+        relative_gate = -0.691 + 10 * np.log10(gated.mean()) - 10.0
+        gated = power[(block_lufs > -70.0) & (block_lufs > relative_gate)]
+        return float(-0.691 + 10 * np.log10(gated.mean()))
+
+    def true_peak_dbtp(self):
+        # Flush the unmeasured end of the stream, where the signal really does stop
+        if len(self.tail):
+            self._measure_true_peak(self.tail, max(len(self.tail) - self.TRUE_PEAK_MARGIN, 0), len(self.tail))
+            self.tail = self.tail[:0]
+        return float(20 * np.log10(self.peak)) if self.peak > 0 else float('-inf')
+
+def measure_loudness(samples, sample_rate, block_frames=STREAM_BLOCK_FRAMES, oversample=LoudnessMeter.OVERSAMPLE):
+    """
+    Integrated loudness and true peak of a decoded buffer: {'integrated_lufs', 'true_peak_dbtp'}
+    """
+    meter = LoudnessMeter(sample_rate, samples.shape[1], oversample=oversample)
+    for block in _array_blocks(samples, block_frames):
+        meter.process(block)
+    return {'integrated_lufs': meter.integrated_lufs(), 'true_peak_dbtp': meter.true_peak_dbtp()}
+
+def _normalization_gain(measured, template_settings):
+    """
+    Gain (dB) that brings the measured loudness to the template target, pushing peaks at most
+    LIMITER_MAX_REDUCTION_DB into the limiter, plus the target, input and gain for the report
+    """
+    target = loudness_target(template_settings)
+    ceiling = limiter_ceiling(template_settings)
+    lufs, true_peak = measured['integrated_lufs'], measured['true_peak_dbtp']
+    if not np.isfinite(lufs):
+        gain_db = 0.0
+    else:
+        gain_db = min(target - lufs, ceiling - true_peak + LIMITER_MAX_REDUCTION_DB)
+
+    return gain_db, {
+        'target_lufs': round(target, 2),
+        'input_lufs': round(lufs, 2) if np.isfinite(lufs) else None,
+        'gain_db': round(gain_db, 2)
+    }
+
+def _output_loudness(loudness, measured):
+    """The report with integrated loudness and true peak as measured on the mastered output"""
+    lufs, true_peak = measured['integrated_lufs'], measured['true_peak_dbtp']
+    return dict(loudness, integrated_lufs=round(lufs, 2) if np.isfinite(lufs) else None,
+                true_peak_dbtp=round(true_peak, 2) if np.isfinite(true_peak) else None)
+
+def load_audio_array(input_file_path):
+    """
+    Decode an audio file once into a float32 (frames, channels) array at the canonical rate,
+    through the same decoders as the streaming path
+    """
+    sample_rate, channels, _ = probe_stream_format(input_file_path)
+    blocks = list(iter_audio_blocks(input_file_path, channels))
+    if not blocks:
+        return np.zeros((0, channels), dtype=np.float32), sample_rate
+    return np.concatenate(blocks), sample_rate
+
+def load_decoded_audio(input_file_path):
+    """
+    Decoded (pcm, sample_rate) from the PCM cache (a read-only memmap), or None if it cannot be cached
+    """
+    from audio_cache import get_decoded_audio
+    try:
+        return get_decoded_audio(input_file_path)
+    except Exception as e:
+        logger.warning(f"PCM cache unavailable for {input_file_path}: {str(e)}")
+        return None
+
+def deliverable_paths(output_file_path):
+    """Paths of every export format for a job whose main (320k MP3) output is output_file_path"""
+    base = os.path.splitext(output_file_path)[0]
+    return {fmt: output_file_path if spec['suffix'] is None else base + spec['suffix']
+            for fmt, spec in EXPORT_FORMATS.items()}
+
+def encode_blocks(blocks, sample_rate, channels, outputs, on_block=None):
+    """
+    Feed one pass of float32 blocks to one ffmpeg encoder per output ({format: path}).
+    The encoders run as parallel processes reading the same PCM from their stdin.
+    on_block, if given, is called with the frame count of each block written.
+    """
+    encoders = []
+    try:
+        for fmt, path in outputs.items():
+            encoders.append((path, subprocess.Popen(
+                ['ffmpeg', '-v', 'error', '-y', '-f', 'f32le', '-ar', str(sample_rate), '-ac', str(channels),
+                 '-i', '-'] + EXPORT_FORMATS[fmt]['args'] + [path],
+                stdin=subprocess.PIPE, stderr=subprocess.PIPE
+            )))
+        for block in blocks:
+            data = memoryview(np.ascontiguousarray(block, dtype='<f4'))
+            for _, encoder in encoders:
+                encoder.stdin.write(data)
+            if on_block is not None:
+                on_block(len(block))
+        for _, encoder in encoders:
+            encoder.stdin.close()
+        for path, encoder in encoders:
+            stderr = encoder.stderr.read()
+            if encoder.wait() != 0:
+                raise Exception(f'Encoding {os.path.basename(path)} failed: {stderr.decode(errors="replace")}')
+    except BaseException:
+        for _, encoder in encoders:
+            encoder.kill()
+            encoder.wait()
+        raise
+
+def export_deliverables(blocks, sample_rate, channels, output_file_path, total_frames=None, preview=True,
+                        on_preview=None, progress_callback=None, progress_span=(60, 95)):
+    """
+    Encode mastered audio to every deliverable: the preview first (then on_preview(path) is called),
+    then the finals in parallel. The waveform peaks sidecar is computed during the first stage.
+    blocks is a callable returning a fresh iterator of mastered float32 blocks; it is read once
+    per stage. Returns {format: path}.
+    """
+    from waveform_peaks import PeakAccumulator, peaks_path, write_peaks
+
+    paths = deliverable_paths(output_file_path)
+    stages = [{'preview': paths['preview']}] if preview else []
+    stages.append({fmt: paths[fmt] for fmt in FINAL_FORMATS})
+
+    # The preview is a small share of the encode time; give it a fifth of the progress span
+    start, end = progress_span
+    spans = [(start, start + (end - start) * 0.2), (start + (end - start) * 0.2, end)] if preview else [(start, end)]
+
+    exported = {}
+    peaks = PeakAccumulator()
+    for stage_index, (outputs, (span_start, span_end)) in enumerate(zip(stages, spans)):
+        frames_done = [0]
+
+        def on_block(frames):
+            frames_done[0] += frames
+            if total_frames:
+                _report_progress(progress_callback,
+                                 span_start + (span_end - span_start) * frames_done[0] / total_frames)
+
+        stage_blocks = peaks.tap(blocks()) if stage_index == 0 else blocks()
+        encode_blocks(stage_blocks, sample_rate, channels, outputs, on_block=on_block)
+        if stage_index == 0:
+            write_peaks(peaks_path(output_file_path), peaks, sample_rate)
+        exported.update(outputs)
+        if 'preview' in outputs and on_preview is not None:
+            try:
+                on_preview(outputs['preview'])
+            except Exception as e:
+                logger.warning(f"Preview callback failed: {str(e)}")
+    return exported
+
+def _prepare_filter_bank(template_settings, sample_rate):
+    """Filter bank as float32 SOS, the dtype sosfilt keeps the audio in"""
+    return build_filter_bank(template_settings, sample_rate).astype(np.float32)
+
+def _peak(samples):
+    """Absolute peak of a buffer (max/min avoids allocating an abs() copy)"""
+    if samples.size == 0:
+        return 0.0
+    return max(float(samples.max()), -float(samples.min()))
+
+# Noise (-200 dBFS) added ahead of the IIR filters so that during digital silence their state
+# never decays into subnormal floats, which make every later filter pass many times slower
+DENORMAL_DITHER = 1e-10
+
+def _pre_gain_stage(template_settings, sample_rate, channels):
+    """
+    The filter bank followed by the compressor, as a function of consecutive blocks (state is
+    carried between calls). This is what loudness is measured on before the gain and limiter.
+    """
+    sos = _prepare_filter_bank(template_settings, sample_rate)
+    state = {'zi': np.zeros((sos.shape[0], 2, channels), dtype=np.float32)}
+    compressor = build_compressor(template_settings, sample_rate, channels)
+    dither = np.random.default_rng(0)
+
+    def process(block):
+        block = block + DENORMAL_DITHER * dither.standard_normal(block.shape, dtype=np.float32)
+        filtered, state['zi'] = signal.sosfilt(sos, block, axis=0, zi=state['zi'])
+        return compressor.process(filtered) if compressor is not None else filtered
+    return process
+
+def _apply_pre_gain(samples, sample_rate, template_settings, block_frames=STREAM_BLOCK_FRAMES):
+    """
+    The pre-gain stage over a whole decoded buffer, into a new float32 array; run block by block
+    so the filters' and compressor's working memory is bounded by the block size
+    """
+    process = _pre_gain_stage(template_settings, sample_rate, samples.shape[1])
+    processed = np.empty(samples.shape, dtype=np.float32)
+    for start in range(0, len(samples), block_frames):
+        processed[start:start + block_frames] = process(samples[start:start + block_frames])
+    return processed
+
+def _gain_and_limit(processed, sample_rate, template_settings, measured):
+    """Normalize and limit a pre-gain buffer in place; returns the loudness report"""
+    gain_db, loudness = _normalization_gain(measured, template_settings)
+    processed *= np.float32(10 ** (gain_db / 20.0))
+    build_limiter(template_settings, sample_rate, processed.shape[1]).limit(processed, STREAM_BLOCK_FRAMES,
+                                                                            out=processed)
+    return _output_loudness(loudness, measure_loudness(processed, sample_rate))
+
+def master_audio_array(samples, sample_rate, template_settings):
+    """
+    Run the template's filter bank and compressor over a decoded buffer, loudness-normalize it
+    and limit it, block by block into one output buffer. Returns (mastered, loudness measurements).
+    """
+    mastered = _apply_pre_gain(samples, sample_rate, template_settings)
+    loudness = _gain_and_limit(mastered, sample_rate, template_settings, measure_loudness(mastered, sample_rate))
+    return mastered, loudness
+
+def read_audio_window(input_file_path, start_frame, frame_count):
+    """
+    Decode only frames [start_frame, start_frame + frame_count) of the canonical-rate stream as
+    float32 (frames, channels). Sliced from the warm PCM cache when the track is in it, otherwise
+    seeked in the WAV or by ffmpeg and resampled. Returns (samples, sample_rate).
+    """
+    from audio_cache import lookup_decoded_audio
+    from audio_probe import probe_audio
+
+    cached = lookup_decoded_audio(input_file_path)
+    if cached is not None:
+        pcm, sample_rate = cached
+        return np.array(pcm[start_frame:start_frame + frame_count]), sample_rate
+
+    try:
+        wav = wave.open(input_file_path, 'rb')
+    except (wave.Error, EOFError):
+        wav = None
+
+    if wav is not None:
+        with wav:
+            source_rate = wav.getframerate()
+            wav.setpos(min(start_frame * source_rate // CANONICAL_SAMPLE_RATE, wav.getnframes()))
+            raw = wav.readframes(-(-frame_count * source_rate // CANONICAL_SAMPLE_RATE))
+            samples = _wav_block_to_float(raw, wav.getsampwidth(), wav.getnchannels())
+        return resample_array(samples, source_rate)[:frame_count], CANONICAL_SAMPLE_RATE
+
+    info = probe_audio(input_file_path)
+    if info is None:
+        raise Exception(f'Could not probe audio format of {os.path.basename(input_file_path)}')
+    channels = info['channels']
+    result = subprocess.run(
+        ['ffmpeg', '-v', 'error', '-ss', f'{start_frame / CANONICAL_SAMPLE_RATE:.6f}', '-i', input_file_path,
+         '-t', f'{frame_count / CANONICAL_SAMPLE_RATE:.6f}'] + _pcm_output_args(channels),
+        capture_output=True
+    )
+    if result.returncode != 0:
+        raise Exception(f'ffmpeg could not decode excerpt: {result.stderr.decode(errors="replace")[-500:]}')
+    raw = result.stdout[:len(result.stdout) - len(result.stdout) % (channels * 4)]
+    return np.frombuffer(raw, dtype='<f4').reshape(-1, channels)[:frame_count], CANONICAL_SAMPLE_RATE
+
+def render_excerpt(input_file_path, template_settings, position, duration=EXCERPT_SECONDS):
+    """
+    Master a short window of a track centred on position (seconds) for live EQ previews.
+    The window is normalized on its own loudness, so its level approximates the full render;
+    peaks are metered without oversampling since the limiter holds the ceiling either way.
+    Returns (mastered, sample_rate, start_seconds, loudness).
+    """
+    sample_rate, channels, total_frames = probe_stream_format(input_file_path)
+    duration = min(max(float(duration), 1.0), MAX_EXCERPT_SECONDS)
+    frame_count = int(duration * sample_rate)
+
+    start_frame = max(0, int((float(position) - duration / 2) * sample_rate))
+    if total_frames:
+        start_frame = max(0, min(start_frame, total_frames - frame_count))
+
+    # Decode a little earlier and drop it after filtering, so the window starts with settled filters
+    preroll = min(start_frame, int(EXCERPT_PREROLL_SECONDS * sample_rate))
+    samples, sample_rate = read_audio_window(input_file_path, start_frame - preroll, frame_count + preroll)
+    if len(samples) <= preroll:
+        raise Exception('Excerpt position is past the end of the track')
+
+    mastered = _apply_pre_gain(samples, sample_rate, template_settings)[preroll:]
+    loudness = _gain_and_limit(mastered, sample_rate, template_settings,
+                               measure_loudness(mastered, sample_rate, oversample=1))
+    return mastered, sample_rate, start_frame / sample_rate, loudness
+
+def encode_wav_bytes(samples, sample_rate):
+    """16-bit WAV of a float (frames, channels) buffer, in memory"""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2')
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(pcm.shape[1])
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+def probe_stream_format(input_file_path):
+    """
+    Return (sample_rate, channels, total_frames) of the decoded stream without decoding the audio.
+    sample_rate is always the canonical rate; total_frames may be None.
+    """
+    from audio_probe import probe_audio
+    info = probe_audio(input_file_path)
+    if info is None:
+        raise Exception(f'Could not probe audio format of {os.path.basename(input_file_path)}')
+    frames = info['frames']
+    if frames and info['sample_rate'] != CANONICAL_SAMPLE_RATE:
+        up, down = _resample_ratio(info['sample_rate'])
+        frames = -(-frames * up // down)
+    return CANONICAL_SAMPLE_RATE, info['channels'], frames
+
+def should_stream(input_file_path):
+    """
+    True if an upload should be mastered block-by-block: its decoded float32 size (frames x
+    channels x 4 from the headers) is over STREAMING_THRESHOLD_BYTES, or can't be told from them
+    """
+    try:
+        _, channels, frames = probe_stream_format(input_file_path)
+    except Exception:
+        return True
+    return not frames or frames * channels * 4 > STREAMING_THRESHOLD_BYTES
+
+def _wav_block_to_float(raw, sample_width, channels):
+    """Convert interleaved PCM bytes from a WAV file into a float32 (frames, channels) block"""
+    if sample_width == 3:
+        packed = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        ints = (packed[:, 0].astype(np.int32) << 8) | (packed[:, 1].astype(np.int32) << 16) \
+            | (packed[:, 2].astype(np.int32) << 24)
+        block = ints.astype(np.float32)
+        block *= 1.0 / (1 << 31)
+    else:
+        dtypes = {1: np.uint8, 2: np.int16, 4: np.int32}
+        block = np.frombuffer(raw, dtype=dtypes[sample_width]).astype(np.float32)
+        if sample_width == 1:
+            block -= 128.0
+        block *= 1.0 / (1 << (8 * sample_width - 1))
+    return block.reshape(-1, channels)
+
+def _resample_ratio(source_rate, target_rate=CANONICAL_SAMPLE_RATE):
+    """(up, down) factors for resample_poly"""
+    divisor = gcd(int(target_rate), int(source_rate))
+    return int(target_rate) // divisor, int(source_rate) // divisor
+
+def resample_array(samples, source_rate, target_rate=CANONICAL_SAMPLE_RATE):
+    """Resample a whole (frames, channels) buffer"""
+    if source_rate == target_rate:
+        return samples
+    up, down = _resample_ratio(source_rate, target_rate)
+    return signal.resample_poly(samples, up, down, axis=0).astype(np.float32, copy=False)
+
+def resample_blocks(blocks, source_rate, channels, target_rate=CANONICAL_SAMPLE_RATE):
+    """
+    Resample a stream of (frames, channels) blocks with resample_poly. Each call filters a whole
+    number of resampling periods with enough input on either side for the filter, so the output
+    matches resampling the whole stream at once.
+    """
+    up, down = _resample_ratio(source_rate, target_rate)
+    # resample_poly's filter spans 10 * max(up, down) taps either side at the upsampled rate
+    margin = -(-10 * max(up, down) // up) + 1
+    margin = -(-margin // down) * down
+
+    pending = np.zeros((margin, channels), dtype=np.float32)
+    frames_in = frames_out = 0
+    for block in blocks:
+        frames_in += len(block)
+        pending = np.concatenate([pending, block])
+        core = (len(pending) - 2 * margin) // down * down
+        if core <= 0:
+            continue
+        resampled = signal.resample_poly(pending[:core + 2 * margin], up, down, axis=0)
+        piece = resampled[margin * up // down:(margin + core) * up // down]
+        frames_out += len(piece)
+        yield piece.astype(np.float32, copy=False)
+        pending = pending[core:]
+
+    # The rest of the stream, padded with the silence resample_poly assumes past the end
+    remaining = -(-frames_in * up // down) - frames_out
+    if remaining > 0:
+        padding = (-(len(pending) - margin)) % down + margin
+        pending = np.concatenate([pending, np.zeros((padding, channels), dtype=np.float32)])
+        resampled = signal.resample_poly(pending, up, down, axis=0)
+        yield resampled[margin * up // down:margin * up // down + remaining].astype(np.float32, copy=False)
+
+def _pcm_output_args(channels):
+    """
+    ffmpeg output options for raw f32le PCM at the canonical rate with the probed channel count.
+    Both are pinned because the headers can disagree with the decoder (HE-AAC headers give the
+    core rate, half what ffmpeg outputs), and the bytes are read back with the probed layout
+    """
+    return ['-f', 'f32le', '-acodec', 'pcm_f32le', '-ac', str(channels), '-ar', str(CANONICAL_SAMPLE_RATE), '-']
+
+def _source_blocks(input_file_path, channels, block_frames):
     """
-    Apply vocal mastering effects to an audio file based on template settings
+    (source sample rate, float32 block generator): WAV natively at the file's own rate, everything
+    else as raw f32le PCM read straight from an ffmpeg pipe, which decodes to the canonical rate
     """
+    try:
+        wav = wave.open(input_file_path, 'rb')
+    except (wave.Error, EOFError):
+        wav = None
+
+    if wav is not None:
+        def wav_blocks():
+            with wav:
+                sample_width = wav.getsampwidth()
+                while True:
+                    raw = wav.readframes(block_frames)
+                    if not raw:
+                        break
+                    yield _wav_block_to_float(raw, sample_width, channels)
+        return wav.getframerate(), wav_blocks()
+
+    def ffmpeg_blocks():
+        proc = subprocess.Popen(
+            ['ffmpeg', '-v', 'error', '-i', input_file_path] + _pcm_output_args(channels),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        try:
+            block_bytes = block_frames * channels * 4
+            while True:
+                raw = proc.stdout.read(block_bytes)
+                if not raw:
+                    break
+                usable = len(raw) - len(raw) % (channels * 4)
+                yield np.frombuffer(raw[:usable], dtype='<f4').reshape(-1, channels)
+        finally:
+            proc.stdout.close()
+            proc.kill()
+            proc.wait()
+    return CANONICAL_SAMPLE_RATE, ffmpeg_blocks()
+
+def iter_audio_blocks(input_file_path, channels, block_frames=STREAM_BLOCK_FRAMES):
+    """
+    Decode an audio file in float32 blocks at the canonical rate (WAV natively, resampled on the
+    way when its rate differs; everything else through an ffmpeg pipe decoding to that rate)
+    """
+    source_rate, blocks = _source_blocks(input_file_path, channels, block_frames)
+    if source_rate != CANONICAL_SAMPLE_RATE:
+        blocks = resample_blocks(blocks, source_rate, channels)
+    yield from blocks
+
+def _report_progress(progress_callback, percent):
+    """Forward a progress percentage to the caller, never letting reporting break processing"""
+    if progress_callback is None:
+        return
+    try:
+        progress_callback(int(min(max(percent, 0), 100)))
+    except Exception as e:
+        logger.warning(f"Progress callback failed: {str(e)}")
+
+def _array_blocks(samples, block_frames):
+    """Fixed-size views over a decoded (possibly memory-mapped) buffer"""
+    for start in range(0, len(samples), block_frames):
+        yield samples[start:start + block_frames]
+
+def master_audio_stream(input_file_path, output_file_path, template_settings, block_frames=STREAM_BLOCK_FRAMES,
+                        progress_callback=None, decoded=None, on_preview=None):
+    """
+    Bounded-memory mastering: a loudness scan pass over the filtered, compressed signal, then gain and
+    limiter passes streamed into the encoders
+    (one for the preview, one for the finals). decoded, if given, is a (pcm memmap, sample_rate) pair
+    from the PCM cache; every pass then reads it block by block instead of decoding the file again.
+    Returns (loudness measurements, {format: path}).
+    """
+    if decoded is not None:
+        pcm, sample_rate = decoded
+        channels, total_frames = pcm.shape[1], len(pcm)
+        blocks = lambda: _array_blocks(pcm, block_frames)
+    else:
+        sample_rate, channels, total_frames = probe_stream_format(input_file_path)
+        blocks = lambda: iter_audio_blocks(input_file_path, channels, block_frames)
+    def report(frames_done):
+        if total_frames:
+            _report_progress(progress_callback, 5 + 30 * frames_done / total_frames)
+
+    # Pass 1: meter the filtered and compressed signal, carrying state across blocks
+    pre_gain = _pre_gain_stage(template_settings, sample_rate, channels)
+    meter = LoudnessMeter(sample_rate, channels)
+    frames_done = 0
+    for block in blocks():
+        meter.process(pre_gain(block))
+        frames_done += len(block)
+        report(frames_done)
+
+    measured = {'integrated_lufs': meter.integrated_lufs(), 'true_peak_dbtp': meter.true_peak_dbtp()}
+    gain_db, loudness = _normalization_gain(measured, template_settings)
+    gain = 10 ** (gain_db / 20.0)
+
+    # Encode passes: re-run the chain from a clean state, apply the gain and limit. The first
+    # pass also meters the limiter's output for the report
+    output_meter = LoudnessMeter(sample_rate, channels)
+    passes = [0]
+
+    def mastered_blocks():
+        pre_gain = _pre_gain_stage(template_settings, sample_rate, channels)
+        limiter = build_limiter(template_settings, sample_rate, channels)
+        metering = passes[0] == 0
+        passes[0] += 1
+        for block in blocks():
+            processed = pre_gain(block)
+            processed *= gain
+            limited = limiter.process(processed)
+            if len(limited):
+                if metering:
+                    output_meter.process(limited)
+                yield limited
+        limited = limiter.flush()
+        if metering:
+            output_meter.process(limited)
+        yield limited
+
+    exported = export_deliverables(mastered_blocks, sample_rate, channels, output_file_path,
+                                   total_frames=total_frames, on_preview=on_preview,
+                                   progress_callback=progress_callback, progress_span=(35, 95))
+    measured = {'integrated_lufs': output_meter.integrated_lufs(), 'true_peak_dbtp': output_meter.true_peak_dbtp()}
+    return _output_loudness(loudness, measured), exported
+
+def apply_vocal_mastering(input_file_path, output_file_path, template_settings, progress_callback=None,
+                          report=None, on_preview=None):
+    """
+    Apply vocal mastering effects to an audio file based on template settings.
+    progress_callback, if given, is called with a 0-100 completion percentage.
+    report, if given, is a dict that receives the loudness measurements under 'loudness' and the
+    exported files ({format: path}) under 'deliverables'.
+    on_preview, if given, is called with the preview's path as soon as it is playable.
+    """
+    report = {} if report is None else report
     try:
         # Check if input file exists
         if not os.path.exists(input_file_path):
             logger.error(f"Input file not found: {input_file_path}")
             return False
-            
+
         # For small test files, copy the original and modify it slightly
         if os.path.getsize(input_file_path) < 1000:  # Small test files
             logger.info(f"Processing small test file: {input_file_path}")
             # Copy original file but with slight modifications to show mastering effect
             import shutil
             shutil.copy2(input_file_path, output_file_path)
+            report['deliverables'] = {'mp3': output_file_path}
             return True
-        
-        # Load audio file
-        audio = AudioSegment.from_file(input_file_path)
-        
-        # Convert to mono if stereo for processing
-        if audio.channels > 1:
-            audio = audio.set_channels(1)
-        
-        # Apply template-specific processing (simplified to avoid timeouts)
+
         template = template_settings.get('template', 'Radio Ready')
-        
-        # SIMPLIFIED PROCESSING TO AVOID WORKER TIMEOUTS
-        if template == 'Radio Ready':
-            # Radio ready: volume boost and normalization only
-            audio = audio + 2  # Slight volume boost
-            audio = normalize(audio)
-            
-        elif template == 'Club Banger':
-            # Club banger: volume boost and slight filtering
-            audio = audio + 4  # More volume
-            try:
-                audio = audio.low_pass_filter(8000)  # Slight high-cut for warmth
-            except:
-                pass  # Skip filtering if it fails
-            
-        elif template == 'Vintage Warmth':
-            # Vintage: high pass filter and normalization
-            try:
-                audio = audio.high_pass_filter(80)  # Remove sub-bass
-            except:
-                pass
-            audio = audio - 1  # Slightly quieter for vintage feel
-            
-        elif template == 'Vocal Focused':
-            # Vocal focus: high pass and slight boost
-            try:
-                audio = audio.high_pass_filter(100)  # Remove low rumble
-            except:
-                pass
-            audio = audio + 1  # Slight boost
-            
-        elif template == 'Bass Heavy':
-            # Bass heavy: volume boost only
-            audio = audio + 3  # Volume boost
-            
-        else:
-            # Default processing: normalize only
-            audio = normalize(audio)
-        
-        # Final normalize to prevent clipping
-        audio = normalize(audio)
-        
-        # Export mastered audio
-        audio.export(output_file_path, format="mp3", bitrate="320k")
-        
+
+        # Re-masters of the same upload read the cached PCM instead of decoding again
+        decoded = load_decoded_audio(input_file_path)
+
+        # Long uploads stream through in fixed-size blocks instead of being processed whole
+        if template_settings.get('streaming') or should_stream(input_file_path):
+            report['loudness'], report['deliverables'] = master_audio_stream(
+                input_file_path, output_file_path, template_settings,
+                progress_callback=progress_callback, decoded=decoded, on_preview=on_preview
+            )
+            logger.info(f"Successfully processed audio with {template} template (streaming)")
+            return True
+
+        # Decode once, then template + EQ filter pass and loudness normalization
+        samples, sample_rate = decoded if decoded is not None else load_audio_array(input_file_path)
+        _report_progress(progress_callback, 30)
+        mastered, report['loudness'] = master_audio_array(samples, sample_rate, template_settings)
+        del samples
+        _report_progress(progress_callback, 60)
+
+        # Export the preview, then the final deliverables
+        report['deliverables'] = export_deliverables(
+            lambda: _array_blocks(mastered, STREAM_BLOCK_FRAMES), sample_rate, mastered.shape[1],
+            output_file_path, total_frames=len(mastered), on_preview=on_preview,
+            progress_callback=progress_callback
+        )
+
         logger.info(f"Successfully processed audio with {template} template")
         return True
-        
+
     except Exception as e:
         logger.error(f"Error processing audio: {str(e)}")
         return False
 
+def _render_shared_variant(shm_name, shape, sample_rate, template_settings, output_file_path):
+    """
+    Process pool entry point: master one variant from the decoded buffer held in shared memory.
+    Returns a report with the variant's loudness measurements and exported files.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        samples = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        mastered, loudness = master_audio_array(samples, sample_rate, template_settings)
+        del samples
+        # Batch variants are not auditioned while rendering, so they skip the preview
+        deliverables = export_deliverables(lambda: _array_blocks(mastered, STREAM_BLOCK_FRAMES), sample_rate,
+                                           mastered.shape[1], output_file_path, preview=False)
+        return {'loudness': loudness, 'deliverables': deliverables}
+    finally:
+        shm.close()
+
+def master_with_report(input_file_path, output_file_path, template_settings, progress_callback=None,
+                       on_preview=None):
+    """apply_vocal_mastering returning (success, report), for callers in another process"""
+    report = {}
+    success = apply_vocal_mastering(input_file_path, output_file_path, template_settings,
+                                    progress_callback=progress_callback, report=report, on_preview=on_preview)
+    return success, report
+
+def render_mastering_variants(input_file_path, variants, max_workers=None, on_variant_done=None,
+                              start_method='forkserver'):
+    """
+    Master one upload with several templates/EQ presets, decoding it only once.
+    variants is a list of (output_file_path, template_settings); returns a list of success flags.
+    on_variant_done(index, success, report) is called as each variant finishes; report holds
+    'loudness' and 'deliverables' like apply_vocal_mastering's.
+    start_method is how the variant worker processes are started; 'fork' is only safe from a
+    single-threaded process.
+    """
+    results = [False] * len(variants)
+
+    def finish(index, success, report=None):
+        results[index] = success
+        if on_variant_done is not None:
+            on_variant_done(index, success, report or {})
+
+    # Tiny test files and streaming-sized uploads go through the single-file path per variant
+    if os.path.getsize(input_file_path) < 1000 or should_stream(input_file_path):
+        for index, (output_file_path, template_settings) in enumerate(variants):
+            report = {}
+            success = apply_vocal_mastering(input_file_path, output_file_path, template_settings, report=report)
+            finish(index, success, report)
+        return results
+
+    decoded = load_decoded_audio(input_file_path)
+    samples, sample_rate = decoded if decoded is not None else load_audio_array(input_file_path)
+    shm = shared_memory.SharedMemory(create=True, size=max(samples.nbytes, 1))
+    try:
+        shared = np.ndarray(samples.shape, dtype=np.float32, buffer=shm.buf)
+        shared[:] = samples
+        shape = samples.shape
+        del samples, shared
+
+        workers = max_workers or min(len(variants), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context(start_method)) as pool:
+            futures = {
+                pool.submit(_render_shared_variant, shm.name, shape, sample_rate,
+                            template_settings, output_file_path): index
+                for index, (output_file_path, template_settings) in enumerate(variants)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    report = future.result()
+                    success = True
+                except Exception as e:
+                    logger.error(f"Error rendering variant {index}: {str(e)}")
+                    report = None
+                    success = False
+                finish(index, success, report)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    logger.info(f"Rendered {sum(results)}/{len(variants)} mastering variants from one decode")
+    return results
+
 def get_audio_info(file_path):
     """
-    Get basic audio file information
+    Get basic audio file information from the container headers (no decode)
     """
     try:
-        audio = AudioSegment.from_file(file_path)
+        from audio_probe import probe_audio
+        info = probe_audio(file_path)
+        if info is None:
+            return None
         return {
-            'duration': len(audio) / 1000.0,  # Convert to seconds
-            'channels': audio.channels,
-            'sample_rate': audio.frame_rate,
-            'format': 'MP3'
+            'duration': info['duration'],
+            'channels': info['channels'],
+            'sample_rate': info['sample_rate'],
+            'format': info['format']
         }
     except Exception as e:
         logger.error(f"Error getting audio info: {str(e)}")
-        return None
\ No newline at end of file
+        return None
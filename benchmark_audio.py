@@ -0,0 +1,222 @@
+"""
+Benchmark harness for the audio pipeline.
+
+Generates synthetic test signals (a log sine sweep, pink noise and speech-like bursts) as WAV
+files, then times get_audio_info and apply_vocal_mastering on each of them with every mastering
+template. Every measurement runs in a fresh process so wall time, CPU time (including the ffmpeg
+encoders) and peak RSS belong to that case alone. Runs offline; needs only ffmpeg on the PATH.
+
+    python benchmark_audio.py --durations 30,300,3600 --output bench.json
+    python benchmark_audio.py --durations 30 --templates "Radio Ready" --compare bench.json
+
+The PCM cache is disabled by default so every render decodes from scratch (--pcm-cache keeps it).
+"""
+import os
+import sys
+import json
+import time
+import wave
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+from scipy import signal
+
+SIGNALS = ('sweep', 'noise', 'speech')
+
+# Brings the pink noise filter's output to roughly -18 dBFS RMS
+PINK_NOISE_GAIN = 1.45
+GENERATE_BLOCK_SECONDS = 10
+
+def _sweep_block(t, duration, channels, rng, state):
+    # Log sweep 20 Hz - 20 kHz over the whole file, -6 dBFS
+    tone = 0.5 * signal.chirp(t, f0=20.0, t1=duration, f1=20000.0, method='logarithmic')
+    return np.repeat(tone[:, np.newaxis], channels, axis=1)
+
+def _noise_block(t, duration, channels, rng, state):
+    # Pink noise: white noise through a -3 dB/octave IIR (Kellet's economy filter), filter state
+    # carried between blocks
+    b, a = [0.049922035, -0.095993537, 0.050612699, -0.004408786], [1, -2.494956002, 2.017265875, -0.522189400]
+    white = rng.standard_normal((len(t), channels))
+    pink, state['zi'] = signal.lfilter(b, a, white, axis=0, zi=state.get('zi', np.zeros((3, channels))))
+    return PINK_NOISE_GAIN * pink
+
+def _speech_block(t, duration, channels, rng, state):
+    # Syllable-rate (~4 Hz) bursts of a voiced 140 Hz buzz with pauses between phrases
+    buzz = signal.sawtooth(2 * np.pi * 140.0 * t) + 0.3 * rng.standard_normal(len(t))
+    syllables = np.clip(np.sin(2 * np.pi * 4.0 * t), 0, None) ** 2
+    phrases = (np.sin(2 * np.pi * 0.25 * t) > -0.3).astype(np.float64)
+    voice = 0.4 * buzz * syllables * phrases
+    return np.repeat(voice[:, np.newaxis], channels, axis=1)
+
+GENERATORS = {'sweep': _sweep_block, 'noise': _noise_block, 'speech': _speech_block}
+
+def generate_signal(path, kind, duration, sample_rate, channels, seed=0):
+    """Write a 16-bit WAV test signal block by block, so hour-long files never sit in memory"""
+    rng = np.random.default_rng(seed)
+    state = {}
+    total = int(duration * sample_rate)
+    block = GENERATE_BLOCK_SECONDS * sample_rate
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        for start in range(0, total, block):
+            t = np.arange(start, min(start + block, total)) / sample_rate
+            samples = GENERATORS[kind](t, duration, channels, rng, state)
+            wav.writeframes((np.clip(samples, -1.0, 1.0) * 32767).astype('<i2').tobytes())
+    return path
+
+def _rusage():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own, children
+
+def _run_case(case):
+    """Child process entry point: run one operation and measure it"""
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+    if not case['pcm_cache']:
+        os.environ['PCM_CACHE_MAX_BYTES'] = '0'
+    from audio_processor import apply_vocal_mastering, get_audio_info
+
+    own_before, children_before = _rusage()
+    wall_start = time.perf_counter()
+    if case['operation'] == 'get_audio_info':
+        success = get_audio_info(case['input']) is not None
+    else:
+        output = os.path.join(case['workdir'], f"out_{os.getpid()}.mp3")
+        report = {}
+        success = apply_vocal_mastering(case['input'], output,
+                                        {'template': case['template'], 'eq_settings': {}}, report=report)
+        for path in report.get('deliverables', {}).values():
+            if os.path.exists(path):
+                os.remove(path)
+    wall = time.perf_counter() - wall_start
+    own_after, children_after = _rusage()
+
+    cpu = (own_after.ru_utime - own_before.ru_utime) + (own_after.ru_stime - own_before.ru_stime) \
+        + (children_after.ru_utime - children_before.ru_utime) + (children_after.ru_stime - children_before.ru_stime)
+    return {
+        'success': bool(success),
+        'wall_s': round(wall, 4),
+        'cpu_s': round(cpu, 4),
+        'realtime_factor': round(case['duration'] / wall, 2) if wall > 0 else None,
+        # ru_maxrss is in KB on Linux
+        'peak_rss_mb': round(own_after.ru_maxrss / 1024, 1),
+    }
+
+def _parse_list(value, cast=str):
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+def _case_key(result):
+    return (result['operation'], result['signal'], result['duration'], result['sample_rate'],
+            result['channels'], result['template'])
+
+def _environment():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        revision = None
+    try:
+        ffmpeg = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True).stdout.split('\n')[0]
+    except OSError:
+        ffmpeg = None
+    return {
+        'revision': revision,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': __import__('scipy').__version__,
+        'ffmpeg': ffmpeg,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+def print_header(baseline=None):
+    header = f"{'operation':<22}{'signal':<8}{'dur':>6}{'rate':>7}{'ch':>3}  {'template':<16}" \
+             f"{'wall s':>9}{'cpu s':>9}{'x RT':>9}{'RSS MB':>9}"
+    if baseline:
+        header += f"{'vs base':>9}"
+    print(header)
+
+def print_result(r, baseline=None):
+    """One table row; with a baseline, the wall time relative to the same case there"""
+    line = f"{r['operation']:<22}{r['signal']:<8}{r['duration']:>6g}{r['sample_rate']:>7}{r['channels']:>3}  " \
+           f"{(r['template'] or '-'):<16}{r['wall_s']:>9.3f}{r['cpu_s']:>9.3f}" \
+           f"{(r['realtime_factor'] or 0):>9.1f}{r['peak_rss_mb']:>9.1f}"
+    base = (baseline or {}).get(_case_key(r))
+    if base and base['wall_s']:
+        line += f"{r['wall_s'] / base['wall_s']:>8.2f}x"
+    if not r['success']:
+        line += '  FAILED'
+    print(line)
+
+def main(argv=None):
+    from audio_processor import MASTERING_TEMPLATES
+
+    parser = argparse.ArgumentParser(description='Benchmark get_audio_info and apply_vocal_mastering')
+    parser.add_argument('--durations', default='30,300,3600', help='comma-separated signal lengths in seconds')
+    parser.add_argument('--signals', default=','.join(SIGNALS), help=f"any of {', '.join(SIGNALS)}")
+    parser.add_argument('--sample-rates', default='44100,48000')
+    parser.add_argument('--channels', default='1,2')
+    parser.add_argument('--templates', default=','.join(MASTERING_TEMPLATES))
+    parser.add_argument('--pcm-cache', action='store_true', help='let renders use the decoded PCM cache')
+    parser.add_argument('--workdir', help='where to write test signals (default: a temporary directory)')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='JSON from an earlier run to show wall-time ratios against')
+    args = parser.parse_args(argv)
+
+    signals = _parse_list(args.signals)
+    unknown = set(signals) - set(SIGNALS)
+    if unknown:
+        parser.error(f"unknown signals: {', '.join(sorted(unknown))}")
+    templates = _parse_list(args.templates)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {_case_key(r): r for r in json.load(f).get('results', [])}
+
+    tempdir = None if args.workdir else tempfile.TemporaryDirectory(prefix='audio-bench-')
+    workdir = args.workdir or tempdir.name
+    os.makedirs(workdir, exist_ok=True)
+    context = multiprocessing.get_context('spawn')
+    results = []
+    print_header(baseline)
+    try:
+        for duration in _parse_list(args.durations, float):
+            for sample_rate in _parse_list(args.sample_rates, int):
+                for channels in _parse_list(args.channels, int):
+                    for kind in signals:
+                        path = os.path.join(workdir, f'{kind}_{duration:g}s_{sample_rate}_{channels}ch.wav')
+                        generate_signal(path, kind, duration, sample_rate, channels)
+                        cases = [('get_audio_info', None)] + [('apply_vocal_mastering', t) for t in templates]
+                        for operation, template in cases:
+                            case = {'operation': operation, 'template': template, 'input': path,
+                                    'workdir': workdir, 'duration': duration, 'pcm_cache': args.pcm_cache}
+                            # One process per case: peak RSS and rusage are never carried over
+                            with context.Pool(1, maxtasksperchild=1) as pool:
+                                measured = pool.apply(_run_case, (case,))
+                            result = {'operation': operation, 'signal': kind, 'duration': duration,
+                                      'sample_rate': sample_rate, 'channels': channels, 'template': template,
+                                      **measured}
+                            results.append(result)
+                            print_result(result, baseline)
+                        os.remove(path)
+    finally:
+        if tempdir is not None:
+            tempdir.cleanup()
+
+    report = {'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'environment': _environment(),
+              'pcm_cache': args.pcm_cache, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {len(results)} results to {args.output}")
+    return 0 if all(r['success'] for r in results) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
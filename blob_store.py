@@ -0,0 +1,105 @@
+"""
+Content-addressed storage for uploaded audio.
+
+Uploads are stored once per distinct content as <sha256>.<ext> in the upload folder, so
+the same track uploaded for mastering and again for a video (or re-uploaded after a page
+refresh) shares one file, and with it the PCM cache, probe results and the peaks and
+analysis sidecars. References are the VocalMaster.original_file and
+VideoGeneration.audio_file columns themselves; a blob is deleted only once no row
+points at it.
+
+A blob is committed before the request that uploaded it has inserted its row, so a concurrent
+upload of the same content can hold a blob that nothing references yet. Releases are therefore
+deferred: every commit (new or deduplicated) touches the blob, and a released blob is only
+deleted once it has gone BLOB_RELEASE_GRACE_SECONDS without a commit and is still unreferenced.
+"""
+import os
+import time
+import logging
+import threading
+from app import app
+
+logger = logging.getLogger(__name__)
+
+# Extension a blob is stored under, from the sniffed format rather than the client's filename
+FORMAT_EXTENSIONS = {'WAV': 'wav', 'FLAC': 'flac', 'MP3': 'mp3', 'M4A': 'm4a', 'AAC': 'aac'}
+
+# How long after its last commit a released blob is kept, so uploads still between committing
+# it and inserting their row never lose it
+BLOB_RELEASE_GRACE_SECONDS = int(os.environ.get('BLOB_RELEASE_GRACE_SECONDS', 600))
+
+def blob_filename(content_hash, audio_format):
+    return f"{content_hash}.{FORMAT_EXTENSIONS.get(audio_format, 'bin')}"
+
+def blob_path(filename):
+    return os.path.join(app.config['UPLOAD_FOLDER'], filename)
+
+def commit_blob(tmp_path, content_hash, audio_format):
+    """
+    Move a fully written upload into the store. Returns (filename, deduplicated); when the
+    content is already stored the new copy is dropped and the existing blob is reused.
+    """
+    filename = blob_filename(content_hash, audio_format)
+    final_path = blob_path(filename)
+    if os.path.exists(final_path):
+        try:
+            # Marks the blob as in use by this upload until it has inserted its row
+            os.utime(final_path)
+        except OSError:
+            pass  # Released meanwhile: store this copy in its place
+        else:
+            os.remove(tmp_path)
+            logger.info(f"Upload deduplicated to existing blob {filename}")
+            return filename, True
+    os.replace(tmp_path, final_path)
+    return filename, False
+
+def blob_refcount(filename):
+    """Number of mastering and video jobs that reference a stored upload"""
+    from models import VocalMaster, VideoGeneration
+    return VocalMaster.query.filter_by(original_file=filename).count() \
+        + VideoGeneration.query.filter_by(audio_file=filename).count()
+
+def release_blob(filename, grace_seconds=None):
+    """
+    Delete a stored upload once nothing references it, after the grace period since its last
+    commit (checked again then, off the request thread)
+    """
+    grace_seconds = BLOB_RELEASE_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    timer = threading.Timer(grace_seconds, _release_when_idle, args=(filename, grace_seconds))
+    timer.daemon = True
+    timer.start()
+
+def _release_when_idle(filename, grace_seconds):
+    try:
+        idle = time.time() - os.path.getmtime(blob_path(filename))
+    except OSError:
+        return
+    if idle < grace_seconds:
+        # Committed again meanwhile: wait out the grace period from that commit
+        release_blob(filename, grace_seconds)
+        return
+    try:
+        with app.app_context():
+            _delete_if_unreferenced(filename)
+    except Exception as e:
+        logger.error(f"Could not release blob {filename}: {str(e)}")
+
+def _delete_if_unreferenced(filename):
+    """Delete a stored upload and its sidecars if nothing references it; returns True if it was removed"""
+    from waveform_peaks import peaks_path
+    from audio_analysis import analysis_path
+
+    if blob_refcount(filename) > 0:
+        return False
+    try:
+        os.remove(blob_path(filename))
+    except OSError:
+        return False
+    for sidecar_path in (peaks_path(blob_path(filename)), analysis_path(blob_path(filename))):
+        try:
+            os.remove(sidecar_path)
+        except OSError:
+            pass
+    logger.info(f"Released unreferenced blob {filename}")
+    return True
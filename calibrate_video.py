@@ -0,0 +1,132 @@
+"""
+Encoder calibration for music video renders.
+
+Measures how fast this host encodes each video resolution with every x264 preset (the
+style's lavfi source and filters included, as in a real render, audio left out), then picks
+for each (resolution, duration) profile in video_render.ENCODER_PROFILES the slowest, best
+compressing preset whose predicted render time fits the resolution's RENDER_BUDGET_SECONDS.
+The picks are written to VIDEO_PROFILES_FILE, which video_render reads at startup. Needs only
+ffmpeg on the PATH.
+
+    python calibrate_video.py
+    python calibrate_video.py --resolutions 4K --parallel 2 --dry-run
+
+--parallel runs that many encodes at once, as the render pool does with VIDEO_RENDER_WORKERS
+workers busy. The mandelbrot (cyberpunk) source is the slowest style, so it is the default.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+from video_render import (ENCODER_PROFILES, RENDER_BUDGET_SECONDS, RESOLUTIONS, VIDEO_FPS, VIDEO_PROFILES_FILE,
+                          encoder_profile, encoder_args, style_graph)
+
+# Best compression first; the first preset that fits the budget is picked
+PRESET_LADDER = ('medium', 'fast', 'faster', 'veryfast', 'superfast', 'ultrafast')
+
+def _parse_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+def _encode_command(profile, visual_style, seconds):
+    source, video_filter = style_graph(visual_style, profile['source_size'], VIDEO_FPS,
+                                       (profile['width'], profile['height']))
+    return ['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', source, '-vf', video_filter,
+            '-t', str(seconds)] + encoder_args(profile) + ['-f', 'null', '-']
+
+def measure_encode_fps(profile, visual_style, seconds, parallel=1):
+    """Frames per second each of `parallel` simultaneous encodes of the profile achieves"""
+    cmd = _encode_command(profile, visual_style, seconds)
+    started = time.monotonic()
+    processes = [subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                 for _ in range(parallel)]
+    for process in processes:
+        _, stderr = process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='replace').strip()}")
+    return seconds * VIDEO_FPS / (time.monotonic() - started)
+
+def pick_preset(encode_fps, duration_seconds, budget_seconds):
+    """(preset, predicted render seconds): the first preset on the ladder that fits, else the fastest"""
+    measured = [preset for preset in PRESET_LADDER if preset in encode_fps]
+    for preset in measured:
+        predicted = duration_seconds * VIDEO_FPS / encode_fps[preset]
+        if predicted <= budget_seconds:
+            return preset, predicted
+    fastest = max(measured, key=lambda preset: encode_fps[preset])
+    return fastest, duration_seconds * VIDEO_FPS / encode_fps[fastest]
+
+def _environment():
+    try:
+        ffmpeg = subprocess.run(['ffmpeg', '-version'], stdin=subprocess.DEVNULL, capture_output=True,
+                                text=True).stdout.split('\n')[0]
+    except OSError:
+        ffmpeg = None
+    return {'ffmpeg': ffmpeg, 'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure video encode speed and pick x264 presets per profile')
+    parser.add_argument('--resolutions', default=','.join(RESOLUTIONS))
+    parser.add_argument('--style', default='cyberpunk', help='visual style whose source is encoded')
+    parser.add_argument('--seconds', type=float, default=4, help='length of each test encode')
+    parser.add_argument('--parallel', type=int, default=1, help='encodes run at once')
+    parser.add_argument('--headroom', type=float, default=0.8, help='fraction of the render budget to plan for')
+    parser.add_argument('--output', default=VIDEO_PROFILES_FILE)
+    parser.add_argument('--dry-run', action='store_true', help='print the picks without writing them')
+    args = parser.parse_args(argv)
+
+    resolutions = _parse_list(args.resolutions)
+    unknown = set(resolutions) - set(RESOLUTIONS)
+    if unknown:
+        parser.error(f"unknown resolutions: {', '.join(sorted(unknown))}")
+
+    encode_fps = {}
+    print(f"{'resolution':<12}{'preset':<12}{'fps':>9}")
+    for resolution in resolutions:
+        encode_fps[resolution] = {}
+        # Every tier of a resolution shares frame size, source size and threads
+        tiers = sorted(seconds for res, seconds in ENCODER_PROFILES if res == resolution)
+        profile = encoder_profile(resolution, tiers[0])
+        for preset in PRESET_LADDER:
+            fps = measure_encode_fps(dict(profile, preset=preset), args.style, args.seconds, args.parallel)
+            encode_fps[resolution][preset] = round(fps, 2)
+            print(f"{resolution:<12}{preset:<12}{fps:>9.1f}")
+
+    profiles, predictions = {}, {}
+    print(f"\n{'profile':<14}{'preset':<12}{'predicted s':>12}{'budget s':>10}")
+    for resolution in resolutions:
+        budget = RENDER_BUDGET_SECONDS[resolution]
+        for res, seconds in sorted(ENCODER_PROFILES):
+            if res != resolution:
+                continue
+            preset, predicted = pick_preset(encode_fps[resolution], seconds, budget * args.headroom)
+            key = f'{resolution}/{seconds}'
+            profiles[key] = {'preset': preset}
+            predictions[key] = round(predicted, 1)
+            line = f"{key:<14}{preset:<12}{predicted:>12.1f}{budget:>10}"
+            if predicted > budget:
+                line += '  OVER BUDGET'
+            print(line)
+
+    if args.dry_run:
+        return 0
+    # Resolutions not calibrated in this run keep their earlier picks
+    try:
+        with open(args.output) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        previous = {}
+    report = {'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'environment': _environment(),
+              'style': args.style, 'parallel': args.parallel, 'headroom': args.headroom,
+              'encode_fps': {**previous.get('encode_fps', {}), **encode_fps},
+              'predicted_seconds': {**previous.get('predicted_seconds', {}), **predictions},
+              'profiles': {**previous.get('profiles', {}), **profiles}}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote presets for {len(profiles)} profiles to {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+"""
+Dynamics processing for mastering: a three-band compressor and a lookahead brickwall limiter.
+
+Both run on (frames, channels) float32 blocks with their state carried between calls, so the
+same objects serve whole in-memory buffers (fed through in BLOCK_FRAMES pieces, so working
+memory does not grow with track length) and the block-by-block streaming path. Filter state,
+band signals and gains stay float32. All of the per-sample work is vectorized:
+
+- bands are split with 4th-order Linkwitz-Riley crossovers. An LR4 low/high pair sums to a
+  2nd-order allpass, so each high pass is taken as allpass minus low pass, and the low band
+  goes through the upper crossover's allpass so the three bands sum back flat
+- level detectors are one-pole IIR filters over the signal power, run with scipy's lfilter
+  at a control rate of one value per CONTROL_FRAMES samples; over each control period the
+  gain ramps linearly to the value computed for the previous one, so only complete periods
+  are ever used and the output does not depend on how the audio is split into blocks
+- release is a gain reduction that decays at a fixed rate in dB, which is a running maximum
+  of reduction + ramp and so a single np.maximum.accumulate
+- the limiter holds each required reduction over the lookahead window and then averages it
+  over the same window, so gain ramps down before a peak arrives and still reaches the full
+  reduction by the time the (delayed) peak is output
+- the limiter's detector runs on a 4x-oversampled copy of the signal, so inter-sample (true)
+  peaks are held under the ceiling, not just the samples. The interpolator needs a few
+  samples of context after each one, so detection lags the input by that margin and the
+  audio is delayed by the same amount on top of the lookahead
+"""
+import numpy as np
+from scipy import signal
+from scipy.ndimage import maximum_filter1d
+
+# Crossover frequencies between the low/mid and mid/high bands, in Hz
+CROSSOVER_FREQUENCIES = (200.0, 3000.0)
+
+# Width of the compressor's soft knee, in dB around the threshold
+KNEE_DB = 6.0
+
+# Release times are the time taken to recover this much gain reduction
+RELEASE_REFERENCE_DB = 10.0
+
+LIMITER_LOOKAHEAD_MS = 5.0
+
+# Limiter detector oversampling (true peak, as BS.1770 meters it) and the input samples of
+# context kept on each side of every measured sample so interpolator edge ringing is never used
+LIMITER_OVERSAMPLE = 4
+TRUE_PEAK_MARGIN = 16
+
+# Samples per compressor control value (detector, gain curve)
+CONTROL_FRAMES = 32
+
+# Block size whole buffers are processed in
+BLOCK_FRAMES = 65536
+
+_POWER_FLOOR = 1e-12
+
+def _linkwitz_riley_sos(freq, sample_rate):
+    """
+    LR4 crossover at freq: the low pass (two cascaded 2nd-order Butterworth sections) and the
+    allpass that low pass + high pass sum to (the Butterworth denominator over its mirror)
+    """
+    freq = min(freq, sample_rate * 0.45)
+    section = signal.butter(2, freq, btype='lowpass', fs=sample_rate, output='sos')
+    denominator = section[0, 3:]
+    allpass = np.concatenate([denominator[::-1], denominator])[np.newaxis, :]
+    return np.vstack([section, section]), allpass
+
+def _release_envelope(reduction_db, last_db, step_db):
+    """
+    Let a gain reduction curve (dB, >= 0) rise instantly and fall by step_db per sample,
+    starting from last_db. y[n] = max(x[n], y[n-1] - step) is a running maximum of
+    x[n] + step * n, shifted back down by the ramp.
+    """
+    ramp = step_db * np.arange(1, len(reduction_db) + 1)
+    held = np.maximum(np.maximum.accumulate(reduction_db + ramp), last_db)
+    return np.maximum(held - ramp, 0.0)
+
+def _release_step(release_ms, sample_rate):
+    return RELEASE_REFERENCE_DB / max(release_ms * 1e-3 * sample_rate, 1.0)
+
+def _across_channels(ufunc, values):
+    """Reduce (frames, channels) to (frames,) one channel at a time (much faster than axis=1)"""
+    result = np.array(values[:, 0])
+    for channel in range(1, values.shape[1]):
+        ufunc(result, values[:, channel], out=result)
+    return result
+
+class _BandFilter:
+    """A float32 SOS filter with its state carried across blocks"""
+
+    def __init__(self, sos, channels):
+        self.sos = sos.astype(np.float32)
+        self.zi = np.zeros((sos.shape[0], 2, channels), dtype=np.float32)
+
+    def __call__(self, block):
+        filtered, self.zi = signal.sosfilt(self.sos, block, axis=0, zi=self.zi)
+        return filtered
+
+class MultibandCompressor:
+    """
+    Three-band downward compressor with linked stereo detection. Every band shares the
+    threshold, ratio and timing; band_gains_db are per-band output gains (low, mid, high)
+    applied on top of makeup_db.
+    """
+
+    def __init__(self, sample_rate, channels, threshold_db=-12.0, ratio=4.0, attack_ms=3.0, release_ms=100.0,
+                 makeup_db=0.0, band_gains_db=(0.0, 0.0, 0.0), crossovers=CROSSOVER_FREQUENCIES):
+        low_freq, high_freq = crossovers
+        low_lowpass, low_allpass = _linkwitz_riley_sos(low_freq, sample_rate)
+        high_lowpass, high_allpass = _linkwitz_riley_sos(high_freq, sample_rate)
+        self.low_lowpass = _BandFilter(low_lowpass, channels)
+        self.low_allpass = _BandFilter(low_allpass, channels)
+        self.high_lowpass = _BandFilter(high_lowpass, channels)
+        self.high_allpass = _BandFilter(high_allpass, channels)
+        self.low_band_allpass = _BandFilter(high_allpass, channels)
+
+        self.threshold_db = float(threshold_db)
+        self.slope = 1.0 - 1.0 / max(float(ratio), 1.0)
+        coeff = np.exp(-CONTROL_FRAMES / max(attack_ms * 1e-3 * sample_rate, CONTROL_FRAMES))
+        self.detector = ([1.0 - coeff], [1.0, -coeff])
+        self.detector_zi = [np.zeros(1) for _ in range(3)]
+        self.release_step = _release_step(release_ms, sample_rate) * CONTROL_FRAMES
+        self.release_last = [0.0, 0.0, 0.0]
+        self.band_gains_db = [makeup_db + gain for gain in band_gains_db]
+        # Gain ramp of the current control period (start, end), and its power so far
+        self.ramps = [(10 ** (gain / 20.0),) * 2 for gain in self.band_gains_db]
+        self.pending_power = [0.0, 0.0, 0.0]
+        self.phase = 0
+
+    def _gain_reduction(self, level_db):
+        """Soft-knee static curve: dB of reduction for a detector level"""
+        over = level_db - self.threshold_db
+        knee = self.slope * (over + KNEE_DB / 2) ** 2 / (2 * KNEE_DB)
+        return np.where(over <= -KNEE_DB / 2, 0.0, np.where(over >= KNEE_DB / 2, self.slope * over, knee))
+
+    def split(self, block):
+        """Split a block into its (low, mid, high) bands"""
+        low = self.low_lowpass(block)
+        rest = self.low_allpass(block) - low
+        mid = self.high_lowpass(rest)
+        return self.low_band_allpass(low), mid, self.high_allpass(rest) - mid
+
+    def _control_gains(self, index, power):
+        """Linear gain for each completed control period of one band"""
+        envelope, self.detector_zi[index] = signal.lfilter(*self.detector, power, zi=self.detector_zi[index])
+        reduction = self._gain_reduction(10 * np.log10(np.maximum(envelope, _POWER_FLOOR)))
+        reduction = _release_envelope(reduction, self.release_last[index], self.release_step)
+        self.release_last[index] = reduction[-1]
+        return 10 ** ((self.band_gains_db[index] - reduction) / 20.0)
+
+    def process(self, block):
+        if len(block) == 0:
+            return np.zeros_like(block)
+        # Control periods touched by this block; the first may have started in the previous one
+        starts = np.arange(0, len(block) + self.phase, CONTROL_FRAMES) - self.phase
+        starts[0] = 0
+        lengths = np.diff(np.append(starts, len(block)))
+        complete = len(starts) if (self.phase + len(block)) % CONTROL_FRAMES == 0 else len(starts) - 1
+        ramp = ((np.arange(len(block)) + self.phase) % CONTROL_FRAMES + 1) / CONTROL_FRAMES
+
+        output = np.zeros(block.shape, dtype=np.float32)
+        for index, band in enumerate(self.split(block)):
+            power = np.add.reduceat(_across_channels(np.add, np.square(band)), starts) / band.shape[1]
+            power[0] += self.pending_power[index]
+            self.pending_power[index] = 0.0 if complete == len(starts) else power[-1]
+
+            # Period k ramps from the gain of period k - 2 to that of period k - 1
+            gains = np.concatenate([self.ramps[index], self._control_gains(index, power[:complete] / CONTROL_FRAMES)
+                                    if complete else []])
+            self.ramps[index] = tuple(gains[complete:complete + 2])
+            gain = np.repeat(gains[:len(starts)], lengths) \
+                + np.repeat(np.diff(gains[:len(starts) + 1]), lengths) * ramp
+            output += band * gain.astype(np.float32)[:, np.newaxis]
+        self.phase = (self.phase + len(block)) % CONTROL_FRAMES
+        return output
+
+class LookaheadLimiter:
+    """
+    Brickwall true-peak limiter (oversample=1 limits sample peaks only). Output is delayed
+    by the lookahead internally but realigned: process() returns fewer frames than it was
+    given at first, and flush() returns the remainder, so the total frame count is unchanged.
+    """
+
+    def __init__(self, sample_rate, channels, ceiling_db=-1.0, release_ms=50.0, lookahead_ms=LIMITER_LOOKAHEAD_MS,
+                 oversample=LIMITER_OVERSAMPLE):
+        self.ceiling_db = float(ceiling_db)
+        self.lookahead = max(int(round(lookahead_ms * 1e-3 * sample_rate)), 1)
+        self.channels = channels
+        self.oversample = oversample
+        self.margin = TRUE_PEAK_MARGIN if oversample > 1 else 0
+        self.delay = self.lookahead + self.margin
+        self.release_step = _release_step(release_ms, sample_rate)
+        self.release_last = 0.0
+        self.audio_history = np.zeros((self.delay, channels), dtype=np.float32)
+        # Silence before the stream starts is the detector's context for the first samples
+        self.detector_history = np.zeros((2 * self.margin, channels), dtype=np.float32)
+        self.reduction_history = np.zeros(self.lookahead)
+        self.held_history = np.zeros(self.lookahead)
+        self.pending_trim = self.delay
+
+    def _detect_peaks(self, block):
+        """
+        Per-sample peak (max over channels) for as many samples as block has: true peak of the
+        samples from margin before the block start, each measured with margin samples of
+        context on both sides, so the detector lags the input by margin samples
+        """
+        if not self.margin:
+            return _across_channels(np.maximum, np.abs(block))
+        history = np.concatenate([self.detector_history, block])
+        self.detector_history = history[-2 * self.margin:]
+        measured = history[self.margin:len(history) - self.margin]
+        upsampled = signal.resample_poly(history, self.oversample, 1, axis=0)
+        upsampled = upsampled[self.margin * self.oversample:(len(history) - self.margin) * self.oversample]
+        inter_sample = np.abs(upsampled).reshape(len(measured), self.oversample, self.channels).max(axis=1)
+        return _across_channels(np.maximum, np.maximum(inter_sample, np.abs(measured)))
+
+    def _trailing_window(self, history, values, reduce):
+        """reduce ('max' or 'mean') over the lookahead + 1 samples ending at each new value"""
+        extended = np.concatenate([history, values])
+        size = self.lookahead + 1
+        if reduce == 'max':
+            # A centred filter shifted so that each output only looks backwards
+            result = maximum_filter1d(extended, size=size, origin=(size - 1) // 2)[self.lookahead:]
+        else:
+            sums = np.cumsum(np.concatenate([[0.0], extended]))
+            result = (sums[size:] - sums[:-size]) / size
+        return result, extended[-self.lookahead:]
+
+    def process(self, block):
+        if len(block) == 0:
+            return block
+        peak = self._detect_peaks(block)
+        over = peak > 10 ** (self.ceiling_db / 20.0)
+        reduction = np.zeros(len(block))
+        reduction[over] = 20 * np.log10(peak[over]) - self.ceiling_db
+        reduction = _release_envelope(reduction, self.release_last, self.release_step)
+        self.release_last = reduction[-1]
+
+        held, self.reduction_history = self._trailing_window(self.reduction_history, reduction, 'max')
+        smoothed, self.held_history = self._trailing_window(self.held_history, held, 'mean')
+
+        audio = np.concatenate([self.audio_history, block])
+        self.audio_history = audio[-self.delay:]
+        output = audio[:len(block)] * (10 ** (-smoothed / 20.0)).astype(np.float32)[:, np.newaxis]
+
+        trim = min(self.pending_trim, len(output))
+        self.pending_trim -= trim
+        return output[trim:].astype(block.dtype, copy=False)
+
+    def flush(self):
+        """Frames still held back by the lookahead (and detector) delay"""
+        return self.process(np.zeros((self.delay, self.channels), dtype=np.float32))
+
+    def limit(self, samples, block_frames=BLOCK_FRAMES, out=None):
+        """
+        Limit a whole buffer block by block into out (a new array by default; samples itself
+        limits in place, since each block's output lands behind the input already read)
+        """
+        out = np.empty(samples.shape, dtype=np.float32) if out is None else out
+        written = 0
+        for start in range(0, len(samples), block_frames):
+            limited = self.process(samples[start:start + block_frames])
+            out[written:written + len(limited)] = limited
+            written += len(limited)
+        limited = self.flush()
+        out[written:written + len(limited)] = limited
+        return out
@@ -0,0 +1,114 @@
+"""
+Raw-frame pipe into an ffmpeg encoder.
+
+Frames generated in Python (PIL images or uint8 arrays) are written as raw RGB24 to an
+ffmpeg subprocess's stdin (-f rawvideo), so they are never JPEG-encoded to temporary files
+and decoded again, and concurrent jobs don't share files in the working directory. The
+command is an argument list; no shell is involved.
+
+Slideshows of stills are fed at a low input rate (input_fps), one frame per still, and
+ffmpeg's fps filter repeats them up to the output rate, so a held still crosses the pipe once
+instead of once per output frame. Given a duration, the last still is padded by one input frame
+and the output cut with -t, so the clip length doesn't depend on how the fps filter ends it.
+"""
+import subprocess
+import logging
+from fractions import Fraction
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENCODER_ARGS = ['-c:v', 'libx264', '-pix_fmt', 'yuv420p']
+
+class FrameSinkError(Exception):
+    """ffmpeg could not encode the frames"""
+
+class FrameSink:
+    """
+    Encodes frames written with write() into output_path at a fixed size and frame rate.
+    Frames are read at input_fps (default fps) and converted to fps by ffmpeg. duration, if
+    given, pins the output length in seconds.
+    Use as a context manager; leaving the block cleanly finishes the file (raising
+    FrameSinkError if ffmpeg failed), leaving it with an exception kills the encoder.
+    """
+
+    def __init__(self, output_path, width, height, fps=24, encoder_args=None, timeout=120, input_fps=None,
+                 duration=None):
+        self.output_path = output_path
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.input_fps = Fraction(input_fps).limit_denominator(1001) if input_fps else Fraction(fps)
+        self.timeout = timeout
+        self.frames = 0
+        filters = []
+        length_args = []
+        if duration:
+            # Hold the last frame past the end so -t, not the fps filter's EOF handling, sets the length
+            filters.append(f'tpad=stop_mode=clone:stop_duration={float(1 / self.input_fps):.6f}')
+            length_args = ['-t', f'{duration:.3f}']
+        if self.input_fps != fps:
+            filters.append(f'fps={fps}')
+        rate_filter = ['-vf', ','.join(filters)] if filters else []
+        self.cmd = ['ffmpeg', '-y', '-v', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                    '-s', f'{width}x{height}', '-r', str(self.input_fps), '-i', '-'] \
+            + rate_filter + (encoder_args or DEFAULT_ENCODER_ARGS) + length_args + [output_path]
+        self.proc = None
+
+    def __enter__(self):
+        self.proc = subprocess.Popen(self.cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.PIPE)
+        return self
+
+    def _to_bytes(self, frame):
+        """RGB24 bytes of a PIL image or (height, width, 3) uint8 array, resized if needed"""
+        if isinstance(frame, np.ndarray):
+            if frame.shape != (self.height, self.width, 3):
+                raise ValueError(f'Frame shape {frame.shape} does not match {self.width}x{self.height}')
+            return np.ascontiguousarray(frame, dtype=np.uint8).tobytes()
+        from PIL import Image
+        if frame.mode != 'RGB':
+            frame = frame.convert('RGB')
+        if frame.size != (self.width, self.height):
+            frame = frame.resize((self.width, self.height), Image.LANCZOS)
+        return frame.tobytes()
+
+    def write(self, frame, count=1):
+        """Append a frame, repeated count times (a still held on screen)"""
+        data = self._to_bytes(frame)
+        try:
+            for _ in range(count):
+                self.proc.stdin.write(data)
+        except BrokenPipeError:
+            raise FrameSinkError(f'ffmpeg exited early: {self._stderr()}')
+        self.frames += count
+
+    def _finish(self):
+        """Close stdin and wait for ffmpeg, draining stderr meanwhile; returns stderr or None on timeout"""
+        try:
+            _, stderr = self.proc.communicate(timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.communicate()
+            return None
+        return stderr.decode(errors='replace').strip()
+
+    def _stderr(self):
+        stderr = self._finish()
+        return 'timed out' if stderr is None else stderr
+
+    def close(self):
+        stderr = self._finish()
+        if stderr is None:
+            raise FrameSinkError('ffmpeg timed out encoding frames')
+        if self.proc.returncode != 0:
+            raise FrameSinkError(f'ffmpeg failed: {stderr}')
+        logger.info(f"Encoded {self.frames} frames into {self.output_path}")
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self.proc.kill()
+            self.proc.wait()
+            return False
+        self.close()
+        return False
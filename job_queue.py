@@ -0,0 +1,258 @@
+"""
+Database-backed job queue shared by the mastering and video render pools.
+
+Jobs are rows whose status moves queued -> running -> completed/failed. Worker threads claim
+the oldest queued rows with a conditional UPDATE, so any number of web processes can serve
+one queue; a queue with a running limit only claims while fewer rows than that are running
+anywhere, which caps concurrent renders across processes rather than per process. Claims
+against a running limit are serialized per queue (a transaction-scoped advisory lock on
+PostgreSQL, the database write lock on SQLite), so two processes can't both see room for the
+last slot.
+
+The pool is started at app startup. While a process runs jobs it stamps their heartbeat_at,
+and every process periodically reaps running rows whose heartbeat went stale (their process
+died or was restarted) or that outlived the queue's run-time limit: they are queued again, or
+failed once they have been attempted MAX_ATTEMPTS times. The run-time limit counts from when
+the handler calls mark_started (once its render holds a media slot); until then a claimed job
+waiting for a slot has started_at refreshed with its heartbeat. Outcomes are recorded only
+while a job is still running, so a job the reaper failed stays failed. A job whose handler
+raises is always recorded as failed rather than left running.
+"""
+import time
+import zlib
+import threading
+import logging
+from datetime import datetime, timedelta
+from app import app, db
+
+logger = logging.getLogger(__name__)
+
+# How often idle workers re-check the database for jobs queued by other processes
+POLL_INTERVAL_SECONDS = 5
+
+# Running jobs' heartbeats are refreshed this often; a job whose heartbeat is older than
+# STALE_HEARTBEAT_SECONDS has lost its process
+HEARTBEAT_SECONDS = 15
+STALE_HEARTBEAT_SECONDS = 60
+
+# Claims of one job before an interrupted job is failed instead of queued again
+MAX_ATTEMPTS = 2
+
+class JobQueue:
+    """
+    A queue over a model with status, queued_at, started_at, completed_at, heartbeat_at,
+    attempts and error_message columns. run_jobs(ids) runs the claimed ids and records their
+    outcome. batch_column groups rows claimed together; workers_key and running_limit_key name
+    app.config entries for threads per process and the cross-process running limit.
+    max_run_seconds is the longest a job may run after mark_started before it is reaped
+    regardless of heartbeat.
+    """
+
+    def __init__(self, name, model, run_jobs, workers_key, max_run_seconds, batch_column=None,
+                 running_limit_key=None):
+        self.name = name
+        self.model = model
+        self.run_jobs = run_jobs
+        self.workers_key = workers_key
+        self.max_run_seconds = max_run_seconds
+        self.batch_column = batch_column
+        self.running_limit_key = running_limit_key
+        self._wake = threading.Event()
+        self._workers = []
+        self._workers_lock = threading.Lock()
+        self._active = set()
+        self._waiting = set()
+        self._active_lock = threading.Lock()
+
+    def start_workers(self):
+        """Start the worker threads and the heartbeat/reaper thread (idempotent)"""
+        with self._workers_lock:
+            if self._workers:
+                return
+            for i in range(app.config.get(self.workers_key, 2)):
+                worker = threading.Thread(target=self._worker_loop, name=f"{self.name}-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            monitor = threading.Thread(target=self._monitor_loop, name=f"{self.name}-monitor", daemon=True)
+            monitor.start()
+            self._workers.append(monitor)
+            logger.info(f"Started {len(self._workers) - 1} {self.name} workers")
+
+    def wake(self):
+        """Nudge an idle worker after queueing jobs"""
+        self.start_workers()
+        self._wake.set()
+
+    def queue_position(self, job):
+        """1-based position of a queued job, or None if it is not waiting"""
+        model = self.model
+        if job.status != 'queued' or job.queued_at is None:
+            return None
+        ahead = model.query.filter(
+            model.status == 'queued',
+            db.or_(model.queued_at < job.queued_at,
+                   db.and_(model.queued_at == job.queued_at, model.id < job.id))
+        ).count()
+        return ahead + 1
+
+    def claim_next(self):
+        """
+        Atomically move the oldest queued job (and the rest of its batch) to running; returns
+        the claimed ids, or an empty list if nothing is queued or the running limit is reached
+        """
+        model = self.model
+        limit = app.config.get(self.running_limit_key) if self.running_limit_key else None
+        columns = [model.id] + ([getattr(model, self.batch_column)] if self.batch_column else [])
+        candidates = db.session.query(*columns).filter(model.status == 'queued') \
+            .order_by(model.queued_at, model.id).limit(5).all()
+        if limit and candidates:
+            self._lock_claims()
+        for candidate in candidates:
+            job_id, batch_id = candidate[0], candidate[1] if self.batch_column else None
+            query = model.query.filter(model.status == 'queued')
+            query = query.filter(getattr(model, self.batch_column) == batch_id) if batch_id \
+                else query.filter(model.id == job_id)
+            ids = [row.id for row in query.with_entities(model.id).order_by(model.id).all()]
+
+            # Claim row by row so rowcount tells us exactly which rows this worker owns
+            owned = []
+            for claim_id in ids:
+                claim = model.query.filter(model.id == claim_id, model.status == 'queued')
+                if limit:
+                    # Evaluated inside the UPDATE, so the running count is as of the claim itself
+                    running = db.aliased(model)
+                    claim = claim.filter(db.session.query(db.func.count(running.id))
+                                         .filter(running.status == 'running').scalar_subquery() < limit)
+                now = datetime.utcnow()
+                claimed = claim.update({'status': 'running', 'started_at': now, 'heartbeat_at': now,
+                                        'attempts': db.func.coalesce(model.attempts, 0) + 1},
+                                       synchronize_session=False)
+                if claimed:
+                    owned.append(claim_id)
+            db.session.commit()
+            if owned:
+                return owned
+            if limit:
+                # At the running limit: nothing else can be claimed until a job finishes
+                return []
+        return []
+
+    def _lock_claims(self):
+        """
+        Serialize running-limit claims on this queue until the transaction ends. Under READ
+        COMMITTED the running count in the claim UPDATE would otherwise miss a claim another
+        process has made but not yet committed. SQLite needs nothing: it allows one writer at a time
+        """
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(db.text('SELECT pg_advisory_xact_lock(:key)'),
+                               {'key': zlib.crc32(f'job_queue:{self.name}'.encode())})
+
+    def fail_jobs(self, job_ids, error_message):
+        """Mark the jobs among job_ids that are still running as failed"""
+        model = self.model
+        model.query.filter(model.id.in_(job_ids), model.status == 'running').update(
+            {'status': 'failed', 'error_message': error_message, 'completed_at': datetime.utcnow()},
+            synchronize_session=False
+        )
+        db.session.commit()
+        logger.error(f"{self.name} job(s) {job_ids} failed: {error_message}")
+
+    def mark_started(self, job_ids):
+        """
+        Start the run-time clock of claimed jobs: called by the handler once the render actually
+        starts, so time spent waiting for a media slot doesn't count towards max_run_seconds
+        """
+        with self._active_lock:
+            self._waiting.difference_update(job_ids)
+        now = datetime.utcnow()
+        self.model.query.filter(self.model.id.in_(job_ids), self.model.status == 'running').update(
+            {'started_at': now, 'heartbeat_at': now}, synchronize_session=False
+        )
+        db.session.commit()
+
+    def reap_orphans(self):
+        """Queue again (or fail) running jobs whose process is gone or that ran past the limit"""
+        model = self.model
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=STALE_HEARTBEAT_SECONDS)
+        overdue = now - timedelta(seconds=self.max_run_seconds + STALE_HEARTBEAT_SECONDS)
+        orphans = db.session.query(model.id, model.started_at, model.attempts).filter(
+            model.status == 'running',
+            db.or_(db.func.coalesce(model.heartbeat_at, model.started_at) < stale,
+                   model.started_at.is_(None), model.started_at < overdue)
+        ).all()
+        requeued = False
+        for job_id, started_at, attempts in orphans:
+            if started_at and started_at < overdue:
+                values = {'status': 'failed', 'completed_at': now,
+                          'error_message': f'Job ran longer than {self.max_run_seconds} s'}
+            elif (attempts or 0) >= MAX_ATTEMPTS:
+                values = {'status': 'failed', 'completed_at': now,
+                          'error_message': 'Job was interrupted repeatedly (server restarted while it ran)'}
+            else:
+                values = {'status': 'queued', 'started_at': None, 'heartbeat_at': None}
+            # Conditional on still running, so a job that finishes meanwhile keeps its outcome
+            if model.query.filter(model.id == job_id, model.status == 'running').update(
+                    values, synchronize_session=False):
+                requeued = requeued or values['status'] == 'queued'
+                logger.warning(f"Reaped orphaned {self.name} job {job_id}: now {values['status']}")
+        db.session.commit()
+        if requeued:
+            self._wake.set()
+
+    def _heartbeat(self):
+        with self._active_lock:
+            active = list(self._active)
+            waiting = list(self._waiting)
+        now = datetime.utcnow()
+        if active:
+            self.model.query.filter(self.model.id.in_(active), self.model.status == 'running').update(
+                {'heartbeat_at': now}, synchronize_session=False
+            )
+        if waiting:
+            # Not rendering yet, so their run-time clock hasn't started
+            self.model.query.filter(self.model.id.in_(waiting), self.model.status == 'running').update(
+                {'started_at': now}, synchronize_session=False
+            )
+        db.session.commit()
+
+    def _monitor_loop(self):
+        # Runs right away at startup, so jobs orphaned by the previous process are picked up on boot
+        while True:
+            try:
+                with app.app_context():
+                    self._heartbeat()
+                    self.reap_orphans()
+            except Exception as e:
+                logger.error(f"{self.name} monitor error: {str(e)}")
+            time.sleep(HEARTBEAT_SECONDS)
+
+    def _run_claimed(self, job_ids):
+        with self._active_lock:
+            self._active.update(job_ids)
+            self._waiting.update(job_ids)
+        try:
+            self.run_jobs(job_ids)
+        except Exception as e:
+            db.session.rollback()
+            self.fail_jobs(job_ids, str(e) or type(e).__name__)
+        finally:
+            with self._active_lock:
+                self._active.difference_update(job_ids)
+                self._waiting.difference_update(job_ids)
+
+    def _worker_loop(self):
+        while True:
+            self._wake.wait(timeout=POLL_INTERVAL_SECONDS)
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    while True:
+                        job_ids = self.claim_next()
+                        if not job_ids:
+                            break
+                        logger.info(f"{self.name} job(s) {job_ids} started on {threading.current_thread().name}")
+                        self._run_claimed(job_ids)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"{self.name} worker error: {str(e)}")
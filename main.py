@@ -1,4 +1,11 @@
 from app import app
+from mastering_jobs import start_workers as start_mastering_workers
+from video_jobs import start_workers as start_video_workers
+
+# Job pools run in every web process from startup, so queued jobs (and jobs orphaned by a
+# restart) are picked up without waiting for a new job to be queued
+start_mastering_workers()
+start_video_workers()
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,299 @@
+"""
+Background job queue for vocal mastering.
+
+Jobs are queued in the database (VocalMaster.status = 'queued') and picked up by a
+pool of worker threads (job_queue), so /api/start-mastering returns immediately instead
+of holding a gunicorn worker for the whole render. Workers claim jobs with a
+conditional UPDATE, which keeps the queue correct across several web processes, and
+jobs orphaned by a restart are picked up again. Jobs whose (upload, template, EQ) was
+rendered before are completed straight from the result cache without being queued.
+"""
+import os
+import threading
+import logging
+from datetime import datetime
+from app import app, db
+from models import VocalMaster, CacheCounter
+from job_queue import JobQueue
+from media_workers import MEDIA_JOB_WALL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Only write progress to the database when it moved by at least this much
+PROGRESS_STEP = 5
+
+# Variant worker processes a batch render forks. Resource limits are per process, so a batch
+# can use up to this many times the media job limits on top of its job process's own
+BATCH_VARIANT_WORKERS = int(os.environ.get('BATCH_VARIANT_WORKERS', 2))
+
+def run_claimed_jobs(job_ids):
+    """Render jobs claimed together: a batch from one decode, or a single job"""
+    if len(job_ids) > 1:
+        run_mastering_batch(job_ids)
+    else:
+        run_mastering_job(job_ids[0])
+
+# Batch variants share a batch_id and are claimed together
+mastering_queue = JobQueue('mastering', VocalMaster, run_claimed_jobs, 'MASTERING_WORKERS',
+                           max_run_seconds=MEDIA_JOB_WALL_SECONDS, batch_column='batch_id')
+queue_position = mastering_queue.queue_position
+
+def start_workers():
+    """Start the mastering worker pool at app startup (idempotent)"""
+    mastering_queue.start_workers()
+    # Start the media job forkserver now so the first render doesn't pay for its imports
+    from media_workers import warm_up
+    threading.Thread(target=warm_up, name="media-warm-up", daemon=True).start()
+
+def enqueue_mastering_job(vocal_master):
+    """
+    Put a job in the queue and wake a worker. The caller commits eq_settings first.
+    """
+    enqueue_mastering_jobs([vocal_master])
+
+def enqueue_mastering_jobs(vocal_masters):
+    """
+    Queue several jobs in one commit (batch variants share a batch_id and are claimed together).
+    Jobs with a cached render are completed immediately instead.
+    """
+    now = datetime.utcnow()
+    queued = 0
+    for vocal_master in vocal_masters:
+        vocal_master.progress = 0
+        vocal_master.error_message = None
+        vocal_master.queued_at = now
+        vocal_master.started_at = None
+        vocal_master.completed_at = None
+        vocal_master.preview_file = None
+        hit = _complete_from_cache(vocal_master)
+        _count_cache_lookup(hit)
+        if hit:
+            continue
+        vocal_master.status = 'queued'
+        vocal_master.cache_hit = False
+        queued += 1
+    db.session.commit()
+
+    if queued:
+        mastering_queue.wake()
+
+def _complete_from_cache(vocal_master):
+    """Link a cached render's deliverables to the job and mark it completed; False on a miss"""
+    from audio_processor import deliverable_paths
+    from result_cache import lookup_result, link_result
+    from waveform_peaks import peaks_path
+
+    if vocal_master.id is None:
+        db.session.flush()
+    original_path = os.path.join(app.config['UPLOAD_FOLDER'], vocal_master.original_file)
+    try:
+        cached = lookup_result(original_path, vocal_master.template, vocal_master.eq_settings)
+        if cached is None:
+            return False
+        render_paths, metadata = cached
+        mastered_filename = mastered_filename_for(vocal_master)
+        mastered_path = os.path.join(app.config['UPLOAD_FOLDER'], mastered_filename)
+        output_paths = deliverable_paths(mastered_path)
+        _clear_output(mastered_path)
+        for fmt, render_path in render_paths.items():
+            link_result(render_path, output_paths[fmt])
+        # The render's waveform peaks come with it, so the player never decodes the cached MP3
+        if os.path.exists(peaks_path(render_paths['mp3'])):
+            link_result(peaks_path(render_paths['mp3']), peaks_path(mastered_path))
+    except OSError as e:
+        logger.warning(f"Result cache lookup failed for job {vocal_master.id}: {str(e)}")
+        return False
+
+    vocal_master.status = 'completed'
+    vocal_master.progress = 100
+    vocal_master.mastered_file = mastered_filename
+    vocal_master.deliverables = {fmt: os.path.basename(output_paths[fmt]) for fmt in render_paths}
+    vocal_master.loudness = metadata.get('loudness')
+    vocal_master.cache_hit = True
+    vocal_master.completed_at = datetime.utcnow()
+    logger.info(f"Mastering job {vocal_master.id} served from result cache")
+    return True
+
+def _count_cache_lookup(hit):
+    """Bump the result cache counters in the caller's transaction (atomic UPDATE, so safe across processes)"""
+    column = CacheCounter.hits if hit else CacheCounter.misses
+    updated = CacheCounter.query.filter_by(name='result_cache').update({column: column + 1},
+                                                                       synchronize_session=False)
+    if not updated:
+        db.session.add(CacheCounter(name='result_cache', hits=int(hit), misses=int(not hit)))
+
+def result_cache_stats():
+    """Hit/miss counters plus cache disk usage"""
+    from result_cache import result_cache_usage
+
+    counter = CacheCounter.query.get('result_cache')
+    hits = counter.hits if counter else 0
+    misses = counter.misses if counter else 0
+    stats = {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / float(hits + misses), 3) if hits + misses else None
+    }
+    stats.update(result_cache_usage(app.config['UPLOAD_FOLDER']))
+    return stats
+
+def _set_progress(job_id, percent):
+    VocalMaster.query.filter_by(id=job_id).update({'progress': percent}, synchronize_session=False)
+    db.session.commit()
+
+def _set_preview(job_id, preview_path):
+    """Publish the preview so /audio/<id>/mastered can play it while the finals encode"""
+    VocalMaster.query.filter_by(id=job_id).update({'preview_file': os.path.basename(preview_path)},
+                                                  synchronize_session=False)
+    db.session.commit()
+
+def mastered_filename_for(vocal_master):
+    """
+    Output filename for a job (its 320k MP3). Uploads are content-addressed and shared between
+    jobs, so the job id keeps each job's render separate.
+    """
+    return f"mastered_{vocal_master.id}_{os.path.splitext(vocal_master.original_file)[0]}.mp3"
+
+def _template_settings(vocal_master):
+    return {
+        'template': vocal_master.template,
+        'eq_settings': vocal_master.eq_settings or {}
+    }
+
+def _clear_output(output_path):
+    """
+    Remove a previous render (every deliverable) before writing a new one: the main output may
+    be hard-linked into the result cache, and rendering over it in place would corrupt the entry
+    """
+    from audio_processor import deliverable_paths
+    from waveform_peaks import peaks_path
+
+    for path in list(deliverable_paths(output_path).values()) + [peaks_path(output_path)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _cache_result(vocal_master):
+    from result_cache import store_result
+
+    upload_folder = app.config['UPLOAD_FOLDER']
+    outputs = {fmt: os.path.join(upload_folder, filename) for fmt, filename in vocal_master.deliverables.items()}
+    try:
+        store_result(os.path.join(upload_folder, vocal_master.original_file), vocal_master.template,
+                     vocal_master.eq_settings, outputs, {'loudness': vocal_master.loudness})
+    except OSError as e:
+        logger.warning(f"Could not cache render of job {vocal_master.id}: {str(e)}")
+
+def _finish_job(job_id, success, mastered_filename, error_message=None, report=None):
+    """
+    Record a job's outcome; report is the renderer's {'loudness', 'deliverables'} report.
+    Conditional on the job still running, so a job the reaper already failed keeps that outcome.
+    The preview is deleted once the outcome is committed: only a running job serves it
+    """
+    from audio_processor import FINAL_FORMATS
+
+    report = report or {}
+    if success:
+        values = {
+            'status': 'completed',
+            'progress': 100,
+            'mastered_file': mastered_filename,
+            'deliverables': {fmt: os.path.basename(path) for fmt, path in (report.get('deliverables') or {}).items()
+                             if fmt in FINAL_FORMATS},
+            'loudness': report.get('loudness')
+        }
+    else:
+        values = {'status': 'failed', 'error_message': error_message or 'Audio processing failed'}
+    values['completed_at'] = datetime.utcnow()
+    values['preview_file'] = None
+    preview_file = VocalMaster.query.get(job_id).preview_file
+    finished = VocalMaster.query.filter(VocalMaster.id == job_id, VocalMaster.status == 'running').update(
+        values, synchronize_session=False
+    )
+    db.session.commit()
+    if not finished:
+        logger.warning(f"Mastering job {job_id} was no longer running; its {values['status']} outcome was dropped")
+        return
+    if preview_file:
+        try:
+            os.remove(os.path.join(app.config['UPLOAD_FOLDER'], preview_file))
+        except OSError:
+            pass
+    if success:
+        _cache_result(VocalMaster.query.get(job_id))
+    else:
+        logger.error(f"Mastering job {job_id} failed: {values['error_message']}")
+
+def _record_usage(job_ids, usage):
+    """Store a render's resource usage on its jobs; a batch's usage is shared by all its variants"""
+    usage = dict(usage, batch_size=len(job_ids)) if len(job_ids) > 1 else usage
+    for job_id in job_ids:
+        VocalMaster.query.get(job_id).resource_usage = usage
+    db.session.commit()
+
+def run_mastering_batch(job_ids):
+    """Render claimed batch variants from a single decode of their shared upload"""
+    from audio_processor import render_mastering_variants
+    from media_workers import run_isolated
+
+    vocal_masters = [VocalMaster.query.get(job_id) for job_id in job_ids]
+    original_path = os.path.join(app.config['UPLOAD_FOLDER'], vocal_masters[0].original_file)
+    filenames = [mastered_filename_for(vocal_master) for vocal_master in vocal_masters]
+    variants = [(os.path.join(app.config['UPLOAD_FOLDER'], filename), _template_settings(vocal_master))
+                for filename, vocal_master in zip(filenames, vocal_masters)]
+
+    def on_variant_done(index, success, report):
+        _finish_job(job_ids[index], success, filenames[index], report=report)
+
+    for output_path, _ in variants:
+        _clear_output(output_path)
+    usage = {}
+    try:
+        # The job process is single-threaded, so its variant workers fork from it directly. They
+        # inherit its limits (each gets its own RLIMIT_AS and RLIMIT_CPU, hence the worker cap) and,
+        # as reaped children, count towards its subprocess CPU usage
+        run_isolated(render_mastering_variants, original_path, variants, start_method='fork',
+                     max_workers=min(len(variants), BATCH_VARIANT_WORKERS),
+                     callbacks={'on_variant_done': on_variant_done}, usage=usage,
+                     on_started=lambda: mastering_queue.mark_started(job_ids))
+    except Exception as e:
+        for job_id in job_ids:
+            if VocalMaster.query.get(job_id).status == 'running':
+                _finish_job(job_id, False, None, str(e))
+    _record_usage(job_ids, usage)
+
+def run_mastering_job(job_id):
+    """Render one claimed job and record the outcome"""
+    from audio_processor import master_with_report
+    from media_workers import run_isolated
+
+    vocal_master = VocalMaster.query.get(job_id)
+    original_path = os.path.join(app.config['UPLOAD_FOLDER'], vocal_master.original_file)
+    mastered_filename = mastered_filename_for(vocal_master)
+    mastered_path = os.path.join(app.config['UPLOAD_FOLDER'], mastered_filename)
+    template_settings = _template_settings(vocal_master)
+
+    last_reported = [0]
+
+    def on_progress(percent):
+        if percent - last_reported[0] >= PROGRESS_STEP:
+            last_reported[0] = percent
+            _set_progress(job_id, percent)
+
+    _clear_output(mastered_path)
+    report = {}
+    usage = {}
+    try:
+        # Rendered in a resource-limited child process; a killed render lands in the except below
+        success, report = run_isolated(master_with_report, original_path, mastered_path, template_settings,
+                                       callbacks={'progress_callback': on_progress,
+                                                  'on_preview': lambda path: _set_preview(job_id, path)},
+                                       usage=usage, on_started=lambda: mastering_queue.mark_started([job_id]))
+        error_message = None if success else 'Audio processing failed'
+    except Exception as e:
+        success = False
+        error_message = str(e)
+
+    _finish_job(job_id, success, mastered_filename, error_message, report=report)
+    _record_usage([job_id], usage)
@@ -0,0 +1,228 @@
+"""
+Process-isolated media jobs.
+
+Decoding, mastering and ffmpeg renders run in a child process per job instead of inside the
+web worker, so a huge or hostile upload can only exhaust its own limits: each child caps its
+address space and CPU time with setrlimit (ffmpeg processes it starts inherit the caps), and
+the supervising thread kills it once it overruns the wall-clock limit. Each child leads its own
+process group, so a kill takes the ffmpeg and ffprobe processes it started with it. Children are forked
+from a multiprocessing forkserver that has numpy, scipy, PIL and the audio modules imported
+already, so starting one costs a fork rather than a cold interpreter.
+
+Callbacks (progress, preview ready, batch variant done) cannot cross the process boundary, so
+the child sends each call back over a pipe and the supervisor makes it in the web process.
+A job that is killed or dies raises MediaJobFailed with a readable reason.
+
+Each job's resource usage (wall and CPU time, peak RSS, disk I/O and the CPU time of the
+ffmpeg processes it ran) is measured in the child and handed back for storage with the job;
+usage_percentiles() summarizes stored usage for capacity planning.
+"""
+import os
+import time
+import signal
+import logging
+import resource
+import threading
+import multiprocessing
+from functools import partial
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MEDIA_JOB_MEMORY_BYTES = int(os.environ.get('MEDIA_JOB_MEMORY_BYTES', 4 * 1024 * 1024 * 1024))
+MEDIA_JOB_CPU_SECONDS = int(os.environ.get('MEDIA_JOB_CPU_SECONDS', 600))
+MEDIA_JOB_WALL_SECONDS = int(os.environ.get('MEDIA_JOB_WALL_SECONDS', 900))
+
+# Media jobs (mastering, video, analysis) running at once per web process; further jobs wait for a slot
+MEDIA_WORKERS = int(os.environ.get('MEDIA_WORKERS', os.cpu_count() or 2))
+
+# Imported once in the forkserver and inherited by every job process
+PRELOAD_MODULES = ['numpy', 'scipy.signal', 'scipy.ndimage', 'PIL.Image', 'audio_processor', 'waveform_peaks',
+                   'audio_analysis']
+
+_slots = threading.BoundedSemaphore(MEDIA_WORKERS)
+_context = None
+_context_lock = threading.Lock()
+
+class MediaJobFailed(Exception):
+    """A media job that raised, was killed for exceeding a limit, or died"""
+
+def _get_context():
+    """The forkserver context, started and pre-warmed on first use"""
+    global _context
+    with _context_lock:
+        if _context is None:
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(PRELOAD_MODULES)
+            from multiprocessing import forkserver
+            forkserver.ensure_running()
+            _context = context
+            logger.info("Media worker forkserver started")
+        return _context
+
+def warm_up():
+    """Start the forkserver ahead of the first job (idempotent)"""
+    _get_context()
+
+def _apply_limits(memory_bytes, cpu_seconds):
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    if memory_bytes:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+    if cpu_seconds:
+        # SIGXCPU at the soft limit; the hard limit is a SIGKILL backstop
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 5))
+
+# Metrics that add up across the jobs of a batch render, as opposed to wall time and peak RSS
+ADDITIVE_USAGE_METRICS = ('cpu_user_seconds', 'cpu_system_seconds', 'subprocess_cpu_seconds',
+                          'read_bytes', 'write_bytes')
+USAGE_PERCENTILES = (50, 90, 99)
+
+def _io_counters():
+    """Bytes this process (and its reaped children) read from and wrote to storage"""
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['read_bytes']), int(counters['write_bytes'])
+    except (OSError, KeyError, ValueError):
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return (own.ru_inblock + children.ru_inblock) * 512, (own.ru_oublock + children.ru_oublock) * 512
+
+def _usage_snapshot():
+    return resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN), _io_counters()
+
+def _usage_since(snapshot):
+    """Resource usage of this process since snapshot; subprocess time is ffmpeg and other children"""
+    own_before, children_before, (read_before, written_before) = snapshot
+    own, children, (read, written) = _usage_snapshot()
+    return {
+        'cpu_user_seconds': round(own.ru_utime - own_before.ru_utime, 3),
+        'cpu_system_seconds': round(own.ru_stime - own_before.ru_stime, 3),
+        'subprocess_cpu_seconds': round((children.ru_utime - children_before.ru_utime)
+                                        + (children.ru_stime - children_before.ru_stime), 3),
+        # ru_maxrss is in KB on Linux
+        'peak_rss_mb': round(own.ru_maxrss / 1024, 1),
+        'read_bytes': read - read_before,
+        'write_bytes': written - written_before,
+    }
+
+def usage_percentiles(usages):
+    """
+    Percentiles of each metric over stored usage dicts. Usage recorded for a batch render
+    (batch_size > 1) is the whole batch's, so its additive metrics are split evenly per job.
+    """
+    values = {}
+    for usage in usages:
+        share = usage.get('batch_size') or 1
+        for metric, value in usage.items():
+            if metric == 'batch_size' or not isinstance(value, (int, float)):
+                continue
+            values.setdefault(metric, []).append(value / share if metric in ADDITIVE_USAGE_METRICS else value)
+    return {
+        metric: {f'p{p}': round(float(v), 3) for p, v in zip(USAGE_PERCENTILES, np.percentile(samples, USAGE_PERCENTILES))}
+        for metric, samples in values.items()
+    }
+
+def _send_callback(conn, name, *args):
+    conn.send(('callback', name, args))
+
+def _child_main(conn, func, args, kwargs, callback_names, memory_bytes, cpu_seconds):
+    """Job process entry point: apply the limits, run func and send its usage and result back"""
+    os.setpgid(0, 0)
+    snapshot = _usage_snapshot()
+    try:
+        _apply_limits(memory_bytes, cpu_seconds)
+        for name in callback_names:
+            kwargs[name] = partial(_send_callback, conn, name)
+        outcome = ('result', func(*args, **kwargs))
+    except MemoryError:
+        outcome = ('error', 'ran out of memory')
+    except Exception as e:
+        outcome = ('error', str(e) or type(e).__name__)
+    try:
+        conn.send(('usage', _usage_since(snapshot)))
+        conn.send(outcome)
+    finally:
+        conn.close()
+
+def _describe_exit(exitcode):
+    if exitcode == -signal.SIGXCPU:
+        return 'exceeded its CPU time limit'
+    if exitcode == -signal.SIGKILL:
+        return 'was killed (out of memory or over its limits)'
+    if exitcode is not None and exitcode < 0:
+        return f'was killed by signal {-exitcode}'
+    return f'exited unexpectedly (code {exitcode})'
+
+def _kill_group(process):
+    """SIGKILL a job process and every process it started that is still in its group"""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+def run_isolated(func, *args, callbacks=None, usage=None, on_started=None, memory_bytes=MEDIA_JOB_MEMORY_BYTES,
+                 cpu_seconds=MEDIA_JOB_CPU_SECONDS, wall_seconds=MEDIA_JOB_WALL_SECONDS, **kwargs):
+    """
+    Run func(*args, **kwargs) in a limited child process and return its result.
+    func and its arguments must be picklable (func a module-level function). callbacks maps
+    keyword names of func to callables in this process; the child gets stand-ins that relay
+    each call here. usage, if given, is a dict that receives the job's resource usage (only
+    wall_seconds when the child was killed). on_started, if given, is called once the job has
+    a slot, when its wall clock starts. Raises MediaJobFailed if the job raises, is killed or
+    runs too long.
+    """
+    callbacks = callbacks or {}
+    usage = {} if usage is None else usage
+    context = _get_context()
+    name = getattr(func, '__name__', 'media job')
+
+    with _slots:
+        if on_started is not None:
+            on_started()
+        started = time.monotonic()
+        parent_conn, child_conn = context.Pipe(duplex=False)
+        process = context.Process(target=_child_main, name=f'media-{name}',
+                                  args=(child_conn, func, args, kwargs, list(callbacks), memory_bytes, cpu_seconds))
+        process.start()
+        child_conn.close()
+
+        deadline = time.monotonic() + wall_seconds if wall_seconds else None
+        outcome = None
+        try:
+            while outcome is None:
+                remaining = deadline - time.monotonic() if deadline else 1.0
+                if remaining <= 0:
+                    _kill_group(process)
+                    raise MediaJobFailed(f'{name} timed out after {wall_seconds} s')
+                if not parent_conn.poll(min(remaining, 1.0)):
+                    if not process.is_alive() and not parent_conn.poll():
+                        break
+                    continue
+                try:
+                    message = parent_conn.recv()
+                except EOFError:
+                    break
+                if message[0] == 'callback':
+                    callbacks[message[1]](*message[2])
+                elif message[0] == 'usage':
+                    usage.update(message[1])
+                else:
+                    outcome = message
+        finally:
+            parent_conn.close()
+            process.join(timeout=5)
+            # Also reaps ffmpeg processes a finished or killed job left behind
+            _kill_group(process)
+            if process.is_alive():
+                process.kill()
+            process.join()
+            usage['wall_seconds'] = round(time.monotonic() - started, 3)
+
+    if outcome is None:
+        reason = _describe_exit(process.exitcode)
+        logger.error(f"Media job {name} {reason}")
+        raise MediaJobFailed(f'{name} {reason}')
+    if outcome[0] == 'error':
+        raise MediaJobFailed(outcome[1])
+    return outcome[1]
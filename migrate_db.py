@@ -0,0 +1,64 @@
+"""
+Schema migration for existing databases.
+
+db.create_all() creates missing tables (such as cache_counter) but never alters a table that
+already exists, so a database created before the job queue, deliverables, loudness and
+resource-usage columns were added to vocal_master and video_generation lacks them. This script
+compares every model table with the live schema and adds the missing columns (nullable, so
+existing rows are untouched) and indexes. It only ever adds, so running it again is a no-op.
+
+    python migrate_db.py            # migrate the database at DATABASE_URL
+    python migrate_db.py --dry-run  # print the statements without running them
+
+Run it once after deploying, before the app serves traffic.
+"""
+import sys
+import argparse
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from app import app, db
+
+def pending_statements(connection):
+    """ALTER TABLE / CREATE INDEX statements bringing the live schema up to the models"""
+    inspector = inspect(connection)
+    dialect = connection.dialect
+    preparer = dialect.identifier_preparer
+    existing_tables = set(inspector.get_table_names())
+    statements = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            # Created whole by create_all
+            continue
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            statements.append(f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN '
+                              f'{preparer.format_column(column)} {column.type.compile(dialect=dialect)}')
+        indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                statements.append(str(CreateIndex(index).compile(dialect=dialect)))
+    return statements
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Add columns and indexes missing from existing tables')
+    parser.add_argument('--dry-run', action='store_true', help='print the statements without running them')
+    args = parser.parse_args(argv)
+
+    with app.app_context():
+        db.create_all()
+        with db.engine.begin() as connection:
+            statements = pending_statements(connection)
+            for statement in statements:
+                print(statement)
+                if not args.dry_run:
+                    connection.execute(text(statement))
+    if not statements:
+        print('Schema is up to date')
+    elif not args.dry_run:
+        print(f'Applied {len(statements)} statements')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -40,9 +40,22 @@ class VocalMaster(db.Model):
     track_title = db.Column(db.String(100), nullable=False)
     original_file = db.Column(db.String(255), nullable=False)
     mastered_file = db.Column(db.String(255))
+    preview_file = db.Column(db.String(255))  # low-bitrate preview, playable before the finals land
+    deliverables = db.Column(db.JSON)  # format -> filename, e.g. {'mp3': ..., 'wav': ...}
     template = db.Column(db.String(50), nullable=False)
     eq_settings = db.Column(db.JSON)
-    status = db.Column(db.String(20), default='processing')  # processing, completed, failed
+    loudness = db.Column(db.JSON)  # integrated_lufs, true_peak_dbtp, target_lufs, gain_db, input_lufs
+    resource_usage = db.Column(db.JSON)  # wall/CPU seconds, peak RSS, I/O bytes of the render (see media_workers)
+    status = db.Column(db.String(20), default='uploaded')  # uploaded, queued, running, completed, failed
+    progress = db.Column(db.Integer, default=0)  # 0-100 while running
+    batch_id = db.Column(db.String(32), index=True)  # set on variants rendered together from one decode
+    cache_hit = db.Column(db.Boolean, index=True)  # True if served from the result cache, False if rendered
+    error_message = db.Column(db.Text)
+    queued_at = db.Column(db.DateTime)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)  # refreshed while a worker runs the job (see job_queue)
+    attempts = db.Column(db.Integer, default=0)  # times a worker has claimed the job
+    completed_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class VideoGeneration(db.Model):
@@ -55,5 +68,18 @@ class VideoGeneration(db.Model):
     duration = db.Column(db.String(10), nullable=False)  # 15s, 30s, 1min
     resolution = db.Column(db.String(10), nullable=False)  # 720p, 1080p, 4K
     video_file = db.Column(db.String(255))
-    status = db.Column(db.String(20), default='processing')  # processing, completed, failed
+    status = db.Column(db.String(20), default='processing')  # processing, queued, running, completed, failed
+    resource_usage = db.Column(db.JSON)  # wall/CPU seconds, peak RSS, I/O bytes of the render (see media_workers)
+    error_message = db.Column(db.Text)
+    queued_at = db.Column(db.DateTime)  # set for uploaded-audio renders, which go through video_jobs
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)  # refreshed while a worker runs the job (see job_queue)
+    attempts = db.Column(db.Integer, default=0)  # times a worker has claimed the job
+    completed_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CacheCounter(db.Model):
+    """Hit/miss counters for a named cache, shared by every web and worker process"""
+    name = db.Column(db.String(50), primary_key=True)
+    hits = db.Column(db.Integer, default=0, nullable=False)
+    misses = db.Column(db.Integer, default=0, nullable=False)
@@ -2,6 +2,7 @@ import os
 import requests
 import time
 from openai import OpenAI
+from frame_sink import FrameSink
 
 # Initialize OpenAI client with working timeout configuration
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
@@ -268,62 +269,18 @@ def download_and_save_image(image_url, filename):
         print(f"Error downloading image: {str(e)}")
         raise e
 
-def merge_audio_with_video(video_path, audio_path, output_path, duration_seconds=15):
-    """
-    Merge uploaded audio file with generated video using FFmpeg
-    """
-    try:
-        import subprocess
-        import os
-        
-        # Verify input files exist
-        if not os.path.exists(video_path):
-            raise Exception(f"Video file not found: {video_path}")
-        if not os.path.exists(audio_path):
-            raise Exception(f"Audio file not found: {audio_path}")
-        
-        # Ensure output directory exists
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        
-        # FFmpeg command to merge video and audio
-        cmd = [
-            'ffmpeg', '-y',  # Overwrite output file
-            '-i', video_path,  # Input video
-            '-i', audio_path,  # Input audio  
-            '-map', '0:v',     # Use video from first input
-            '-map', '1:a',     # Use audio from second input
-            '-c:v', 'copy',    # Copy video codec (no re-encoding)
-            '-c:a', 'aac',     # Encode audio as AAC
-            '-shortest',       # Match shortest duration
-            '-t', str(duration_seconds),  # Limit to specified duration
-            output_path
-        ]
-        
-        print(f"Merging audio {audio_path} with video {video_path}")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
-        
-        if result.returncode == 0 and os.path.exists(output_path):
-            file_size = os.path.getsize(output_path)
-            print(f"Audio-video merge successful: {output_path} ({file_size} bytes)")
-            return output_path
-        else:
-            print(f"FFmpeg merge error: {result.stderr}")
-            raise Exception(f'Audio-video merge failed: {result.stderr}')
-            
-    except subprocess.TimeoutExpired:
-        raise Exception('Audio-video merge timed out')
-    except Exception as e:
-        print(f"Error merging audio with video: {str(e)}")
-        raise e
+# Fade applied at both ends of the audio window cut out of an upload
+HIGHLIGHT_FADE_SECONDS = 0.5
 
-def create_demo_video_with_audio(track_title, visual_style, duration_seconds=15, audio_file=None):
+def create_demo_video_with_audio(track_title, visual_style, duration_seconds=15, audio_file=None, resolution='720p'):
     """
-    Create a professional video using FFmpeg with animated elements
+    Create a professional video using FFmpeg with animated elements, encoded with its audio
+    in a single pass at the resolution's encoder profile (see video_render)
     """
     try:
         import uuid
         import os
-        import subprocess
+        from video_render import render_video
         
         # Generate unique filename
         video_filename = f"video_{uuid.uuid4().hex[:8]}.mp4"
@@ -334,93 +291,34 @@ def create_demo_video_with_audio(track_title, visual_style, duration_seconds=15,
         
         # Create actual animated music video content
         if audio_file and os.path.exists(audio_file):
-            # Use uploaded audio file
-            audio_input = ['-i', audio_file]
-            audio_filter = ['-map', '1:a', '-c:a', 'aac']
+            # Use uploaded audio file (its cached decoded PCM when available, skipping the decode),
+            # seeking on the input side to its most energetic window so only that part is decoded
+            from audio_cache import ffmpeg_input_args
+            from audio_analysis import select_highlight
+            try:
+                start_seconds = select_highlight(audio_file, duration_seconds)
+            except Exception as e:
+                print(f"Highlight selection failed, starting at 0:00: {str(e)}")
+                start_seconds = 0.0
+            print(f"Using audio window {start_seconds:.2f}s-{start_seconds + duration_seconds:.2f}s")
+            audio_input = ['-ss', f'{start_seconds:.3f}', '-t', str(duration_seconds)] + ffmpeg_input_args(audio_file)
+            fade_out = max(duration_seconds - HIGHLIGHT_FADE_SECONDS, 0)
+            audio_filter = f'afade=t=in:d={HIGHLIGHT_FADE_SECONDS},afade=t=out:st={fade_out}:d={HIGHLIGHT_FADE_SECONDS}'
         else:
             # Generate synthetic audio
             audio_input = ['-f', 'lavfi', '-i', f'sine=frequency=220:duration={duration_seconds}']
-            audio_filter = ['-c:a', 'aac']
-        
-        if visual_style.lower() == 'cyberpunk':
-            # Cyberpunk: Moving plasma with purple tint
-            cmd = [
-                'ffmpeg', '-y',
-                '-f', 'lavfi', '-i', f'mandelbrot=size=1280x720:rate=25:maxiter=100'
-            ] + audio_input + [
-                '-vf', f'colorchannelmixer=rr=0.3:gg=0.1:bb=0.8:aa=1,trim=duration={duration_seconds}',
-                '-c:v', 'libx264'
-            ] + audio_filter + [
-                '-pix_fmt', 'yuv420p', '-t', str(duration_seconds), '-shortest',
-                output_path
-            ]
-        elif visual_style.lower() == 'cinematic':
-            # Cinematic: Smooth flowing gradients with warm colors
-            cmd = [
-                'ffmpeg', '-y',
-                '-f', 'lavfi', '-i', f'rgbtestsrc=size=1280x720:rate=25'
-            ] + audio_input + [
-                '-vf', f'colorchannelmixer=rr=0.8:gg=0.5:bb=0.2:aa=1,hue=h=30:s=0.8,trim=duration={duration_seconds}',
-                '-c:v', 'libx264'
-            ] + audio_filter + [
-                '-pix_fmt', 'yuv420p', '-t', str(duration_seconds), '-shortest',
-                output_path
-            ]
-        elif visual_style.lower() == 'abstract':
-            # Abstract: Color patterns with movement
-            cmd = [
-                'ffmpeg', '-y',
-                '-f', 'lavfi', '-i', f'smptebars=size=1280x720:rate=25'
-            ] + audio_input + [
-                '-vf', f'colorchannelmixer=rr=0.9:gg=0.2:bb=0.8:aa=1,rotate=angle=PI*t/5,trim=duration={duration_seconds}',
-                '-c:v', 'libx264'
-            ] + audio_filter + [
-                '-pix_fmt', 'yuv420p', '-t', str(duration_seconds), '-shortest',
-                output_path
-            ]
-        elif visual_style.lower() == 'fantasy':
-            # Fantasy: Magical colors and gradients
-            cmd = [
-                'ffmpeg', '-y',
-                '-f', 'lavfi', '-i', f'gradients=size=1280x720:rate=25:c0=purple:c1=pink:c2=gold'
-            ] + audio_input + [
-                '-vf', f'colorchannelmixer=rr=0.9:gg=0.7:bb=0.9:aa=1,hue=h=60:s=1.2,trim=duration={duration_seconds}',
-                '-c:v', 'libx264'
-            ] + audio_filter + [
-                '-pix_fmt', 'yuv420p', '-t', str(duration_seconds), '-shortest',
-                output_path
-            ]
-        else:
-            # Default: Moving test source with blue tint
-            cmd = [
-                'ffmpeg', '-y',
-                '-f', 'lavfi', '-i', f'testsrc=size=1280x720:rate=25'
-            ] + audio_input + [
-                '-vf', f'colorchannelmixer=rr=0.2:gg=0.4:bb=0.9:aa=1,trim=duration={duration_seconds}',
-                '-c:v', 'libx264'
-            ] + audio_filter + [
-                '-pix_fmt', 'yuv420p', '-t', str(duration_seconds), '-shortest',
-                output_path
-            ]
+            audio_filter = None
         
-        print(f"Creating video with FFmpeg: {video_filename}")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-        
-        if result.returncode == 0 and os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-            print(f"Video created successfully: {video_filename} ({os.path.getsize(output_path)} bytes)")
-            return video_filename
-        else:
-            print(f"FFmpeg error: {result.stderr}")
-            raise Exception(f'FFmpeg failed: {result.stderr}')
+        print(f"Creating {resolution} video with FFmpeg: {video_filename}")
+        render_video(output_path, visual_style, duration_seconds, audio_input, audio_filter, resolution=resolution)
+        print(f"Video created successfully: {video_filename} ({os.path.getsize(output_path)} bytes)")
+        return video_filename
             
-    except subprocess.TimeoutExpired:
-        print("Video generation timed out")
-        raise Exception('Video generation timed out')
     except Exception as e:
         print(f"Error creating video: {str(e)}")
         raise e
 
-def generate_video_with_replicate(prompt, duration=5, aspect_ratio="16:9", model="pika_v1"):
+def generate_video_with_replicate(prompt, duration=5, aspect_ratio="16:9", model="pika_v1", resolution="720p"):
     """
     Generate AI video using Replicate API with various video generation models
     """
@@ -432,7 +330,7 @@ def generate_video_with_replicate(prompt, duration=5, aspect_ratio="16:9", model
             REPLICATE_API_TOKEN = REPLICATE_API_TOKEN.split("=")[-1].strip('"\'').strip()
         if not REPLICATE_API_TOKEN:
             print("No Replicate API token, using OpenAI DALL-E for AI video")
-            return generate_video_openai_dalle(prompt, duration, aspect_ratio, model)
+            return generate_video_openai_dalle(prompt, duration, aspect_ratio, model, resolution)
         
         print(f"Initiating Replicate video generation: {prompt}")
         
@@ -499,22 +397,26 @@ def generate_video_with_replicate(prompt, duration=5, aspect_ratio="16:9", model
             print(f"Failed to start Replicate prediction: {response.status_code}")
             print(f"Response content: {response.text}")
             print("Using OpenAI DALL-E for AI video generation instead")
-            return generate_video_openai_dalle(prompt, duration, aspect_ratio, model)
+            return generate_video_openai_dalle(prompt, duration, aspect_ratio, model, resolution)
             
     except Exception as e:
         print(f"Error with Replicate video generation: {str(e)}")
         print("Using OpenAI DALL-E for AI video generation instead")
-        return generate_video_openai_dalle(prompt, duration, aspect_ratio, model)
+        return generate_video_openai_dalle(prompt, duration, aspect_ratio, model, resolution)
 
-def generate_video_openai_dalle(prompt, duration=5, aspect_ratio="16:9", model="dalle"):
+def generate_video_openai_dalle(prompt, duration=5, aspect_ratio="16:9", model="dalle", resolution="720p"):
     """Generate AI video using OpenAI DALL-E for frames + FFmpeg for animation"""
     try:
         import uuid
-        import subprocess
         import requests
         from PIL import Image
         import io
         from openai import OpenAI
+        from video_render import encoder_profile, encoder_args
+        
+        # Frame size and x264 settings for the requested resolution
+        profile = encoder_profile(resolution, duration)
+        width, height = profile['width'], profile['height']
         
         # Use global OpenAI client with timeout configuration
         global client
@@ -524,7 +426,7 @@ def generate_video_openai_dalle(prompt, duration=5, aspect_ratio="16:9", model="
         
         print(f"Task {task_id} - Generating AI video frames with OpenAI DALL-E")
         
-        # Create fewer frames for reliability - DALL-E works but needs time
+        # Create fewer frames for reliability - DALL-E works but needs time (kept in memory as PIL images)
         frames = []
         # Use only 3 frames to avoid timeouts - quality over quantity
         frame_prompts = [
@@ -584,10 +486,7 @@ def generate_video_openai_dalle(prompt, duration=5, aspect_ratio="16:9", model="
         if not client:
             print(f"Task {task_id} - No OpenAI client available, creating descriptive frames")
             for i in range(3):
-                fallback_frame = create_descriptive_frame(1280, 720, frame_prompts[i], i+1)
-                frame_path = f"temp_video_frame_{task_id}_{i}.jpg"
-                fallback_frame.save(frame_path, "JPEG")
-                frames.append(frame_path)
+                frames.append(create_descriptive_frame(width, height, frame_prompts[i], i+1))
         else:
             # Generate 1 REAL AI frame optimized for the style, then create artistic variations
             try:
@@ -609,14 +508,12 @@ def generate_video_openai_dalle(prompt, duration=5, aspect_ratio="16:9", model="
                 image_url = response.data[0].url
                 img_response = requests.get(image_url, timeout=10)
                 ai_img = Image.open(io.BytesIO(img_response.content))
-                ai_img = ai_img.resize((1280, 720), Image.LANCZOS)
+                ai_img = ai_img.resize((width, height), Image.LANCZOS)
                 
                 print(f"Task {task_id} - Master AI frame created! Now creating style variations...")
                 
-                # Save original AI frame
-                frame_path = f"temp_video_frame_{task_id}_0.jpg"
-                ai_img.save(frame_path, "JPEG", quality=85)
-                frames.append(frame_path)
+                # Keep original AI frame
+                frames.append(ai_img)
                 
                 # Create style-specific artistic variations for motion
                 from PIL import ImageEnhance, ImageFilter, ImageOps
@@ -669,9 +566,7 @@ def generate_video_openai_dalle(prompt, duration=5, aspect_ratio="16:9", model="
                             enhancer = ImageEnhance.Saturation(variation)
                             variation = enhancer.enhance(1.2)
                     
-                    frame_path = f"temp_video_frame_{task_id}_{i}.jpg"
-                    variation.save(frame_path, "JPEG", quality=85)
-                    frames.append(frame_path)
+                    frames.append(variation)
                 
                 print(f"Task {task_id} - Created AI frame + {len(frames)-1} {visual_style} style variations!")
                 
@@ -690,12 +585,10 @@ def generate_video_openai_dalle(prompt, duration=5, aspect_ratio="16:9", model="
                     image_url = response.data[0].url
                     img_response = requests.get(image_url, timeout=10)
                     ai_img = Image.open(io.BytesIO(img_response.content))
-                    ai_img = ai_img.resize((1280, 720), Image.LANCZOS)
+                    ai_img = ai_img.resize((width, height), Image.LANCZOS)
                     
-                    # Save original
-                    frame_path = f"temp_video_frame_{task_id}_0.jpg"
-                    ai_img.save(frame_path, "JPEG", quality=85)
-                    frames.append(frame_path)
+                    # Keep original
+                    frames.append(ai_img)
                     
                     # Create artistic variations (not just brightness)
                     from PIL import ImageEnhance, ImageFilter
@@ -712,9 +605,7 @@ def generate_video_openai_dalle(prompt, duration=5, aspect_ratio="16:9", model="
                             enhancer = ImageEnhance.Color(variation)
                             variation = enhancer.enhance(0.8)
                         
-                        frame_path = f"temp_video_frame_{task_id}_{i}.jpg"
-                        variation.save(frame_path, "JPEG", quality=85)
-                        frames.append(frame_path)
+                        frames.append(variation)
                     
                     print(f"Task {task_id} - Created artistic variations from 1 AI frame")
                     
@@ -722,52 +613,19 @@ def generate_video_openai_dalle(prompt, duration=5, aspect_ratio="16:9", model="
                     print(f"Task {task_id} - Fallback also failed: {str(fallback_error)}")
                     # Final fallback to descriptive frames
                     for i in range(3):
-                        fallback_frame = create_descriptive_frame(1280, 720, frame_prompts[i], i+1)
-                        frame_path = f"temp_video_frame_{task_id}_{i}.jpg"
-                        fallback_frame.save(frame_path, "JPEG")
-                        frames.append(frame_path)
+                        frames.append(create_descriptive_frame(width, height, frame_prompts[i], i+1))
         
         # Create video from AI-generated frames - save to static for web serving
         output_filename = f"video_{uuid.uuid4().hex[:8]}.mp4"
         os.makedirs("static/videos/generated", exist_ok=True)
         output_path = os.path.join("static", "videos", "generated", output_filename)
         
-        # Use FFmpeg to create smooth video from frames with transitions
-        frame_duration = duration / len(frames)
-        
-        # Create input list for FFmpeg
-        input_files = []
-        for i, frame in enumerate(frames):
-            input_files.append(f"-loop 1 -t {frame_duration} -i {frame}")
-        
-        inputs = " ".join(input_files)
-        
-        # Create smooth transitions between frames
-        filter_complex = []
-        for i in range(len(frames)):
-            if i == 0:
-                filter_complex.append(f"[{i}:v]scale=1280:720,setpts=PTS-STARTPTS[v{i}]")
-            else:
-                filter_complex.append(f"[{i}:v]scale=1280:720,setpts=PTS-STARTPTS[v{i}]")
-        
-        # Concatenate all frames
-        concat_inputs = "".join([f"[v{i}]" for i in range(len(frames))])
-        filter_complex.append(f"{concat_inputs}concat=n={len(frames)}:v=1:a=0,fps=24[out]")
-        
-        filter_string = ";".join(filter_complex)
-        
-        cmd = f"""ffmpeg -y {inputs} \
-            -filter_complex "{filter_string}" \
-            -map "[out]" -c:v libx264 -pix_fmt yuv420p -t {duration} "{output_path}" """
-        
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        
-        # Clean up temporary frames
-        for frame in frames:
-            try:
-                os.remove(frame)
-            except:
-                pass
+        # Stream the frames as raw RGB into ffmpeg, each held for an equal share of the duration:
+        # every still is written once and ffmpeg repeats it up to 24 fps, cut at exactly duration
+        with FrameSink(output_path, width, height, fps=24, encoder_args=encoder_args(profile, fps=24),
+                       timeout=profile['timeout'], input_fps=len(frames) / duration, duration=duration) as sink:
+            for frame in frames:
+                sink.write(frame)
         
         if os.path.exists(output_path):
             file_size = os.path.getsize(output_path)
@@ -958,11 +816,11 @@ def generate_video_with_ffmpeg(prompt, duration=5, aspect_ratio="16:9", model="f
         }
 
 # Keep the original function name for backwards compatibility
-def generate_video_with_runway(prompt, duration=5, aspect_ratio="16:9", model="gen4_turbo"):
+def generate_video_with_runway(prompt, duration=5, aspect_ratio="16:9", model="gen4_turbo", resolution="720p"):
     """
     Main video generation function - tries Replicate first, falls back to FFmpeg
     """
-    return generate_video_with_replicate(prompt, duration, aspect_ratio, model)
+    return generate_video_with_replicate(prompt, duration, aspect_ratio, model, resolution)
 
 def create_video_thumbnail(task_id, prompt):
     """
@@ -0,0 +1,140 @@
+"""
+Cache of finished mastering renders.
+
+Users re-submit the same template and EQ constantly while toggling, so a finished
+mastered file is kept under a key of (source content hash, template, canonical EQ
+settings). An entry holds every final deliverable (the 320k MP3 and the 24-bit WAV) and
+the render's waveform peaks; a hit hard-links them to the new job's output names, so it
+completes without rendering, decoding or another copy on disk. Entries live in a
+.result_cache directory next to the uploads and are evicted least-recently-used once
+they exceed RESULT_CACHE_MAX_BYTES.
+"""
+import os
+import json
+import shutil
+import hashlib
+import logging
+from audio_cache import file_sha256, evict_lru
+from audio_processor import FINAL_FORMATS
+from waveform_peaks import peaks_path, PEAKS_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_DIRNAME = '.result_cache'
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+
+# Bump when the mastering chain changes so renders from the old chain are no longer served
+RESULT_CACHE_VERSION = 5
+
+# An entry's MP3 is its data file (what eviction and usage count entries by); the other
+# finals sit next to it under their format's name, and the peaks as the MP3's sidecar
+RESULT_SUFFIX = '.audio'
+COMPANION_SUFFIXES = tuple(f'.{fmt}' for fmt in FINAL_FORMATS if fmt != 'mp3') + (RESULT_SUFFIX + PEAKS_SUFFIX,)
+
+def canonical_eq_settings(eq_settings):
+    """
+    EQ settings in a canonical form: numeric strings parsed and rounded, empty values dropped,
+    so {'bass': '3'} and {'bass': 3.0} share a cache entry. Raises ValueError if eq_settings
+    is not a dict
+    """
+    eq_settings = eq_settings or {}
+    if not isinstance(eq_settings, dict):
+        raise ValueError(f'eq_settings must be a dict, not {type(eq_settings).__name__}')
+    canonical = {}
+    for key, value in eq_settings.items():
+        if value is None or value == '':
+            continue
+        try:
+            canonical[key] = round(float(value), 4)
+        except (TypeError, ValueError):
+            canonical[key] = value
+    return canonical
+
+def result_key(source_path, template, eq_settings):
+    payload = json.dumps({
+        'version': RESULT_CACHE_VERSION,
+        'source': file_sha256(source_path),
+        'template': template,
+        'eq_settings': canonical_eq_settings(eq_settings)
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def result_cache_dir(source_path):
+    return os.path.join(os.path.dirname(os.path.abspath(source_path)), RESULT_CACHE_DIRNAME)
+
+def _entry_paths(cache_dir, key):
+    """({format: cached render path}, header path) of an entry"""
+    base = os.path.join(cache_dir, key)
+    return {fmt: base + (RESULT_SUFFIX if fmt == 'mp3' else f'.{fmt}') for fmt in FINAL_FORMATS}, base + '.json'
+
+def lookup_result(source_path, template, eq_settings):
+    """
+    Return ({format: cached render path}, metadata) for a previously rendered job, or None on a miss
+    """
+    render_paths, header_path = _entry_paths(result_cache_dir(source_path),
+                                             result_key(source_path, template, eq_settings))
+    try:
+        with open(header_path) as f:
+            metadata = json.load(f)
+        # Touch so eviction sees this entry as recently used
+        os.utime(render_paths['mp3'])
+    except (OSError, ValueError):
+        return None
+    return render_paths, metadata
+
+def link_result(render_path, output_path):
+    """Give a job its own name for a cached render: a hard link, or a copy across filesystems"""
+    if os.path.exists(output_path):
+        if os.path.samefile(render_path, output_path):
+            return
+        os.remove(output_path)
+    try:
+        os.link(render_path, output_path)
+    except OSError:
+        shutil.copyfile(render_path, output_path)
+
+def store_result(source_path, template, eq_settings, outputs, metadata):
+    """
+    Add a finished render's final deliverables ({format: path}) and the MP3's peaks sidecar to the
+    cache (hard-linked, so they cost no extra disk while the job keeps them)
+    """
+    missing = set(FINAL_FORMATS) - set(outputs)
+    if missing:
+        logger.warning(f"Not caching a render without its {', '.join(sorted(missing))} deliverable")
+        return
+    cache_dir = result_cache_dir(source_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    render_paths, header_path = _entry_paths(cache_dir, result_key(source_path, template, eq_settings))
+    tmp_suffix = f'.tmp{os.getpid()}'
+
+    sources = {render_paths[fmt]: outputs[fmt] for fmt in FINAL_FORMATS}
+    if os.path.exists(peaks_path(outputs['mp3'])):
+        sources[peaks_path(render_paths['mp3'])] = peaks_path(outputs['mp3'])
+    for render_path, output_path in sources.items():
+        try:
+            os.link(output_path, render_path + tmp_suffix)
+        except OSError:
+            shutil.copyfile(output_path, render_path + tmp_suffix)
+    with open(header_path + tmp_suffix, 'w') as f:
+        json.dump(metadata, f)
+
+    # Publish data first, header last, so lookups never see a partial entry
+    for render_path in sources:
+        os.replace(render_path + tmp_suffix, render_path)
+    os.replace(header_path + tmp_suffix, header_path)
+    evict_lru(cache_dir, RESULT_CACHE_MAX_BYTES, data_suffix=RESULT_SUFFIX, companion_suffixes=COMPANION_SUFFIXES)
+
+def result_cache_usage(upload_folder):
+    """Entries, bytes used and the byte budget of the result cache for an upload folder"""
+    cache_dir = os.path.join(upload_folder, RESULT_CACHE_DIRNAME)
+    entries = 0
+    total = 0
+    if os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            if name.endswith((RESULT_SUFFIX,) + COMPANION_SUFFIXES):
+                try:
+                    total += os.path.getsize(os.path.join(cache_dir, name))
+                except OSError:
+                    continue
+                entries += name.endswith(RESULT_SUFFIX)
+    return {'entries': entries, 'bytes': total, 'max_bytes': RESULT_CACHE_MAX_BYTES}
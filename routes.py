@@ -1,12 +1,23 @@
 import os
+import math
 import uuid
 import json
 from flask import render_template, request, jsonify, redirect, url_for, flash, session, send_file
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.utils import secure_filename
 from app import app, db
 from models import User, CoverArt, VocalMaster, VideoGeneration
-from openai_integration import generate_cover_art_image, generate_with_midjourney, generate_with_stable_diffusion, generate_with_dreamshaper, generate_with_playground, download_and_save_image, generate_video_with_runway, download_and_save_video, create_demo_video_with_audio
+from openai_integration import generate_cover_art_image, generate_with_midjourney, generate_with_stable_diffusion, generate_with_dreamshaper, generate_with_playground, download_and_save_image, generate_video_with_runway, download_and_save_video
+from mastering_jobs import enqueue_mastering_job, enqueue_mastering_jobs, queue_position, result_cache_stats
+from audio_processor import get_audio_info, render_excerpt, encode_wav_bytes, EXCERPT_SECONDS, MASTERING_TEMPLATES
+from upload_ingest import ingest_audio_upload, UploadRejected
+from blob_store import release_blob
+from waveform_peaks import peaks_path, compute_peaks_in_background
+from audio_analysis import compute_analysis_in_background
+from media_workers import usage_percentiles, run_isolated
+from video_render import RESOLUTIONS as VIDEO_RESOLUTIONS, encoder_profile
+from video_backgrounds import background_cache_usage
+from video_jobs import enqueue_video_job, queue_full as video_queue_full, \
+    queue_position as video_queue_position, estimated_seconds_remaining, render_limits, DURATION_SECONDS
 import stripe
 import time
 import random
@@ -14,6 +25,10 @@ import random
 # Allowed file extensions for audio uploads
 ALLOWED_EXTENSIONS = {'mp3', 'wav', 'flac', 'm4a', 'aac'}
 
+# Templates rendered by a batch mastering request when none are specified
+BATCH_TEMPLATES = ['Radio Ready', 'Club Banger', 'Vintage Warmth', 'Vocal Focused', 'Bass Heavy']
+MAX_BATCH_VARIANTS = 10
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -226,23 +241,7 @@ def generate_prompt():
 @app.route('/api/upload-audio', methods=['POST'])
 def upload_audio():
     try:
-        if 'audio' not in request.files:
-            return jsonify({'error': 'No audio file provided'}), 400
-
-        file = request.files['audio']
-        track_title = request.form.get('track_title', '').strip()
-        template = request.form.get('template', 'Radio Ready')
-
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
-
-        if not track_title:
-            return jsonify({'error': 'Track title is required'}), 400
-
-        if not allowed_file(file.filename):
-            return jsonify({'error': 'Invalid file format. Supported formats: MP3, WAV, FLAC, M4A, AAC'}), 400
-
-        # Check token balance
+        # Check token balance before accepting the body
         if current_user.is_authenticated:
             current_tokens = current_user.tokens
         else:
@@ -251,20 +250,32 @@ def upload_audio():
         if current_tokens <= 0:
             return jsonify({'error': 'Insufficient tokens. Please purchase more tokens.'}), 402
 
-        # Save uploaded file
-        if not file.filename:
-            return jsonify({'error': 'Invalid file'}), 400
-        filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4().hex}_{filename}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(file_path)
+        # Stream the upload straight into the upload folder, validating it as it arrives
+        try:
+            form, upload = ingest_audio_upload(('audio', 'audio_file'), allowed_file)
+        except UploadRejected as e:
+            return jsonify({'error': str(e)}), e.status_code
+
+        track_title = form.get('track_title', '').strip()
+        template = form.get('template', 'Radio Ready')
+        unique_filename = upload['filename']
+        file_path = upload['path']
+
+        if not track_title:
+            if not upload['deduplicated']:
+                release_blob(unique_filename)
+            return jsonify({'error': 'Track title is required'}), 400
+
+        audio_info = get_audio_info(file_path)
+        compute_peaks_in_background(file_path)
+        compute_analysis_in_background(file_path)
 
         # Create vocal master record
         vocal_master = VocalMaster()
         vocal_master.track_title = track_title
         vocal_master.original_file = unique_filename
         vocal_master.template = template
-        vocal_master.status = 'processing'
+        vocal_master.status = 'uploaded'
 
         db.session.add(vocal_master)
         db.session.commit()
@@ -282,6 +293,9 @@ def upload_audio():
             'success': True,
             'job_id': vocal_master.id,
             'message': 'File uploaded successfully. Processing will begin shortly.',
+            'audio_info': audio_info,
+            'peaks_url': f'/audio/{vocal_master.id}/original/peaks',
+            'deduplicated': upload['deduplicated'],
             'tokens_remaining': tokens_remaining
         })
 
@@ -292,54 +306,148 @@ def upload_audio():
 @app.route('/api/start-mastering', methods=['POST'])
 def start_mastering():
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Request body must be a JSON object'}), 400
         job_id = data.get('job_id')
-        eq_settings = data.get('eq_settings', {})
+        eq_settings = data.get('eq_settings') or {}
+        if not isinstance(eq_settings, dict):
+            return jsonify({'error': 'eq_settings must be an object'}), 400
 
         vocal_master = VocalMaster.query.get(job_id)
         if not vocal_master:
             return jsonify({'error': 'Job not found'}), 404
 
-        # Update EQ settings and start processing
+        if vocal_master.status in ('queued', 'running'):
+            return jsonify({'error': 'Job is already being processed'}), 409
+
+        # Store EQ settings and hand the render to the background workers (or the result cache)
         vocal_master.eq_settings = eq_settings
-        vocal_master.status = 'processing'
-        db.session.commit()
+        enqueue_mastering_job(vocal_master)
 
-        # Simulate processing delay
-        time.sleep(3)
+        return jsonify({
+            'success': True,
+            'status': vocal_master.status,
+            'job_id': vocal_master.id,
+            'queue_position': queue_position(vocal_master),
+            'cache_hit': bool(vocal_master.cache_hit),
+            'status_url': f'/api/job-status/{vocal_master.id}'
+        }), 200 if vocal_master.status == 'completed' else 202
 
-        # Apply real audio mastering processing
-        from audio_processor import apply_vocal_mastering
-        
+    except Exception as e:
+        app.logger.error(f"Error starting mastering: {str(e)}")
+        return jsonify({'error': 'Failed to start mastering process'}), 500
+
+@app.route('/api/preview-excerpt', methods=['POST'])
+def preview_excerpt():
+    """Render a few seconds around the playhead with unsaved EQ settings, for live slider feedback"""
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Request body must be a JSON object'}), 400
+        eq_settings = data.get('eq_settings') or {}
+        if not isinstance(eq_settings, dict):
+            return jsonify({'error': 'eq_settings must be an object'}), 400
+        try:
+            position = float(data.get('position', 0))
+            duration = float(data.get('duration', EXCERPT_SECONDS))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid position or duration'}), 400
+        if not (math.isfinite(position) and math.isfinite(duration)):
+            return jsonify({'error': 'Invalid position or duration'}), 400
+
+        vocal_master = VocalMaster.query.get(data.get('job_id'))
+        if not vocal_master:
+            return jsonify({'error': 'Job not found'}), 404
+
+        template = data.get('template') or vocal_master.template
+        if template not in MASTERING_TEMPLATES:
+            return jsonify({'error': f'Unknown template: {template}'}), 400
+
+        template_settings = {'template': template, 'eq_settings': eq_settings}
         original_path = os.path.join(app.config['UPLOAD_FOLDER'], vocal_master.original_file)
-        mastered_filename = f"mastered_{vocal_master.original_file}"
-        mastered_path = os.path.join(app.config['UPLOAD_FOLDER'], mastered_filename)
-        
-        # Apply template-specific audio processing
-        template_settings = {
-            'template': vocal_master.template,
-            'eq_settings': eq_settings
-        }
-        
-        success = apply_vocal_mastering(original_path, mastered_path, template_settings)
-        if not success:
-            return jsonify({'error': 'Audio processing failed'}), 500
-        
-        # Mark as completed
-        vocal_master.status = 'completed'
-        vocal_master.mastered_file = mastered_filename
-        db.session.commit()
+        mastered, sample_rate, start, loudness = render_excerpt(original_path, template_settings, position, duration)
+
+        response = app.response_class(encode_wav_bytes(mastered, sample_rate), mimetype='audio/wav')
+        response.headers['Cache-Control'] = 'no-store'
+        response.headers['X-Excerpt-Start'] = f'{start:.3f}'
+        if loudness['integrated_lufs'] is not None:
+            response.headers['X-Excerpt-LUFS'] = f"{loudness['integrated_lufs']:.1f}"
+        return response
+
+    except Exception as e:
+        app.logger.error(f"Error rendering excerpt preview: {str(e)}")
+        return jsonify({'error': 'Failed to render preview'}), 500
+
+@app.route('/api/batch-mastering', methods=['POST'])
+def batch_mastering():
+    """Master one upload with several templates/EQ presets from a single decode"""
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Request body must be a JSON object'}), 400
+        job_id = data.get('job_id')
+        variants = data.get('variants') or [{'template': template} for template in BATCH_TEMPLATES]
+
+        vocal_master = VocalMaster.query.get(job_id)
+        if not vocal_master:
+            return jsonify({'error': 'Job not found'}), 404
+
+        if not isinstance(variants, list) or len(variants) > MAX_BATCH_VARIANTS:
+            return jsonify({'error': f'Provide a list of up to {MAX_BATCH_VARIANTS} variants'}), 400
+        for index, variant in enumerate(variants):
+            if not isinstance(variant, dict):
+                return jsonify({'error': f'Variant {index + 1} must be an object'}), 400
+            template = variant.get('template', vocal_master.template)
+            if template not in MASTERING_TEMPLATES:
+                return jsonify({'error': f'Variant {index + 1} has an unknown template: {template}'}), 400
+            if not isinstance(variant.get('eq_settings') or {}, dict):
+                return jsonify({'error': f'Variant {index + 1} eq_settings must be an object'}), 400
+
+        # One VocalMaster row per variant, all pointing at the same upload
+        batch_id = uuid.uuid4().hex
+        jobs = []
+        for variant in variants:
+            job = VocalMaster()
+            job.user_id = vocal_master.user_id
+            job.track_title = vocal_master.track_title
+            job.original_file = vocal_master.original_file
+            job.template = variant.get('template', vocal_master.template)
+            job.eq_settings = variant.get('eq_settings') or {}
+            job.batch_id = batch_id
+            db.session.add(job)
+            jobs.append(job)
+
+        enqueue_mastering_jobs(jobs)
 
         return jsonify({
             'success': True,
-            'status': 'completed',
-            'original_audio_url': f'/audio/{vocal_master.id}/original',
-            'mastered_audio_url': f'/audio/{vocal_master.id}/mastered'
-        })
+            'batch_id': batch_id,
+            'job_ids': [job.id for job in jobs],
+            'status_url': f'/api/batch-status/{batch_id}'
+        }), 202
 
     except Exception as e:
-        app.logger.error(f"Error starting mastering: {str(e)}")
-        return jsonify({'error': 'Failed to start mastering process'}), 500
+        app.logger.error(f"Error starting batch mastering: {str(e)}")
+        return jsonify({'error': 'Failed to start batch mastering'}), 500
+
+@app.route('/api/batch-status/<batch_id>')
+def batch_status(batch_id):
+    jobs = VocalMaster.query.filter_by(batch_id=batch_id).order_by(VocalMaster.id).all()
+    if not jobs:
+        return jsonify({'error': 'Batch not found'}), 404
+
+    return jsonify({
+        'batch_id': batch_id,
+        'completed': sum(1 for job in jobs if job.status == 'completed'),
+        'total': len(jobs),
+        'jobs': [{
+            'job_id': job.id,
+            'template': job.template,
+            'status': job.status,
+            'mastered_url': f'/audio/{job.id}/mastered' if job.status == 'completed' else None
+        } for job in jobs]
+    })
 
 @app.route('/api/job-status/<int:job_id>')
 def job_status(job_id):
@@ -347,12 +455,31 @@ def job_status(job_id):
     if not vocal_master:
         return jsonify({'error': 'Job not found'}), 404
 
+    completed = vocal_master.status == 'completed'
+    preview_ready = vocal_master.status == 'running' and bool(vocal_master.preview_file)
+    playable = completed or preview_ready
+
     return jsonify({
         'status': vocal_master.status,
+        'progress': vocal_master.progress or 0,
+        'queue_position': queue_position(vocal_master),
+        'error': vocal_master.error_message if vocal_master.status == 'failed' else None,
+        'loudness': vocal_master.loudness if vocal_master.status == 'completed' else None,
+        'cache_hit': vocal_master.cache_hit,
+        'resource_usage': vocal_master.resource_usage,
         'track_title': vocal_master.track_title,
         'created_at': vocal_master.created_at.isoformat(),
-        'original_url': f'/audio/{job_id}/original' if vocal_master.status == 'completed' else None,
-        'mastered_url': f'/audio/{job_id}/mastered' if vocal_master.status == 'completed' else None
+        'preview_ready': preview_ready,
+        'original_url': f'/audio/{job_id}/original' if playable else None,
+        'mastered_url': f'/audio/{job_id}/mastered' if playable else None,
+        'downloads': {fmt: f'/audio/{job_id}/{fmt}' for fmt in (vocal_master.deliverables or {})
+                      if fmt != 'preview'} if completed else None,
+        'peaks_urls': {
+            'original': f'/audio/{job_id}/original/peaks',
+            # Versioned by render time so the long-lived cache never serves a previous render's peaks
+            'mastered': f'/audio/{job_id}/mastered/peaks?v={int(vocal_master.completed_at.timestamp())}'
+            if completed and vocal_master.completed_at else None
+        }
     })
 
 @app.route('/api/enable-mastered/<int:job_id>')
@@ -383,12 +510,17 @@ def serve_audio(job_id, audio_type):
     if not vocal_master:
         return "Audio file not found", 404
     
+    preview = False
     if audio_type == 'original':
         filename = vocal_master.original_file
     elif audio_type == 'mastered':
-        if not vocal_master.mastered_file:
+        # Until the final render lands, play the quick preview
+        preview = vocal_master.status != 'completed'
+        filename = vocal_master.preview_file if preview else vocal_master.mastered_file
+        if not filename:
             return "Mastered file not ready", 404
-        filename = vocal_master.mastered_file
+    elif vocal_master.status == 'completed' and audio_type in (vocal_master.deliverables or {}):
+        filename = vocal_master.deliverables[audio_type]
     else:
         return "Invalid audio type", 400
     
@@ -397,7 +529,54 @@ def serve_audio(job_id, audio_type):
         return "File not found", 404
     
     from flask import send_file
-    return send_file(file_path)
+    response = send_file(file_path)
+    if preview:
+        # The same URL serves the final file later, so never let the preview be cached
+        response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/audio/<int:job_id>/<audio_type>/peaks')
+def serve_audio_peaks(job_id, audio_type):
+    """
+    Serve the waveform peaks sidecar (see waveform_peaks.py) for original or mastered audio;
+    202 while a missing sidecar is being computed
+    """
+    vocal_master = VocalMaster.query.get(job_id)
+    if not vocal_master:
+        return "Audio file not found", 404
+
+    if audio_type == 'original':
+        filename = vocal_master.original_file
+        # Uploads are content-addressed, so their peaks never change
+        immutable = True
+    elif audio_type == 'mastered':
+        if vocal_master.status != 'completed' or not vocal_master.mastered_file:
+            return "Mastered file not ready", 404
+        filename = vocal_master.mastered_file
+        immutable = bool(request.args.get('v'))
+    else:
+        return "Invalid audio type", 400
+
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if not os.path.exists(file_path):
+        return "File not found", 404
+    sidecar_path = peaks_path(file_path)
+    if not os.path.exists(sidecar_path):
+        # Renders write their sidecar (or link the cached one), so this is an upload still being
+        # processed or an older job: compute it in a media worker, never in this request. Only
+        # uploads go through the PCM cache; renders are streamed from the file
+        compute_peaks_in_background(file_path, cache_decode=audio_type == 'original')
+        response = jsonify({'status': 'pending'})
+        response.status_code = 202
+        response.headers['Retry-After'] = '2'
+        return response
+
+    response = send_file(os.path.abspath(sidecar_path), mimetype='application/octet-stream')
+    if immutable:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/download/<int:job_id>')
 def download_file(job_id):
@@ -598,25 +777,6 @@ def check_video_status(job_id):
 @app.route('/api/upload-video-audio', methods=['POST'])
 def upload_video_audio():
     try:
-        if 'audio_file' not in request.files:
-            return jsonify({'error': 'No audio file provided'}), 400
-
-        file = request.files['audio_file']
-        track_title = request.form.get('track_title', '').strip()
-        visual_style = request.form.get('visual_style', 'Cinematic')
-        scene_prompt = request.form.get('scene_prompt', '').strip()
-        duration = request.form.get('duration', '30s')
-        resolution = request.form.get('resolution', '1080p')
-
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
-
-        if not track_title:
-            return jsonify({'error': 'Track title is required'}), 400
-
-        if not allowed_file(file.filename):
-            return jsonify({'error': 'Invalid file format. Supported formats: MP3, WAV, FLAC, M4A, AAC'}), 400
-
         # Check token balance - Premium AI video generation with profit margin
         if current_user.is_authenticated:
             current_tokens = current_user.tokens
@@ -627,13 +787,37 @@ def upload_video_audio():
         if current_tokens < video_cost:
             return jsonify({'error': f'Insufficient tokens. Affordable AI video generation requires {video_cost} tokens.'}), 402
 
-        # Save uploaded file
-        if not file.filename:
-            return jsonify({'error': 'Invalid file'}), 400
-        filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4().hex}_{filename}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(file_path)
+        # Admission control: refuse before reading the body when the render queue is full
+        if video_queue_full():
+            response = jsonify({'error': 'Video rendering is at capacity. Please try again in a minute.'})
+            response.headers['Retry-After'] = '60'
+            return response, 429
+
+        # Stream the upload straight into the upload folder, validating it as it arrives
+        try:
+            form, upload = ingest_audio_upload(('audio_file',), allowed_file)
+        except UploadRejected as e:
+            return jsonify({'error': str(e)}), e.status_code
+
+        track_title = form.get('track_title', '').strip()
+        visual_style = form.get('visual_style', 'Cinematic')
+        scene_prompt = form.get('scene_prompt', '').strip()
+        duration = form.get('duration', '30s')
+        resolution = form.get('resolution', '1080p')
+        unique_filename = upload['filename']
+        file_path = upload['path']
+
+        if not track_title:
+            if not upload['deduplicated']:
+                release_blob(unique_filename)
+            return jsonify({'error': 'Track title is required'}), 400
+
+        if resolution not in VIDEO_RESOLUTIONS:
+            if not upload['deduplicated']:
+                release_blob(unique_filename)
+            return jsonify({'error': f"Resolution must be one of: {', '.join(VIDEO_RESOLUTIONS)}"}), 400
+
+        compute_analysis_in_background(file_path)
 
         # Create video generation record
         video_gen = VideoGeneration()
@@ -657,52 +841,20 @@ def upload_video_audio():
             session['tokens'] = current_tokens - video_cost
             tokens_remaining = session['tokens']
 
-        # Convert duration to seconds
-        duration_map = {'15s': 15, '30s': 30, '1min': 60}
-        duration_seconds = duration_map.get(duration, 15)
+        # Render in the bounded video render pool; the page polls /api/video-job-status/<id>
+        enqueue_video_job(video_gen)
 
-        try:
-            # CRITICAL FIX: Generate video with uploaded audio file
-            video_filename = create_demo_video_with_audio(
-                track_title=track_title,
-                visual_style=visual_style,
-                duration_seconds=duration_seconds,
-                audio_file=file_path  # Use the uploaded audio file!
-            )
-            
-            # Update database with completed video
-            video_gen.status = 'completed'
-            video_gen.video_file = video_filename
-            db.session.commit()
-            
-            video_url = f'/static/videos/generated/{video_filename}'
-            video_path = f"static/videos/generated/{video_filename}"
-            file_size = os.path.getsize(video_path) if os.path.exists(video_path) else 0
-            
-            return jsonify({
-                'success': True,
-                'status': 'completed',
-                'job_id': video_gen.id,
-                'video_url': video_url,
-                'preview_url': video_url,
-                'duration': duration_seconds,
-                'file_size': file_size,
-                'tokens_remaining': tokens_remaining,
-                'message': 'Video generated successfully with your audio!'
-            })
-            
-        except Exception as e:
-            # Mark video generation as failed
-            video_gen.status = 'failed'
-            db.session.commit()
-            app.logger.error(f"Video generation failed: {str(e)}")
-            
-            return jsonify({
-                'success': False,
-                'job_id': video_gen.id,
-                'error': f'Video generation failed: {str(e)}',
-                'tokens_remaining': tokens_remaining
-            }), 500
+        return jsonify({
+            'success': True,
+            'status': video_gen.status,
+            'job_id': video_gen.id,
+            'queue_position': video_queue_position(video_gen),
+            'eta_seconds': estimated_seconds_remaining(video_gen),
+            'duration': DURATION_SECONDS.get(duration, 15),
+            'status_url': f'/api/video-job-status/{video_gen.id}',
+            'tokens_remaining': tokens_remaining,
+            'message': 'Video queued for rendering with your audio'
+        }), 202
 
     except Exception as e:
         app.logger.error(f"Error uploading video audio: {str(e)}")
@@ -777,13 +929,24 @@ def start_video_generation():
         # Convert resolution to aspect ratio
         aspect_ratio = "16:9" if video_gen.resolution in ['720p', '1080p'] else "1:1"
         
-        # Generate video using Runway ML
-        result = generate_video_with_runway(
-            prompt=enhanced_prompt,
-            duration=min(duration_seconds, 10),  # Runway max is 10 seconds
-            aspect_ratio=aspect_ratio,
-            model=visual_style
-        )
+        # Generate video using Runway ML, in a resource-limited media worker (the DALL-E fallback
+        # encodes its frames there) so the job's resource usage is recorded like a queued render's
+        generation_seconds = min(duration_seconds, 10)  # Runway max is 10 seconds
+        cpu_seconds, wall_seconds = render_limits(encoder_profile(video_gen.resolution, generation_seconds))
+        usage = {}
+        try:
+            result = run_isolated(
+                generate_video_with_runway,
+                prompt=enhanced_prompt,
+                duration=generation_seconds,
+                aspect_ratio=aspect_ratio,
+                model=visual_style,
+                resolution=video_gen.resolution,
+                usage=usage, cpu_seconds=cpu_seconds, wall_seconds=wall_seconds
+            )
+        finally:
+            # Committed with the outcome below (or by the failure handler)
+            video_gen.resource_usage = usage
         
         if result.get('status') == 'processing':
             # Store prediction ID for status checking
@@ -867,7 +1030,11 @@ def video_job_status(job_id):
         'status': video_gen.status,
         'track_title': video_gen.track_title,
         'visual_style': video_gen.visual_style,
-        'created_at': video_gen.created_at.isoformat()
+        'created_at': video_gen.created_at.isoformat(),
+        'resource_usage': video_gen.resource_usage,
+        'queue_position': video_queue_position(video_gen),
+        'eta_seconds': estimated_seconds_remaining(video_gen),
+        'error': video_gen.error_message if video_gen.status == 'failed' else None
     }
     
     # Add video URL if completed
@@ -882,6 +1049,48 @@ def video_job_status(job_id):
         
     return jsonify(response)
 
+@app.route('/api/resource-usage')
+def resource_usage_summary():
+    """Resource usage percentiles of recent renders, per mastering template and per video style"""
+    try:
+        limit = min(max(request.args.get('limit', 1000, type=int), 1), 10000)
+
+        def summarize(rows, key):
+            groups = {}
+            for row in rows:
+                if row.resource_usage:
+                    groups.setdefault(key(row), []).append(row.resource_usage)
+            return {name: {'jobs': len(usages), **usage_percentiles(usages)} for name, usages in groups.items()}
+
+        mastering = VocalMaster.query.filter(VocalMaster.status.in_(['completed', 'failed'])) \
+            .order_by(VocalMaster.id.desc()).limit(limit).all()
+        videos = VideoGeneration.query.filter(VideoGeneration.status.in_(['completed', 'failed'])) \
+            .order_by(VideoGeneration.id.desc()).limit(limit).all()
+        return jsonify({
+            'mastering': summarize(mastering, lambda vocal_master: vocal_master.template),
+            'video': summarize(videos, lambda video_gen: video_gen.visual_style)
+        })
+
+    except Exception as e:
+        app.logger.error(f"Error summarizing resource usage: {str(e)}")
+        return jsonify({'error': 'Failed to summarize resource usage'}), 500
+
+@app.route('/api/cache-stats')
+def cache_stats():
+    """
+    Result cache hit rate and disk usage plus background clip cache usage. Kept off the job
+    status endpoints, which are polled, because both walk their cache directories
+    """
+    try:
+        return jsonify({
+            'result_cache': result_cache_stats(),
+            'background_cache': background_cache_usage()
+        })
+
+    except Exception as e:
+        app.logger.error(f"Error reading cache stats: {str(e)}")
+        return jsonify({'error': 'Failed to read cache stats'}), 500
+
 @app.route('/api/video-status/<int:job_id>')
 def video_status(job_id):
     """Alias for video job status"""
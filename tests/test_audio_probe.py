@@ -0,0 +1,14 @@
+"""
+Format sniffing must reject or ask for more data on truncated input, never crash.
+"""
+import pytest
+from audio_probe import sniff_audio_format
+
+@pytest.mark.parametrize('tail', [b'\xff', b'\xff\xfb', b'\xff\xfb\x90'])
+def test_sync_byte_at_end_of_complete_file_is_rejected(tail):
+    with pytest.raises(ValueError):
+        sniff_audio_format(b'\x00' * 100 + tail, complete=True)
+
+@pytest.mark.parametrize('tail', [b'\xff', b'\xff\xfb', b'\xff\xfb\x90'])
+def test_sync_byte_at_end_of_partial_head_needs_more(tail):
+    assert sniff_audio_format(b'\x00' * 100 + tail) is None
@@ -0,0 +1,44 @@
+"""
+/api/preview-excerpt rejects malformed requests with 400 instead of failing inside the render.
+"""
+import os
+import tempfile
+import pytest
+
+# Point the app at a throwaway database before it is imported (it creates its tables on import)
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db'))
+
+from app import app, db
+from models import VocalMaster
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    return app.test_client()
+
+@pytest.fixture
+def job_id():
+    with app.app_context():
+        vocal_master = VocalMaster(track_title='Test', original_file='test.wav', template='Radio Ready')
+        db.session.add(vocal_master)
+        db.session.commit()
+        return vocal_master.id
+
+def test_non_object_body_is_rejected(client):
+    assert client.post('/api/preview-excerpt', json=[1, 2]).status_code == 400
+    assert client.post('/api/preview-excerpt', data='job_id=1').status_code == 400
+
+def test_non_object_eq_settings_is_rejected(client, job_id):
+    response = client.post('/api/preview-excerpt', json={'job_id': job_id, 'eq_settings': [1, 2]})
+    assert response.status_code == 400
+
+@pytest.mark.parametrize('field, value', [('position', 'nan'), ('position', 'inf'), ('duration', '-inf'),
+                                          ('position', 'x')])
+def test_non_finite_position_or_duration_is_rejected(client, job_id, field, value):
+    response = client.post('/api/preview-excerpt', json={'job_id': job_id, field: value})
+    assert response.status_code == 400
+
+def test_unknown_template_is_rejected(client, job_id):
+    response = client.post('/api/preview-excerpt', json={'job_id': job_id, 'template': 'Nope'})
+    assert response.status_code == 400
+    assert 'Nope' in response.get_json()['error']
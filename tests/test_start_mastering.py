@@ -0,0 +1,36 @@
+"""
+/api/start-mastering rejects malformed requests with 400 before touching the job or the result cache.
+"""
+import os
+import tempfile
+import pytest
+
+# Point the app at a throwaway database before it is imported (it creates its tables on import)
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db'))
+
+from app import app
+from result_cache import canonical_eq_settings
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    return app.test_client()
+
+@pytest.mark.parametrize('eq_settings', [[1, 2], 'x', 3])
+def test_non_object_eq_settings_is_rejected(client, eq_settings):
+    response = client.post('/api/start-mastering', json={'job_id': 1, 'eq_settings': eq_settings})
+
+    assert response.status_code == 400
+    assert 'eq_settings' in response.get_json()['error']
+
+@pytest.mark.parametrize('body', [[1, 2], 'x', None])
+def test_non_object_body_is_rejected(client, body):
+    response = client.post('/api/start-mastering', json=body)
+
+    assert response.status_code == 400
+
+def test_canonical_eq_settings_rejects_non_dict():
+    assert canonical_eq_settings(None) == {}
+    assert canonical_eq_settings({'bass': '3'}) == canonical_eq_settings({'bass': 3.0})
+    with pytest.raises(ValueError):
+        canonical_eq_settings([1, 2])
@@ -0,0 +1,112 @@
+"""
+Memory ceiling of mastering: a 60-minute upload must stream in memory bounded by the block size,
+not the track length, and an in-memory render may only add its output buffer to that.
+"""
+import os
+import sys
+import json
+import wave
+import textwrap
+import subprocess
+import numpy as np
+import pytest
+import audio_probe
+from audio_processor import STREAM_BLOCK_FRAMES, should_stream
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_RATE = 44100
+DURATION_SECONDS = 60 * 60
+
+# Peak RSS growth allowed, in mono float32 blocks: the block, the filter, compressor, oversampled
+# limiter and meter copies made from it, plus the small per-chunk waveform and loudness summaries.
+# The whole track decoded would be about 2400 blocks
+MAX_WORKING_BLOCKS = 160
+
+# Runs in a fresh interpreter so ru_maxrss measures this mastering run only; the encoders are
+# stubbed to drain the blocks, since only the Python side of the pipeline is under test
+CHILD = textwrap.dedent("""
+    import sys, json, resource
+    import numpy, scipy.signal
+    import audio_processor
+
+    def drain_blocks(blocks, sample_rate, channels, outputs, on_block=None):
+        for block in blocks:
+            if on_block is not None:
+                on_block(len(block))
+
+    audio_processor.encode_blocks = drain_blocks
+    template = {'template': 'Club Banger', 'eq_settings': {}}
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    loudness, exported = audio_processor.master_audio_stream(sys.argv[1], sys.argv[2], template)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'baseline_kb': baseline, 'peak_kb': peak, 'loudness': loudness}))
+""")
+
+# In-memory mastering of a decoded buffer, run block by block into one output buffer
+ARRAY_CHILD = textwrap.dedent("""
+    import sys, json, resource
+    import numpy, scipy.signal
+    import audio_processor
+
+    samples = numpy.random.default_rng(0).standard_normal((int(sys.argv[1]), 2), dtype=numpy.float32)
+    samples *= 0.3
+    template = {'template': 'Club Banger', 'eq_settings': {}}
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    mastered, loudness = audio_processor.master_audio_array(samples, 44100, template)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'baseline_kb': baseline, 'peak_kb': peak, 'loudness': loudness}))
+""")
+ARRAY_SECONDS = 5 * 60
+
+def _write_tone(path, seconds, chunk_seconds=60):
+    """Mono 16-bit WAV of a modulated tone with noise, written a minute at a time"""
+    rng = np.random.default_rng(0)
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        for start in range(0, seconds, chunk_seconds):
+            t = np.arange(start * SAMPLE_RATE, (start + chunk_seconds) * SAMPLE_RATE) / SAMPLE_RATE
+            tone = 0.3 * np.sin(2 * np.pi * 220 * t) * (0.6 + 0.4 * np.sin(2 * np.pi * 0.5 * t))
+            tone += 0.02 * rng.standard_normal(len(t))
+            wav.writeframes((np.clip(tone, -1, 1) * 32767).astype('<i2').tobytes())
+
+def test_sixty_minute_stream_stays_within_block_bound(tmp_path):
+    long_path = str(tmp_path / 'long.wav')
+    _write_tone(long_path, DURATION_SECONDS)
+
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    result = subprocess.run([sys.executable, '-c', CHILD, long_path, str(tmp_path / 'out.mp3')],
+                            capture_output=True, text=True, env=env, timeout=1800)
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+
+    grown_bytes = (report['peak_kb'] - report['baseline_kb']) * 1024
+    bound_bytes = MAX_WORKING_BLOCKS * STREAM_BLOCK_FRAMES * 4
+    assert grown_bytes <= bound_bytes, f'peak RSS grew {grown_bytes} bytes, bound {bound_bytes}'
+    assert report['loudness']['true_peak_dbtp'] <= -1.0 + 0.05
+
+def test_in_memory_master_adds_only_its_output_buffer():
+    frames = ARRAY_SECONDS * SAMPLE_RATE
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    result = subprocess.run([sys.executable, '-c', ARRAY_CHILD, str(frames)],
+                            capture_output=True, text=True, env=env, timeout=600)
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+
+    grown_bytes = (report['peak_kb'] - report['baseline_kb']) * 1024
+    bound_bytes = frames * 2 * 4 + MAX_WORKING_BLOCKS * STREAM_BLOCK_FRAMES * 4
+    assert grown_bytes <= bound_bytes, f'peak RSS grew {grown_bytes} bytes, bound {bound_bytes}'
+    assert report['loudness']['true_peak_dbtp'] <= -1.0 + 0.05
+
+@pytest.mark.parametrize('minutes, frames_known, streams', [(15, True, True), (3, True, False), (3, False, True)])
+def test_streaming_is_chosen_by_decoded_size(monkeypatch, minutes, frames_known, streams):
+    # A 15-minute 128 kbps MP3 is only ~14 MB on disk but decodes to ~320 MB of float32
+    info = {'duration': minutes * 60.0, 'channels': 2, 'sample_rate': SAMPLE_RATE, 'format': 'mp3',
+            'frames': minutes * 60 * SAMPLE_RATE if frames_known else None}
+    monkeypatch.setattr(audio_probe, 'probe_audio', lambda path: info)
+    assert should_stream('upload.mp3') is streams
+
+def test_unprobeable_upload_streams(monkeypatch):
+    monkeypatch.setattr(audio_probe, 'probe_audio', lambda path: None)
+    assert should_stream('upload.mp3') is True
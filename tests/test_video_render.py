@@ -0,0 +1,63 @@
+"""
+Music video renders run ffmpeg once per video: a single encode with the background cache off,
+and a stream-copy remux of the cached background on a cache hit.
+"""
+import os
+import subprocess
+import pytest
+import video_render
+import video_backgrounds
+
+@pytest.fixture
+def ffmpeg_calls(monkeypatch):
+    """Record every ffmpeg command instead of running it, writing a stand-in output file"""
+    calls = []
+
+    def fake_run(cmd, **kwargs):
+        calls.append(cmd)
+        with open(cmd[-1], 'wb') as f:
+            f.write(b'fake media')
+        return subprocess.CompletedProcess(cmd, 0, stdout='', stderr='')
+
+    monkeypatch.setattr(subprocess, 'run', fake_run)
+    return calls
+
+def _assert_single_faststart_output(cmd, output_path):
+    assert cmd[0] == 'ffmpeg'
+    assert cmd[-1] == output_path
+    assert cmd.count(output_path) == 1
+    assert cmd.count('-c:v') == 1
+    assert cmd[cmd.index('-movflags') + 1] == '+faststart'
+
+def test_render_without_cache_is_one_encode(tmp_path, monkeypatch, ffmpeg_calls):
+    monkeypatch.setattr(video_backgrounds, 'BACKGROUND_CACHE_MAX_BYTES', 0)
+    output_path = str(tmp_path / 'video.mp4')
+    audio_input = ['-i', str(tmp_path / 'song.mp3')]
+
+    video_render.render_video(output_path, 'cyberpunk', 30, audio_input)
+
+    assert len(ffmpeg_calls) == 1
+    cmd = ffmpeg_calls[0]
+    _assert_single_faststart_output(cmd, output_path)
+    assert cmd.count('-i') == 2
+    assert cmd[cmd.index('-c:v') + 1] == 'libx264'
+
+def test_cache_hit_is_one_stream_copy_mux(tmp_path, monkeypatch, ffmpeg_calls):
+    monkeypatch.setattr(video_backgrounds, 'BACKGROUND_CACHE_DIR', str(tmp_path / 'backgrounds'))
+    monkeypatch.setattr(video_backgrounds, 'BACKGROUND_CACHE_MAX_BYTES', 1024 * 1024)
+    audio_input = ['-i', str(tmp_path / 'song.mp3')]
+
+    # The first render of a style encodes its background into the cache
+    video_render.render_video(str(tmp_path / 'first.mp4'), 'cyberpunk', 30, audio_input)
+    ffmpeg_calls.clear()
+
+    output_path = str(tmp_path / 'second.mp4')
+    video_render.render_video(output_path, 'cyberpunk', 30, audio_input)
+
+    assert len(ffmpeg_calls) == 1
+    cmd = ffmpeg_calls[0]
+    _assert_single_faststart_output(cmd, output_path)
+    assert cmd[cmd.index('-c:v') + 1] == 'copy'
+    assert 'lavfi' not in cmd
+    # The job's link to the clip and the render lock are gone; only clips and headers remain
+    assert {os.path.splitext(name)[1] for name in os.listdir(tmp_path / 'backgrounds')} == {'.mp4', '.json'}
@@ -0,0 +1,169 @@
+"""
+Streaming ingestion for audio uploads.
+
+The multipart request body is parsed incrementally and the audio part is written
+straight to its final place in the upload folder in large chunks, instead of letting
+Werkzeug spool it to a temp file that file.save() then copies. While the bytes stream
+through, the SHA-256 is computed and the leading bytes are sniffed, so non-audio and
+oversized uploads are rejected before the rest of the body is written. Finished uploads
+are committed to the content-addressed blob store.
+"""
+import os
+import uuid
+import hashlib
+import logging
+from flask import request
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
+from app import app
+from audio_cache import remember_sha256
+from audio_probe import sniff_audio_format
+from blob_store import commit_blob
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_BYTES = 1024 * 1024
+
+# Text fields (track title, prompts) never need more than this
+MAX_FIELD_BYTES = 64 * 1024
+MAX_PARTS = 50
+
+class UploadRejected(Exception):
+    """An upload refused during ingestion; status_code is the HTTP status to answer with"""
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+class _AudioWriter:
+    """Writes one file part to disk, hashing and sniffing it on the way"""
+
+    def __init__(self, max_bytes):
+        self.tmp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}.part")
+        self.max_bytes = max_bytes
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = bytearray()
+        self.format = None
+        self.file = open(self.tmp_path, 'wb', buffering=READ_CHUNK_BYTES)
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            raise UploadRejected('File too large', 413)
+        if self.format is None:
+            self.head += data
+            self._sniff(complete=False)
+        self.digest.update(data)
+        self.file.write(data)
+
+    def _sniff(self, complete):
+        try:
+            self.format = sniff_audio_format(bytes(self.head), complete=complete)
+        except ValueError:
+            raise UploadRejected('File is not a supported audio file', 415)
+        if self.format is not None:
+            self.head = bytearray()
+
+    def finish(self):
+        """Commit the upload to the blob store; returns its stored filename and metadata"""
+        if self.format is None:
+            self._sniff(complete=True)
+        self.file.close()
+        content_hash = self.digest.hexdigest()
+        filename, deduplicated = commit_blob(self.tmp_path, content_hash, self.format)
+        path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        remember_sha256(path, content_hash)
+        return {
+            'filename': filename,
+            'path': path,
+            'sha256': content_hash,
+            'size': self.size,
+            'format': self.format,
+            'deduplicated': deduplicated
+        }
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+def ingest_audio_upload(file_fields, allowed_file):
+    """
+    Stream the current multipart request into the upload folder.
+    file_fields are the accepted names of the audio part; allowed_file checks its filename.
+    Returns (form, upload) where form holds the text fields and upload is a dict with
+    filename (the blob name), original_filename, path, sha256, size, format and
+    deduplicated. Raises UploadRejected.
+    """
+    max_bytes = app.config.get('MAX_CONTENT_LENGTH')
+    if max_bytes and request.content_length and request.content_length > max_bytes:
+        raise UploadRejected('File too large', 413)
+
+    mimetype, options = parse_options_header(request.headers.get('Content-Type', ''))
+    if mimetype != 'multipart/form-data' or 'boundary' not in options:
+        raise UploadRejected('No audio file provided')
+
+    decoder = MultipartDecoder(options['boundary'].encode('latin-1'), max_parts=MAX_PARTS)
+    form = {}
+    upload = None
+    writer = None
+    part = None
+    field_value = None
+
+    try:
+        while True:
+            chunk = request.stream.read(READ_CHUNK_BYTES)
+            decoder.receive_data(chunk or None)
+            event = decoder.next_event()
+            while not isinstance(event, (Epilogue, NeedData)):
+                if isinstance(event, Field):
+                    part, field_value = event, bytearray()
+                elif isinstance(event, File):
+                    part = event
+                    if event.name in file_fields and upload is None and writer is None:
+                        if not event.filename:
+                            raise UploadRejected('No file selected')
+                        if not allowed_file(event.filename):
+                            raise UploadRejected('Invalid file format. Supported formats: MP3, WAV, FLAC, M4A, AAC')
+                        writer = _AudioWriter(max_bytes)
+                        upload = {'original_filename': event.filename}
+                elif isinstance(event, Data):
+                    if isinstance(part, Field):
+                        field_value += event.data
+                        if len(field_value) > MAX_FIELD_BYTES:
+                            raise UploadRejected('Form field too large', 413)
+                        if not event.more_data:
+                            form[part.name] = field_value.decode('utf-8', 'replace')
+                    elif writer is not None and part.name in file_fields:
+                        writer.write(event.data)
+                        if not event.more_data:
+                            upload.update(writer.finish())
+                            writer = None
+                    # Data for any other file part is dropped
+                event = decoder.next_event()
+            if isinstance(event, Epilogue) or not chunk:
+                break
+    except UploadRejected:
+        if writer is not None:
+            writer.discard()
+        raise
+    except RequestEntityTooLarge:
+        if writer is not None:
+            writer.discard()
+        raise UploadRejected('File too large', 413)
+    except Exception as e:
+        if writer is not None:
+            writer.discard()
+        logger.error(f"Upload ingestion failed: {str(e)}")
+        raise UploadRejected('Upload could not be read')
+
+    if upload is None or 'path' not in upload:
+        if writer is not None:
+            writer.discard()
+        raise UploadRejected('No audio file provided')
+
+    logger.info(f"Ingested {upload['filename']} ({upload['size']} bytes, {upload['format']})")
+    return form, upload
@@ -0,0 +1,210 @@
+"""
+Cache of pre-rendered video backgrounds.
+
+The lavfi styles depend only on style, resolution and duration; the user's audio is the
+only per-job input. So each (style, resolution, duration) visual is encoded once, with the
+resolution's encoder profile, into a video-only MP4 in BACKGROUND_CACHE_DIR, and every job
+after that is a remux of the cached clip with its audio (-c:v copy). Entries are keyed by a
+hash of everything that shapes the pixels (style, size, duration, frame rate and encoder
+settings), so recalibrated presets or a changed style graph render fresh clips, and are
+evicted least-recently-used beyond BACKGROUND_CACHE_MAX_BYTES. Setting it to 0 turns the
+cache off and renders every video in a single pass.
+
+A job muxes from its own hard link to the clip (use_background), so another process evicting
+the clip mid-mux only drops the cache's name for it. Renders of one clip are serialized by a
+lock file that the renderer deletes when done; temp files and links left by killed jobs are
+swept up when the clip is rendered again and on every eviction pass.
+"""
+import os
+import json
+import time
+import fcntl
+import hashlib
+import threading
+import subprocess
+import logging
+from contextlib import contextmanager
+from audio_cache import evict_lru
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_CACHE_DIR = os.environ.get('BACKGROUND_CACHE_DIR', '.background_cache')
+BACKGROUND_CACHE_MAX_BYTES = int(os.environ.get('BACKGROUND_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+
+# Bump when a style's source or filters change so clips of the old look are no longer served
+BACKGROUND_CACHE_VERSION = 1
+
+BACKGROUND_SUFFIX = '.mp4'
+
+# Temp files, job links and lock files older than this belong to jobs that were killed (no
+# render runs this long)
+STALE_FILE_SECONDS = 6 * 60 * 60
+
+# Encoder settings that change the encoded pixels (threads only change speed)
+KEYED_PROFILE_FIELDS = ('width', 'height', 'source_size', 'preset', 'crf', 'gop_seconds', 'tune')
+
+def background_cache_enabled():
+    return BACKGROUND_CACHE_MAX_BYTES > 0
+
+def style_key(visual_style):
+    """The VIDEO_STYLES name a style renders as ('default' for unknown styles)"""
+    from video_render import VIDEO_STYLES
+    style = (visual_style or '').lower()
+    return style if style in VIDEO_STYLES else 'default'
+
+def background_path(visual_style, duration_seconds, profile):
+    """Cache path of a background clip: readable prefix plus a hash of everything it depends on"""
+    from video_render import VIDEO_FPS, style_graph
+    style = style_key(visual_style)
+    payload = json.dumps({
+        'version': BACKGROUND_CACHE_VERSION,
+        'graph': style_graph(style, profile['source_size'], VIDEO_FPS, (profile['width'], profile['height'])),
+        'duration': duration_seconds,
+        'fps': VIDEO_FPS,
+        'profile': {field: profile.get(field) for field in KEYED_PROFILE_FIELDS},
+    }, sort_keys=True)
+    digest = hashlib.sha256(payload.encode()).hexdigest()[:16]
+    name = f"{style}_{profile['resolution']}_{duration_seconds:g}s_{digest}{BACKGROUND_SUFFIX}"
+    return os.path.join(BACKGROUND_CACHE_DIR, name)
+
+def _header_path(clip_path):
+    return clip_path[:-len(BACKGROUND_SUFFIX)] + '.json'
+
+def lookup_background(clip_path):
+    """True if the clip is cached, marking it recently used"""
+    try:
+        # The header is published last, so its presence means the clip is complete
+        os.stat(_header_path(clip_path))
+        os.utime(clip_path)
+    except OSError:
+        return False
+    return True
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _sweep_stale_files(prefix=None):
+    """
+    Delete temp files, job links and lock files left behind by killed jobs: those of one clip
+    (prefix, its path; called under its render lock, so none are in use) or, without a prefix,
+    any in the cache older than STALE_FILE_SECONDS
+    """
+    cutoff = time.time() - STALE_FILE_SECONDS
+    for name in os.listdir(BACKGROUND_CACHE_DIR):
+        path = os.path.join(BACKGROUND_CACHE_DIR, name)
+        if prefix is not None:
+            stale = '.tmp' in name and (path.startswith(prefix + '.tmp')
+                                        or path.startswith(_header_path(prefix) + '.tmp'))
+        else:
+            stale = ('.tmp' in name or '.use' in name or name.endswith('.lock')) and not name.endswith(BACKGROUND_SUFFIX)
+            try:
+                stale = stale and os.path.getmtime(path) < cutoff
+            except OSError:
+                stale = False
+        if stale:
+            _remove_quietly(path)
+            logger.info(f"Removed stale background cache file {name}")
+
+def render_background(visual_style, duration_seconds, profile, clip_path):
+    """Encode a style's video-only clip into the cache (data first, header last)"""
+    from video_render import VIDEO_FPS, VideoRenderError, style_graph, encoder_args
+
+    source, video_filter = style_graph(visual_style, profile['source_size'], VIDEO_FPS,
+                                       (profile['width'], profile['height']))
+    tmp_path = clip_path + f'.tmp{os.getpid()}'
+    cmd = ['ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', source, '-vf', video_filter,
+           '-t', str(duration_seconds)] + encoder_args(profile) + ['-an', '-f', 'mp4', tmp_path]
+    try:
+        result = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True, text=True,
+                                timeout=profile['timeout'])
+    except subprocess.TimeoutExpired:
+        result = None
+    if result is None or result.returncode != 0 or not os.path.exists(tmp_path) or os.path.getsize(tmp_path) == 0:
+        _remove_quietly(tmp_path)
+        raise VideoRenderError('Video background render timed out' if result is None
+                               else f'FFmpeg failed: {result.stderr}')
+
+    header_tmp = _header_path(clip_path) + f'.tmp{os.getpid()}'
+    with open(header_tmp, 'w') as f:
+        json.dump({'style': style_key(visual_style), 'resolution': profile['resolution'],
+                   'duration': duration_seconds, 'preset': profile['preset'], 'crf': profile['crf']}, f)
+    os.replace(tmp_path, clip_path)
+    os.replace(header_tmp, _header_path(clip_path))
+    logger.info(f"Cached video background {os.path.basename(clip_path)} ({os.path.getsize(clip_path)} bytes)")
+    evict_lru(BACKGROUND_CACHE_DIR, BACKGROUND_CACHE_MAX_BYTES, data_suffix=BACKGROUND_SUFFIX)
+    _sweep_stale_files()
+
+def _lock_clip(lock_path):
+    """
+    Exclusively lock a clip's lock file. The holder deletes the file before unlocking, so a
+    waiter that wakes up holding a deleted file retries on the current one
+    """
+    while True:
+        lock = open(lock_path, 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.fstat(lock.fileno()).st_ino == os.stat(lock_path).st_ino:
+                return lock
+        except FileNotFoundError:
+            pass
+        lock.close()
+
+def get_background(visual_style, duration_seconds, profile):
+    """
+    Path of the cached background clip for a render, encoding it on a miss. Concurrent misses
+    for the same clip (from any process) wait on a lock file and reuse the first one's render.
+    """
+    clip_path = background_path(visual_style, duration_seconds, profile)
+    if lookup_background(clip_path):
+        return clip_path
+    os.makedirs(BACKGROUND_CACHE_DIR, exist_ok=True)
+    lock_path = clip_path + '.lock'
+    lock = _lock_clip(lock_path)
+    try:
+        if not lookup_background(clip_path):
+            # Any temp files of this clip are from a killed render; no one else can be writing them
+            _sweep_stale_files(prefix=clip_path)
+            render_background(visual_style, duration_seconds, profile, clip_path)
+    finally:
+        _remove_quietly(lock_path)
+        lock.close()
+    return clip_path
+
+@contextmanager
+def use_background(visual_style, duration_seconds, profile):
+    """
+    The cached background clip for a render (encoded on a miss), hard-linked to a path private
+    to this job for the duration of the block, so eviction can't remove it while it is read
+    """
+    for _ in range(3):
+        clip_path = get_background(visual_style, duration_seconds, profile)
+        link_path = clip_path + f'.use{os.getpid()}_{threading.get_ident()}'
+        _remove_quietly(link_path)
+        try:
+            os.link(clip_path, link_path)
+        except FileNotFoundError:
+            # Evicted between lookup and link: look it up (or render it) again
+            continue
+        try:
+            yield link_path
+        finally:
+            _remove_quietly(link_path)
+        return
+    raise OSError(f'Background clip {os.path.basename(clip_path)} was evicted repeatedly')
+
+def background_cache_usage():
+    """Entries, bytes used and the byte budget of the background cache"""
+    entries = 0
+    total = 0
+    if os.path.isdir(BACKGROUND_CACHE_DIR):
+        for name in os.listdir(BACKGROUND_CACHE_DIR):
+            if name.endswith(BACKGROUND_SUFFIX):
+                try:
+                    total += os.path.getsize(os.path.join(BACKGROUND_CACHE_DIR, name))
+                    entries += 1
+                except OSError:
+                    pass
+    return {'entries': entries, 'bytes': total, 'max_bytes': BACKGROUND_CACHE_MAX_BYTES}
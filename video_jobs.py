@@ -0,0 +1,139 @@
+"""
+Render queue for uploaded-audio music videos.
+
+/api/upload-video-audio queues a VideoGeneration (status 'queued') instead of encoding
+inside the request. Render threads in every web process claim jobs oldest first through
+job_queue, which only claims while fewer than VIDEO_RENDER_WORKERS renders are running
+across all processes, and each job renders in a media worker process. Bursts wait in the
+queue instead of starting one libx264 encode per request on the same cores; once
+VIDEO_QUEUE_LIMIT jobs are waiting, new uploads are refused with 429. Renders orphaned by a
+restart are picked up again. Queue position and an ETA from recent render times are
+reported by /api/video-job-status/<id>.
+"""
+import os
+import math
+import logging
+from datetime import datetime
+from app import app, db
+from models import VideoGeneration
+from job_queue import JobQueue
+from media_workers import MEDIA_JOB_CPU_SECONDS, MEDIA_JOB_WALL_SECONDS
+from video_render import ENCODER_PROFILES, encoder_profile
+from video_backgrounds import background_cache_enabled
+
+logger = logging.getLogger(__name__)
+
+# Duration choices in the video form, in seconds
+DURATION_SECONDS = {'15s': 15, '30s': 30, '1min': 60}
+
+# Render time assumed per second of video until renders of that length have been timed
+DEFAULT_RENDER_SECONDS_PER_SECOND = 1.0
+# Recent completed renders averaged for the ETA
+ETA_SAMPLE_JOBS = 20
+
+def duration_seconds_for(video_gen):
+    return DURATION_SECONDS.get(video_gen.duration, 15)
+
+def render_limits(profile):
+    """
+    (cpu_seconds, wall_seconds) for a render's media worker. ffmpeg's CPU time adds up over its
+    encoder threads (plus one for the source and filters), so large renders get a CPU cap to
+    match their thread count and ffmpeg timeout. With the background cache on, a miss runs the
+    background encode and then the mux, each under the profile's timeout, so both are covered
+    """
+    passes = 2 if background_cache_enabled() else 1
+    cpu_seconds = max(MEDIA_JOB_CPU_SECONDS,
+                      profile['timeout'] * (min(profile['threads'], os.cpu_count() or 1) + passes))
+    wall_seconds = max(MEDIA_JOB_WALL_SECONDS, profile['timeout'] * passes + 60)
+    return cpu_seconds, wall_seconds
+
+def run_claimed_jobs(job_ids):
+    run_video_job(job_ids[0])
+
+video_queue = JobQueue('video', VideoGeneration, run_claimed_jobs, 'VIDEO_RENDER_WORKERS',
+                       max_run_seconds=max(render_limits(encoder_profile(resolution, seconds))[1]
+                                           for resolution, seconds in ENCODER_PROFILES),
+                       running_limit_key='VIDEO_RENDER_WORKERS')
+queue_position = video_queue.queue_position
+start_workers = video_queue.start_workers
+
+def queue_full():
+    """True once VIDEO_QUEUE_LIMIT jobs are waiting; new renders should be refused"""
+    return VideoGeneration.query.filter_by(status='queued').count() >= app.config.get('VIDEO_QUEUE_LIMIT', 20)
+
+def enqueue_video_job(video_gen):
+    """Queue a render (committing it) and wake a worker"""
+    video_gen.status = 'queued'
+    video_gen.error_message = None
+    video_gen.queued_at = datetime.utcnow()
+    video_gen.started_at = None
+    video_gen.completed_at = None
+    db.session.commit()
+    video_queue.wake()
+
+def average_render_seconds(duration, resolution):
+    """Mean wall time of recent completed renders of this length and resolution"""
+    recent = VideoGeneration.query.filter(VideoGeneration.status == 'completed',
+                                          VideoGeneration.duration == duration,
+                                          VideoGeneration.resolution == resolution,
+                                          VideoGeneration.started_at.isnot(None)) \
+        .order_by(VideoGeneration.id.desc()).limit(ETA_SAMPLE_JOBS).all()
+    times = [video_gen.resource_usage['wall_seconds'] for video_gen in recent
+             if (video_gen.resource_usage or {}).get('wall_seconds')]
+    if not times:
+        return DEFAULT_RENDER_SECONDS_PER_SECOND * DURATION_SECONDS.get(duration, 15)
+    return sum(times) / len(times)
+
+def estimated_seconds_remaining(video_gen):
+    """
+    Rough seconds until a render finishes: the jobs ahead are shared among the workers, each
+    taking the recent average render time; None once the job has finished
+    """
+    average = average_render_seconds(video_gen.duration, video_gen.resolution)
+    if video_gen.status == 'running' and video_gen.started_at:
+        elapsed = (datetime.utcnow() - video_gen.started_at).total_seconds()
+        return round(max(average - elapsed, 0.0), 1)
+    position = queue_position(video_gen)
+    if position is None:
+        return None
+    workers = max(app.config.get('VIDEO_RENDER_WORKERS', 2), 1)
+    # Waves of renders ahead of this one (the running wave counts as one), then its own
+    return round((math.ceil(position / workers) + 1) * average, 1)
+
+def run_video_job(job_id):
+    """Render one claimed job and record the outcome"""
+    from openai_integration import create_demo_video_with_audio
+    from media_workers import run_isolated
+
+    video_gen = VideoGeneration.query.get(job_id)
+    audio_path = os.path.join(app.config['UPLOAD_FOLDER'], video_gen.audio_file)
+    duration_seconds = duration_seconds_for(video_gen)
+    profile = encoder_profile(video_gen.resolution, duration_seconds)
+    cpu_seconds, wall_seconds = render_limits(profile)
+    usage = {}
+    try:
+        # Rendered in a resource-limited child process; a killed render lands in the except below
+        video_filename = run_isolated(create_demo_video_with_audio, track_title=video_gen.track_title,
+                                      visual_style=video_gen.visual_style, duration_seconds=duration_seconds,
+                                      audio_file=audio_path, resolution=profile['resolution'],
+                                      usage=usage, cpu_seconds=cpu_seconds, wall_seconds=wall_seconds,
+                                      on_started=lambda: video_queue.mark_started([job_id]))
+        error_message = None
+    except Exception as e:
+        video_filename = None
+        error_message = str(e)
+
+    if video_filename:
+        values = {'status': 'completed', 'video_file': video_filename}
+    else:
+        values = {'status': 'failed', 'error_message': error_message or 'Video generation failed'}
+    values['completed_at'] = datetime.utcnow()
+    # Conditional on still running, so a job the reaper already failed keeps that outcome
+    finished = VideoGeneration.query.filter(VideoGeneration.id == job_id, VideoGeneration.status == 'running') \
+        .update(values, synchronize_session=False)
+    VideoGeneration.query.filter_by(id=job_id).update({'resource_usage': usage}, synchronize_session=False)
+    db.session.commit()
+    if not finished:
+        logger.warning(f"Video job {job_id} was no longer running; its {values['status']} outcome was dropped")
+    elif not video_filename:
+        logger.error(f"Video job {job_id} failed: {values['error_message']}")
@@ -0,0 +1,185 @@
+"""
+Music video renders.
+
+The visuals depend only on style, resolution and duration, so they come from a cached
+background clip (video_backgrounds) encoded once per combination; each job is then a single
+ffmpeg pass that copies that video stream (-c:v copy) and encodes only the job's audio to
+AAC, with -movflags +faststart so the MP4's index sits at the front and browsers start
+playback before the whole file has downloaded. With the cache off, each video is one
+ffmpeg invocation instead: the visual source (a lavfi generator per style), its colour
+filters and the audio chain as one filter graph, encoded once to H.264/AAC.
+
+The stored resolution picks an encoder profile (frame size, x264 preset, CRF, GOP length,
+threads, tune) from ENCODER_PROFILES, keyed by resolution and duration and chosen so the
+longest render of each resolution fits its RENDER_BUDGET_SECONDS. 4K renders the lavfi
+source at 1080p and scales it up, since generators like mandelbrot are single-threaded and
+far too slow at full size. calibrate_video.py measures encode speed on the host and writes
+presets into VIDEO_PROFILES_FILE, which overrides the table's defaults.
+"""
+import os
+import json
+import subprocess
+import logging
+
+logger = logging.getLogger(__name__)
+
+VIDEO_FPS = 25
+
+# Resolution choices in the video form -> frame size
+RESOLUTIONS = {'720p': (1280, 720), '1080p': (1920, 1080), '4K': (3840, 2160)}
+DEFAULT_RESOLUTION = '720p'
+
+# Wall time one render may take, per resolution; profiles are picked to fit it
+RENDER_BUDGET_SECONDS = {'720p': 90, '1080p': 180, '4K': 420}
+# ffmpeg is killed after this multiple of the budget
+RENDER_TIMEOUT_FACTOR = 1.5
+
+# (resolution, longest duration in seconds it covers) -> encoder settings. Longer and larger
+# renders trade quality for speed (faster preset, higher CRF); gop_seconds is the keyframe
+# interval, source_size the size the lavfi source is rendered at before scaling
+ENCODER_PROFILES = {
+    ('720p', 15): {'preset': 'medium', 'crf': 21, 'gop_seconds': 2, 'threads': 2, 'tune': 'animation'},
+    ('720p', 30): {'preset': 'fast', 'crf': 21, 'gop_seconds': 2, 'threads': 2, 'tune': 'animation'},
+    ('720p', 60): {'preset': 'faster', 'crf': 22, 'gop_seconds': 2, 'threads': 2, 'tune': 'animation'},
+    ('1080p', 15): {'preset': 'fast', 'crf': 21, 'gop_seconds': 2, 'threads': 4, 'tune': 'animation'},
+    ('1080p', 30): {'preset': 'faster', 'crf': 22, 'gop_seconds': 2, 'threads': 4, 'tune': 'animation'},
+    ('1080p', 60): {'preset': 'veryfast', 'crf': 22, 'gop_seconds': 2, 'threads': 4, 'tune': 'animation'},
+    ('4K', 15): {'preset': 'veryfast', 'crf': 23, 'gop_seconds': 2, 'threads': 8, 'tune': 'fastdecode',
+                 'source_size': (1920, 1080)},
+    ('4K', 30): {'preset': 'superfast', 'crf': 23, 'gop_seconds': 2, 'threads': 8, 'tune': 'fastdecode',
+                 'source_size': (1920, 1080)},
+    ('4K', 60): {'preset': 'ultrafast', 'crf': 24, 'gop_seconds': 2, 'threads': 8, 'tune': 'fastdecode',
+                 'source_size': (1920, 1080)},
+}
+
+# Presets chosen by calibrate_video.py, {"<resolution>/<seconds>": {"preset": ...}}
+VIDEO_PROFILES_FILE = os.environ.get('VIDEO_PROFILES_FILE', 'video_profiles.json')
+
+# Visual style -> (lavfi source, video filter chain); unknown styles use DEFAULT_VIDEO_STYLE
+VIDEO_STYLES = {
+    # Cyberpunk: Moving plasma with purple tint
+    'cyberpunk': ('mandelbrot=size={size}:rate={fps}:maxiter=100', 'colorchannelmixer=rr=0.3:gg=0.1:bb=0.8:aa=1'),
+    # Cinematic: Smooth flowing gradients with warm colors
+    'cinematic': ('rgbtestsrc=size={size}:rate={fps}', 'colorchannelmixer=rr=0.8:gg=0.5:bb=0.2:aa=1,hue=h=30:s=0.8'),
+    # Abstract: Color patterns with movement
+    'abstract': ('smptebars=size={size}:rate={fps}', 'colorchannelmixer=rr=0.9:gg=0.2:bb=0.8:aa=1,rotate=angle=PI*t/5'),
+    # Fantasy: Magical colors and gradients
+    'fantasy': ('gradients=size={size}:rate={fps}:c0=purple:c1=pink:c2=gold',
+                'colorchannelmixer=rr=0.9:gg=0.7:bb=0.9:aa=1,hue=h=60:s=1.2'),
+}
+# Default: Moving test source with blue tint
+DEFAULT_VIDEO_STYLE = ('testsrc=size={size}:rate={fps}', 'colorchannelmixer=rr=0.2:gg=0.4:bb=0.9:aa=1')
+
+AUDIO_CODEC_ARGS = ['-c:a', 'aac', '-b:a', '192k']
+
+class VideoRenderError(Exception):
+    """ffmpeg failed or timed out rendering a video"""
+
+def _load_calibrated_presets():
+    """Presets from VIDEO_PROFILES_FILE, keyed like ENCODER_PROFILES; empty if not calibrated"""
+    try:
+        with open(VIDEO_PROFILES_FILE) as f:
+            calibrated = json.load(f).get('profiles', {})
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable {VIDEO_PROFILES_FILE}: {str(e)}")
+        return {}
+    presets = {}
+    for key, settings in calibrated.items():
+        resolution, _, seconds = key.partition('/')
+        if (resolution, int(seconds or 0)) in ENCODER_PROFILES:
+            presets[(resolution, int(seconds))] = settings
+    return presets
+
+_calibrated_presets = _load_calibrated_presets()
+
+def encoder_profile(resolution, duration_seconds):
+    """
+    Encoder settings for a render: the profile of the shortest duration tier covering
+    duration_seconds (the longest tier beyond that), with calibrated presets applied and
+    width, height, source_size and timeout filled in. Unknown resolutions use DEFAULT_RESOLUTION.
+    """
+    if resolution not in RESOLUTIONS:
+        resolution = DEFAULT_RESOLUTION
+    tiers = sorted(seconds for res, seconds in ENCODER_PROFILES if res == resolution)
+    tier = next((seconds for seconds in tiers if duration_seconds <= seconds), tiers[-1])
+    profile = dict(ENCODER_PROFILES[(resolution, tier)])
+    profile.update(_calibrated_presets.get((resolution, tier), {}))
+    profile['width'], profile['height'] = RESOLUTIONS[resolution]
+    profile.setdefault('source_size', RESOLUTIONS[resolution])
+    profile['resolution'] = resolution
+    profile['timeout'] = int(RENDER_BUDGET_SECONDS[resolution] * RENDER_TIMEOUT_FACTOR)
+    return profile
+
+def encoder_args(profile, fps=VIDEO_FPS):
+    """libx264 output options for a profile; threads are capped at the host's cores"""
+    threads = min(profile['threads'], os.cpu_count() or 1)
+    args = ['-c:v', 'libx264', '-preset', profile['preset'], '-crf', str(profile['crf']),
+            '-g', str(int(profile['gop_seconds'] * fps)), '-threads', str(threads)]
+    if profile.get('tune'):
+        args += ['-tune', profile['tune']]
+    return args + ['-pix_fmt', 'yuv420p']
+
+def style_graph(visual_style, size=RESOLUTIONS[DEFAULT_RESOLUTION], fps=VIDEO_FPS, output_size=None):
+    """
+    (lavfi source, video filter chain) for a visual style, the source rendered at size and
+    scaled to output_size when that differs
+    """
+    source, video_filter = VIDEO_STYLES.get((visual_style or '').lower(), DEFAULT_VIDEO_STYLE)
+    if output_size and tuple(output_size) != tuple(size):
+        video_filter += f',scale={output_size[0]}:{output_size[1]}:flags=bicubic'
+    return source.format(size=f'{size[0]}x{size[1]}', fps=fps), video_filter
+
+def build_render_command(output_path, visual_style, duration_seconds, audio_input, audio_filter=None,
+                         profile=None):
+    """
+    The ffmpeg argument list for one render: input 0 is the style's visual source, input 1 the
+    audio (audio_input holds its input options and -i), joined in one filter graph and encoded once
+    """
+    profile = profile or encoder_profile(DEFAULT_RESOLUTION, duration_seconds)
+    source, video_filter = style_graph(visual_style, profile['source_size'], VIDEO_FPS,
+                                       (profile['width'], profile['height']))
+    graph = f'[0:v]{video_filter}[v];[1:a]{audio_filter or "anull"}[a]'
+    return ['ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', source] + audio_input + [
+        '-filter_complex', graph, '-map', '[v]', '-map', '[a]',
+    ] + encoder_args(profile) + AUDIO_CODEC_ARGS + [
+        '-movflags', '+faststart', '-t', str(duration_seconds), '-shortest', output_path
+    ]
+
+def build_mux_command(output_path, background_path, duration_seconds, audio_input, audio_filter=None):
+    """
+    The ffmpeg argument list muxing a cached background clip (input 0, stream-copied) with
+    the audio (input 1, filtered and encoded)
+    """
+    return ['ffmpeg', '-y', '-v', 'error', '-i', background_path] + audio_input + [
+        '-map', '0:v', '-map', '1:a', '-af', audio_filter or 'anull', '-c:v', 'copy',
+    ] + AUDIO_CODEC_ARGS + [
+        '-movflags', '+faststart', '-t', str(duration_seconds), '-shortest', output_path
+    ]
+
+def render_video(output_path, visual_style, duration_seconds, audio_input, audio_filter=None,
+                 resolution=DEFAULT_RESOLUTION):
+    """
+    Render a styled video over an audio input at the resolution's encoder profile: a remux
+    of the cached background clip, or a single full encode with the cache off; returns output_path
+    """
+    from video_backgrounds import background_cache_enabled, use_background
+
+    profile = encoder_profile(resolution, duration_seconds)
+    if background_cache_enabled():
+        with use_background(visual_style, duration_seconds, profile) as background:
+            _run_ffmpeg(build_mux_command(output_path, background, duration_seconds, audio_input, audio_filter),
+                        output_path, profile['timeout'])
+    else:
+        _run_ffmpeg(build_render_command(output_path, visual_style, duration_seconds, audio_input, audio_filter,
+                                         profile), output_path, profile['timeout'])
+    return output_path
+
+def _run_ffmpeg(cmd, output_path, timeout):
+    try:
+        result = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise VideoRenderError('Video generation timed out')
+    if result.returncode != 0 or not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        raise VideoRenderError(f'FFmpeg failed: {result.stderr}')
@@ -0,0 +1,148 @@
+"""
+Waveform peak sidecars.
+
+Min/max peaks are computed with NumPy at several resolutions (PEAK_RESOLUTIONS buckets
+across the whole track) and stored next to the audio as <file>.peaks, so the browser can
+draw a waveform from a few KB instead of downloading the track.
+
+Sidecar layout (little-endian): a '<4sBBHIQ' header (magic b'WPK1', bits per value,
+number of levels, reserved, sample rate, frame count), one uint32 bucket count per level,
+then for each level its buckets as interleaved (min, max) int8 or int16 values.
+"""
+import os
+import struct
+import threading
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PEAK_RESOLUTIONS = (256, 1024, 4096)
+
+# Peaks are first reduced to fixed chunks while streaming, then to each resolution at the end
+CHUNK_FRAMES = 256
+
+PEAKS_MAGIC = b'WPK1'
+PEAKS_HEADER = struct.Struct('<4sBBHIQ')
+PEAKS_SUFFIX = '.peaks'
+
+class PeakAccumulator:
+    """Streaming min/max reduction of (frames, channels) float blocks, mixed across channels"""
+
+    def __init__(self):
+        self.mins = []
+        self.maxs = []
+        self.carry_min = np.zeros(0, dtype=np.float32)
+        self.carry_max = np.zeros(0, dtype=np.float32)
+        self.frames = 0
+
+    def process(self, block):
+        self.frames += len(block)
+        block_min = np.concatenate([self.carry_min, block.min(axis=1)])
+        block_max = np.concatenate([self.carry_max, block.max(axis=1)])
+        full = len(block_min) // CHUNK_FRAMES * CHUNK_FRAMES
+        if full:
+            self.mins.append(block_min[:full].reshape(-1, CHUNK_FRAMES).min(axis=1))
+            self.maxs.append(block_max[:full].reshape(-1, CHUNK_FRAMES).max(axis=1))
+        self.carry_min, self.carry_max = block_min[full:], block_max[full:]
+
+    def tap(self, blocks):
+        """Pass blocks through unchanged while accumulating their peaks"""
+        for block in blocks:
+            self.process(block)
+            yield block
+
+    def levels(self, resolutions=PEAK_RESOLUTIONS):
+        """[(mins, maxs)] per resolution; short tracks get at most one bucket per chunk"""
+        mins = self.mins + ([self.carry_min.min(keepdims=True)] if len(self.carry_min) else [])
+        maxs = self.maxs + ([self.carry_max.max(keepdims=True)] if len(self.carry_max) else [])
+        if not mins:
+            return [(np.zeros(0), np.zeros(0)) for _ in resolutions]
+        mins, maxs = np.concatenate(mins), np.concatenate(maxs)
+
+        levels = []
+        for buckets in resolutions:
+            buckets = min(buckets, len(mins))
+            starts = np.linspace(0, len(mins), buckets + 1).astype(np.int64)[:-1]
+            levels.append((np.minimum.reduceat(mins, starts), np.maximum.reduceat(maxs, starts)))
+        return levels
+
+def peaks_path(audio_path):
+    return audio_path + PEAKS_SUFFIX
+
+def write_peaks(sidecar_path, accumulator, sample_rate, bits=8):
+    """Write an accumulator's levels as a sidecar (atomically, so readers never see a partial file)"""
+    levels = accumulator.levels()
+    dtype, scale = ('<i1', 127) if bits == 8 else ('<i2', 32767)
+
+    tmp_path = f'{sidecar_path}.tmp{os.getpid()}_{threading.get_ident()}'
+    with open(tmp_path, 'wb') as f:
+        f.write(PEAKS_HEADER.pack(PEAKS_MAGIC, bits, len(levels), 0, sample_rate, accumulator.frames))
+        f.write(np.array([len(mins) for mins, _ in levels], dtype='<u4').tobytes())
+        for mins, maxs in levels:
+            pairs = np.empty((len(mins), 2), dtype=dtype)
+            pairs[:, 0] = np.clip(np.round(mins * scale), -scale, scale)
+            pairs[:, 1] = np.clip(np.round(maxs * scale), -scale, scale)
+            f.write(pairs.tobytes())
+    os.replace(tmp_path, sidecar_path)
+    return sidecar_path
+
+def compute_peaks(audio_path, cache_decode=True):
+    """
+    Decode a file and write its peaks sidecar. Uploads are decoded through the PCM cache (their
+    renders reuse it); with cache_decode False (derived files such as renders) they are streamed
+    straight from the file instead.
+    """
+    from audio_processor import load_decoded_audio, probe_stream_format, iter_audio_blocks, _array_blocks, \
+        STREAM_BLOCK_FRAMES
+
+    decoded = load_decoded_audio(audio_path) if cache_decode else None
+    if decoded is not None:
+        pcm, sample_rate = decoded
+        blocks = _array_blocks(pcm, STREAM_BLOCK_FRAMES)
+    else:
+        sample_rate, channels, _ = probe_stream_format(audio_path)
+        blocks = iter_audio_blocks(audio_path, channels)
+
+    accumulator = PeakAccumulator()
+    for block in blocks:
+        accumulator.process(block)
+    return write_peaks(peaks_path(audio_path), accumulator, sample_rate)
+
+def ensure_peaks(audio_path, cache_decode=True):
+    """
+    Path of an audio file's peaks sidecar, computing it in a media worker if needed; None if the
+    audio can't be read
+    """
+    from media_workers import run_isolated
+
+    sidecar_path = peaks_path(audio_path)
+    if os.path.exists(sidecar_path):
+        return sidecar_path
+    try:
+        return run_isolated(compute_peaks, audio_path, cache_decode)
+    except Exception as e:
+        logger.error(f"Error computing peaks for {os.path.basename(audio_path)}: {str(e)}")
+        return None
+
+# Sidecars being computed by this process, so repeated requests don't start duplicate workers
+_pending = set()
+_pending_lock = threading.Lock()
+
+def _peaks_in_worker(audio_path, cache_decode):
+    try:
+        ensure_peaks(audio_path, cache_decode)
+    finally:
+        with _pending_lock:
+            _pending.discard(audio_path)
+
+def compute_peaks_in_background(audio_path, cache_decode=True):
+    """Compute a sidecar off the request thread, in a media worker, unless it exists or is underway"""
+    if os.path.exists(peaks_path(audio_path)):
+        return
+    with _pending_lock:
+        if audio_path in _pending:
+            return
+        _pending.add(audio_path)
+    threading.Thread(target=_peaks_in_worker, args=(audio_path, cache_decode), name="waveform-peaks",
+                     daemon=True).start()